@@ -75,6 +75,7 @@ def main():
             return authenticate()
 
     init_db(server.config['database_uri'])
+    server.start_workers()
 
     if 'key_file' in server.config and 'cert_file' in server.config:
         import ssl
@@ -33,11 +33,64 @@ from opencenter.db import exceptions
 from opencenter.db import inmemory
 
 import opencenter.webapp.ast
+from opencenter.webapp import metrics
 # from opencenter.webapp.ast import FilterBuilder, FilterTokenizer
 
 
 LOG = logging.getLogger(__name__)
 
+# most values bound into one sql IN clause; older sqlite builds
+# refuse more than 999 variables in a statement
+in_clause_size = 500
+
+
+def select_fields(obj, fields):
+    """
+    Trim a jsonified object down to the top level fields listed in
+    fields.  A fields of None means all of them.
+    """
+    if fields is None:
+        return obj
+
+    return dict([(k, v) for k, v in obj.items() if k in fields])
+
+
+def _equality_terms(root):
+    """
+    Collect the field = literal terms a filter expression requires,
+    as {field: value}.  These are the terms of root, if it is one, or
+    of the top level "and"s.  Anything else is left for the caller to
+    evaluate.
+    """
+    if root.negate:
+        return {}
+
+    if root.op == 'AND':
+        terms = _equality_terms(root.lhs)
+        for field, value in _equality_terms(root.rhs).items():
+            if terms.get(field, value) != value:
+                # contradictory, so let the filter find nothing
+                return {}
+            terms[field] = value
+        return terms
+
+    if root.op != '=':
+        return {}
+
+    identifier, literal = root.lhs, root.rhs
+    if identifier.op != 'IDENTIFIER':
+        identifier, literal = literal, identifier
+
+    if identifier.op != 'IDENTIFIER' or '.' in identifier.lhs or \
+            '{' in identifier.lhs:
+        return {}
+
+    if literal.op == 'NUMBER':
+        return {identifier.lhs: int(literal.lhs)}
+    if literal.op == 'STRING' and not '{' in literal.lhs:
+        return {identifier.lhs: str(literal.lhs)}
+    return {}
+
 
 class DbAbstraction(object):
     def __init__(self, api, model, name):
@@ -53,9 +106,62 @@ class DbAbstraction(object):
     def get_columns(self):
         raise NotImplementedError
 
-    def get_all(self):
+    def get_all(self, fields=None):
         raise NotImplementedError
 
+    def get_many(self, ids, fields=None):
+        """
+        Get the objects with the given ids, in the order asked for.
+        Ids that don't exist are skipped.
+        """
+        result = []
+        for id in ids:
+            try:
+                obj = self.get(id, fields=fields)
+            except exceptions.IdNotFound:
+                continue
+            if obj is not None:
+                result.append(obj)
+        return result
+
+    def _check_sort(self, sort):
+        synthesized = getattr(self.model, '_synthesized_fields', [])
+        if not sort in self.get_columns() or sort in synthesized:
+            raise ValueError('cannot sort on %s' % sort)
+
+    def get_page(self, limit=None, sort='id', descending=False,
+                 after=None, fields=None):
+        """
+        Get up to limit objects, ordered by sort and then id.  Objects
+        with no value for sort come after the rest (before, if
+        descending).
+
+        Arguments:
+        after -- the (sort value, id) of the last object of the
+                 previous page, as a cursor
+
+        Raises:
+        ValueError -- on a field that can't be sorted on
+        """
+        self._check_sort(sort)
+
+        def key(obj):
+            return (obj.get(sort) is None, obj.get(sort), obj['id'])
+
+        objects = sorted(self.get_all(), key=key, reverse=descending)
+
+        if after is not None:
+            last = (after[0] is None, after[0], after[1])
+            if descending:
+                objects = [x for x in objects if key(x) < last]
+            else:
+                objects = [x for x in objects if key(x) > last]
+
+        if limit is not None:
+            objects = objects[:limit]
+
+        return [select_fields(x, fields) for x in objects]
+
     def get_schema(self):
         raise NotImplementedError
 
@@ -65,7 +171,7 @@ class DbAbstraction(object):
     def delete(self, id):
         raise NotImplementedError
 
-    def get(self, id):
+    def get(self, id, fields=None):
         raise NotImplementedError
 
     def query(self, query):
@@ -84,19 +190,140 @@ class DbAbstraction(object):
                 if root.rhs.op == 'NUMBER' or root.rhs.op == 'STRING':
                     return [self.get(int(root.rhs.lhs))]
 
+        # equality terms on plain columns can use the database's
+        # indexes to narrow things down before evaluating the rest
+        terms = _equality_terms(root)
+        if terms:
+            candidates = self.get_by_fields(terms)
+            if candidates is not None:
+                metrics.incr('filter_evaluations', len(candidates))
+                return [x for x in candidates
+                        if root.eval_node(x, builder.functions, builder.ns)]
+
         # not a straight get_by_id
         result = builder.filter()
         return result
 
+    def get_by_fields(self, terms):
+        """
+        Get the objects whose fields equal the values in terms, a
+        dict of {field: value}, or None if this backend can't look
+        them up any faster than a filter scan would.
+        """
+        return None
+
+    def get_by_field_values(self, field, values):
+        """
+        Get the objects whose field is any of values, by id.
+        """
+        values = set(values)
+        return sorted([x for x in self.get_all() if x.get(field) in values],
+                      key=lambda x: x['id'])
+
     def update(self, id, data):
         raise NotImplementedError
 
+    def update_many(self, ids, data):
+        """
+        apply the same update to each object in ids, returning the
+        updated objects.  Ids that don't exist are skipped.
+        """
+        result = []
+        for id in ids:
+            try:
+                result.append(self.update(id, data))
+            except exceptions.IdNotFound:
+                continue
+        return result
+
+    def create_with_keys(self, data, keys):
+        """
+        create a node along with its key/value children, where keys
+        is {model: {key: value}}, e.g. {'facts': {'backends': [...]}}.
+        Returns the created node.
+        """
+        obj = self.create(data)
+        self.update_keys(obj['id'], keys)
+        return self.get(obj['id'])
+
+    def update_keys(self, id, keys):
+        """
+        set key/value children of node id, where keys is
+        {model: {key: value}}, creating any that don't exist.
+        """
+        id = self._validate_id_format(id)
+        for model, values in keys.items():
+            for key, value in values.items():
+                self.api._model_create(model, {'node_id': id,
+                                               'key': key,
+                                               'value': value})
+
     def first_by_query(self, query):
         result = self.query(query)
         if len(result):
             return result[0]
         return None
 
+    def delete_by_query(self, query, limit=None):
+        """
+        delete objects matching a filter language query, returning
+        the number of objects deleted.  If limit is specified, no
+        more than limit objects will be deleted.
+        """
+        matches = self.query(query)
+        if limit is not None:
+            matches = matches[:limit]
+
+        for obj in matches:
+            self.delete(obj['id'])
+
+        return len(matches)
+
+    def move_by_query(self, query, target, limit=None, values=None):
+        """
+        move objects matching a filter language query into the
+        target model, returning the number of objects moved.  Fields
+        in values are set on the moved objects.
+        """
+        matches = self.query(query)
+        if limit is not None:
+            matches = matches[:limit]
+
+        for obj in matches:
+            new_obj = copy.deepcopy(obj)
+            if values is not None:
+                new_obj.update(values)
+            self.api._model_create(target, new_obj)
+            self.delete(obj['id'])
+
+        return len(matches)
+
+    def set_key_values(self, key, values, journal_as=None):
+        """
+        set key to value on each node in values, a dict of
+        {node_id: value}, for key/value models like attrs and facts.
+        Nodes that no longer exist are skipped.  journal_as names
+        the model the change journal records the writes under.
+
+        Returns:
+        list of (object id, node id) for the objects written
+        """
+        result = []
+        for node_id, value in values.items():
+            try:
+                existing = self.first_by_query(
+                    'node_id=%d and key="%s"' % (int(node_id), key))
+                if existing is None:
+                    obj = self.create({'node_id': node_id,
+                                       'key': key,
+                                       'value': value})
+                else:
+                    obj = self.update(existing['id'], {'value': value})
+            except exceptions.IdNotFound:
+                continue
+            result.append((obj['id'], int(node_id)))
+        return result
+
     # README(shep): this is not being called anywhere
     #def _coerce_data(self, data):
     #    schema = self.get_schema()
@@ -184,8 +411,90 @@ class SqlAlchemyAbstraction(DbAbstraction):
 
         return field_list
 
-    def get_all(self):
-        return [x.jsonify(api=self.api) for x in self.model.query.all()]
+    def get_all(self, fields=None):
+        return [x.jsonify(api=self.api, fields=fields)
+                for x in self.model.query.all()]
+
+    def get_many(self, ids, fields=None):
+        ids = [self._validate_id_format(x) for x in ids]
+        if not ids:
+            return []
+
+        found = {}
+        for start in xrange(0, len(ids), in_clause_size):
+            chunk = ids[start:start + in_clause_size]
+            found.update([(x.id, x) for x in
+                          self.model.query.filter(self.model.id.in_(chunk))])
+        return [found[x].jsonify(api=self.api, fields=fields)
+                for x in ids if x in found]
+
+    def get_by_fields(self, terms):
+        table = self.model.__table__
+        for field, value in terms.items():
+            if not field in table.columns:
+                return None
+
+            # only where sql equality means what the filter's does
+            column_type = table.columns[field].type
+            if isinstance(value, int) and \
+                    not isinstance(column_type, sqlalchemy.Integer):
+                return None
+            if isinstance(value, basestring) and \
+                    not isinstance(column_type, sqlalchemy.String):
+                return None
+
+        query = self.model.query.filter_by(**terms).order_by(self.model.id)
+        return [x.jsonify(api=self.api) for x in query]
+
+    def get_by_field_values(self, field, values):
+        column = self.model.__table__.columns[field]
+        values = sorted(set(values))
+
+        result = []
+        for start in xrange(0, len(values), in_clause_size):
+            chunk = values[start:start + in_clause_size]
+            result += [x.jsonify(api=self.api) for x in
+                       self.model.query.filter(column.in_(chunk))]
+        return sorted(result, key=lambda x: x['id'])
+
+    def get_page(self, limit=None, sort='id', descending=False,
+                 after=None, fields=None):
+        self._check_sort(sort)
+
+        column = getattr(self.model, sort)
+        id_column = self.model.id
+        is_null = column == sqlalchemy.null()
+
+        if descending:
+            query = self.model.query.order_by(
+                is_null.desc(), column.desc(), id_column.desc())
+        else:
+            query = self.model.query.order_by(is_null, column, id_column)
+
+        if after is not None:
+            value, last_id = after
+            if descending and value is None:
+                query = query.filter(sqlalchemy.or_(
+                    column != sqlalchemy.null(),
+                    sqlalchemy.and_(is_null, id_column < last_id)))
+            elif descending:
+                query = query.filter(sqlalchemy.and_(
+                    column != sqlalchemy.null(),
+                    sqlalchemy.or_(column < value,
+                                   sqlalchemy.and_(column == value,
+                                                   id_column < last_id))))
+            elif value is None:
+                query = query.filter(sqlalchemy.and_(is_null,
+                                                     id_column > last_id))
+            else:
+                query = query.filter(sqlalchemy.or_(
+                    is_null, column > value,
+                    sqlalchemy.and_(column == value, id_column > last_id)))
+
+        if limit is not None:
+            query = query.limit(limit)
+
+        return [x.jsonify(api=self.api, fields=fields) for x in query]
 
     def get_schema(self):
         obj = self.model
@@ -278,7 +587,7 @@ class SqlAlchemyAbstraction(DbAbstraction):
             msg = e.msg
             raise RuntimeError(msg)
 
-    def get(self, id):
+    def get(self, id, fields=None):
         id = self._validate_id_format(id)
         r = self.model.query.filter_by(id=id).first()
 
@@ -286,7 +595,7 @@ class SqlAlchemyAbstraction(DbAbstraction):
             msg = '%s id %d does not exist' % (self.name.title(), id)
             raise exceptions.IdNotFound(message=msg)
 
-        return r.jsonify(api=self.api)
+        return r.jsonify(api=self.api, fields=fields)
 
     def update(self, id, data):
         id = self._validate_id_format(id)
@@ -309,6 +618,29 @@ class SqlAlchemyAbstraction(DbAbstraction):
             session.rollback()
             raise
 
+    def update_many(self, ids, data):
+        """
+        update the objects in ids in a single transaction
+        """
+        ids = [self._validate_id_format(x) for x in ids]
+        if not ids:
+            return []
+
+        new_data = self._sanitize_for_update(data)
+        found = dict([(x.id, x) for x in
+                      self.model.query.filter(self.model.id.in_(ids))])
+
+        try:
+            for r in found.values():
+                for field in new_data:
+                    r.__setattr__(field, new_data[field])
+            session.commit()
+        except:
+            session.rollback()
+            raise
+
+        return [found[x].jsonify(api=self.api) for x in ids if x in found]
+
     def _ast_to_sqlalchemy(self, ast):
         if ast.op == 'AND':
             return sqlalchemy.and_(self._ast_to_sqlalchemy(ast.lhs),
@@ -318,12 +650,242 @@ class SqlAlchemyAbstraction(DbAbstraction):
             return sqlalchemy.or_(self._ast_to_sqlalchemy(ast.lhs),
                                   self._ast_to_sqlalchemy(ast.rhs))
 
-        if ast.op == '=' and ast.lhs.op == 'IDENTIFIER' and ast.rhs.op in \
-                ['STRING', 'NUMBER']:
-            return self.model.__table__.columns[ast.lhs.lhs] == ast.rhs.lhs
+        if ast.op in ['=', '<', '>', '<=', '>='] and not ast.negate and \
+                ast.lhs.op == 'IDENTIFIER' and \
+                ast.lhs.lhs in self.model.__table__.columns and \
+                ast.rhs.op in ['STRING', 'NUMBER']:
+            column = self.model.__table__.columns[ast.lhs.lhs]
+            value = ast.rhs.lhs
+
+            # the filter evaluator finds no order between values of
+            # different types, where sql would coerce one of them, so
+            # only like types are compared in sql.  NULLs (missing
+            # values) match neither way.
+            if ast.op != '=' and not (
+                    (isinstance(value, int) and
+                     isinstance(column.type, sqlalchemy.Integer)) or
+                    (isinstance(value, basestring) and
+                     isinstance(column.type, sqlalchemy.String))):
+                raise ValueError('Cannot convert to sqlalchemy query')
+
+            if ast.op == '=':
+                return column == value
+            if ast.op == '<':
+                return column < value
+            if ast.op == '>':
+                return column > value
+            if ast.op == '<=':
+                return column <= value
+            return column >= value
 
         raise ValueError('Cannot convert to sqlalchemy query')
 
+    def _sql_filter_from_query(self, query):
+        full_query = '%s: %s' % (self.name, query)
+        builder = opencenter.webapp.ast.FilterBuilder(
+            opencenter.webapp.ast.FilterTokenizer(),
+            full_query, api=self.api)
+
+        return self._ast_to_sqlalchemy(builder.build())
+
+    def delete_by_query(self, query, limit=None):
+        """
+        set-based delete of rows matching query.  Queries that
+        cannot be expressed natively in sql fall back to the
+        (much slower) object-at-a-time delete.
+        """
+        try:
+            sql_filter = self._sql_filter_from_query(query)
+        except ValueError:
+            self.logger.error('could not convert %s to native sql' % (query))
+            return super(SqlAlchemyAbstraction, self).delete_by_query(
+                query, limit)
+
+        id_query = session.query(self.model.id).filter(sql_filter)
+        if limit is not None:
+            id_query = id_query.limit(limit)
+
+        ids = [x[0] for x in id_query]
+        if len(ids) == 0:
+            return 0
+
+        # bulk deletes skip the flush, so journal them by hand
+        from opencenter.db import models
+
+        try:
+            self.model.query.filter(self.model.id.in_(ids)).delete(
+                synchronize_session=False)
+            models.journal_changes(session, self.model.__tablename__, ids)
+            session.commit()
+        except:
+            session.rollback()
+            raise
+
+        return len(ids)
+
+    def move_by_query(self, query, target, limit=None, values=None):
+        """
+        set-based move of rows matching query into the table backing
+        the target model.  Rows are copied and deleted in a single
+        transaction, and keep their ids.
+        """
+        try:
+            sql_filter = self._sql_filter_from_query(query)
+        except ValueError:
+            self.logger.error('could not convert %s to native sql' % (query))
+            return super(SqlAlchemyAbstraction, self).move_by_query(
+                query, target, limit, values)
+
+        target_table = self.api.model_list[target].model.__table__
+        source_columns = self.model.__table__.columns
+        columns = [x for x in source_columns.keys()
+                   if x in target_table.columns]
+
+        row_query = session.query(
+            *[source_columns[x] for x in columns]).filter(
+                sql_filter).order_by(source_columns['id'])
+        if limit is not None:
+            row_query = row_query.limit(limit)
+
+        rows = []
+        for row in row_query:
+            new_row = dict(zip(columns, row))
+            if values is not None:
+                new_row.update(values)
+            rows.append(new_row)
+
+        if len(rows) == 0:
+            return 0
+
+        ids = [x['id'] for x in rows]
+
+        # bulk deletes skip the flush, so journal them by hand
+        from opencenter.db import models
+
+        try:
+            session.execute(target_table.insert(), rows)
+            self.model.query.filter(self.model.id.in_(ids)).delete(
+                synchronize_session=False)
+            node_ids = [x.get('node_id') for x in rows]
+            models.journal_changes(session, self.model.__tablename__, ids,
+                                   node_ids)
+            models.journal_changes(session, target_table.name, ids,
+                                   node_ids)
+            session.commit()
+        except:
+            session.rollback()
+            raise
+
+        return len(rows)
+
+    def _add_keys(self, id, keys):
+        for model, values in keys.items():
+            child = self.api.model_list[model].model
+            existing = dict([(x.key, x) for x in child.query.filter(
+                child.node_id == id).filter(child.key.in_(values.keys()))])
+
+            for key, value in values.items():
+                if key in existing:
+                    existing[key].value = value
+                else:
+                    session.add(child(id, key, value))
+
+    def create_with_keys(self, data, keys):
+        """
+        single transaction version of DbAbstraction.create_with_keys
+        """
+        r = self.model(**self._sanitize_for_create(data))
+        session.add(r)
+
+        try:
+            # for the id
+            session.flush()
+            self._add_keys(r.id, keys)
+            session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            session.rollback()
+            msg = "Unable to create %s, duplicate entry" % (self.name.title())
+            raise exceptions.CreateError(msg)
+
+        return r.jsonify(api=self.api)
+
+    def update_keys(self, id, keys):
+        """
+        single transaction version of DbAbstraction.update_keys
+        """
+        id = self._validate_id_format(id)
+        if self.model.query.filter_by(id=id).first() is None:
+            raise exceptions.IdNotFound(
+                message='%s id %s does not exist' % (self.name.title(), id))
+
+        try:
+            self._add_keys(id, keys)
+            session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            session.rollback()
+            raise exceptions.CreateError(
+                'Unable to update %s, duplicate entry' % self.name.title())
+
+    def set_key_values(self, key, values, journal_as=None):
+        """
+        set-based version of DbAbstraction.set_key_values: existing
+        rows are updated and missing ones inserted with one
+        statement each, in a single transaction.
+        """
+        from opencenter.db import models
+
+        if not values:
+            return []
+
+        table = self.model.__table__
+        node_ids = [int(x) for x in values]
+        values = dict([(int(k), v) for k, v in values.items()])
+
+        live = set([x[0] for x in session.query(models.Nodes.id).filter(
+            models.Nodes.id.in_(node_ids))])
+
+        def existing():
+            return dict([(node_id, object_id) for object_id, node_id in
+                         session.query(table.c.id, table.c.node_id).filter(
+                             table.c.key == key).filter(
+                                 table.c.node_id.in_(list(live)))])
+
+        if not live:
+            return []
+
+        try:
+            found = existing()
+            updates = [{'_id': object_id, '_value': values[node_id]}
+                       for node_id, object_id in found.items()]
+            inserts = [{'node_id': node_id, 'key': key,
+                        'value': values[node_id]}
+                       for node_id in live if not node_id in found]
+
+            if updates:
+                session.execute(
+                    table.update().where(
+                        table.c.id == sqlalchemy.bindparam('_id')).values(
+                            value=sqlalchemy.bindparam(
+                                '_value', type_=table.c.value.type)),
+                    updates)
+            if inserts:
+                session.execute(table.insert(), inserts)
+                found = existing()
+
+            # bulk statements skip the flush, so journal them by hand
+            written = sorted([(object_id, node_id)
+                              for node_id, object_id in found.items()])
+            models.journal_changes(session, journal_as or self.name,
+                                   [x[0] for x in written],
+                                   [x[1] for x in written],
+                                   [key] * len(written))
+            session.commit()
+        except:
+            session.rollback()
+            raise
+
+        return written
+
     def query(self, query):
         """
         try and optimize the ast query into a sql query, leveraging the
@@ -369,10 +931,10 @@ class APIAbstraction(DbAbstraction):
 
         return self.schema.keys()
 
-    def get_all(self):
+    def get_all(self, fields=None):
         self.objects._refresh(True)
         for obj in self.objects:
-            yield obj.to_hash()
+            yield select_fields(obj.to_hash(), fields)
 
     def get_schema(self):
         self.objects._maybe_refresh_schema()
@@ -395,7 +957,7 @@ class APIAbstraction(DbAbstraction):
         except ValueError:
             raise exceptions.IdNotFound(message='id %d does not exist' % id)
 
-    def get(self, id):
+    def get(self, id, fields=None):
         # This sort of naively assumes that the id
         # is an integer.  That's probably mostly right though.
         id = self._validate_id_format(id)
@@ -414,7 +976,7 @@ class APIAbstraction(DbAbstraction):
         except KeyError:
             return None
 
-        return json_object
+        return select_fields(json_object, fields)
 
     def update(self, id, data):
         id = self._validate_id_format(id)
@@ -454,8 +1016,8 @@ class InMemoryAbstraction(DbAbstraction):
 
         return cols
 
-    def get_all(self):
-        return self.dictionary.values()
+    def get_all(self, fields=None):
+        return [select_fields(x, fields) for x in self.dictionary.values()]
 
     def get_schema(self):
         fields = {}
@@ -500,13 +1062,13 @@ class InMemoryAbstraction(DbAbstraction):
         self.dictionary.pop(id)
         return True
 
-    def get(self, id):
+    def get(self, id, fields=None):
         # This sort of naively assumes that the id
         # is an integer.  That's probably mostly right though.
         id = self._validate_id_format(id)
 
         if id in self.dictionary:
-            return self.dictionary[id]
+            return select_fields(self.dictionary[id], fields)
         return None
 
     def update(self, id, data):
@@ -522,6 +1084,34 @@ class InMemoryAbstraction(DbAbstraction):
         return max(self.dictionary.keys()) + 1
 
 
+class SnapshotAbstraction(InMemoryAbstraction):
+    # rows copied out of another abstraction (see
+    # db.api.snapshot_from_api), to work from in another process.
+    # The columns and schema are copied too, as the model's own
+    # may be sqlalchemy ones.
+    def __init__(self, api, model, name, dictionary, columns, schema):
+        self.columns = columns
+        self.schema = schema
+
+        super(SnapshotAbstraction, self).__init__(api, model, name,
+                                                  dictionary)
+
+    def get_columns(self):
+        return self.columns
+
+    def get_schema(self):
+        return self.schema
+
+    def get(self, id, fields=None):
+        result = super(SnapshotAbstraction, self).get(id, fields=fields)
+
+        if result is None:
+            msg = '%s id %d does not exist' % (self.name.title(), int(id))
+            raise exceptions.IdNotFound(message=msg)
+
+        return result
+
+
 class CachedAbstraction(DbAbstraction):
     def __init__(self, api, model, name, base_abstraction):
         self.cache = None
@@ -536,14 +1126,41 @@ class CachedAbstraction(DbAbstraction):
     def get_columns(self):
         return self.base.get_columns()
 
-    def get_all(self):
+    def get_all(self, fields=None):
+        if self.cache is None and fields is not None:
+            # a partial read shouldn't pay to build the full cache,
+            # nor can it fill it
+            metrics.incr('cache_misses', label=self.name)
+            return self.base.get_all(fields=fields)
+
         if self.cache is None:
+            metrics.incr('cache_misses', label=self.name)
             self.cache = {}
 
             for obj in self.base.get_all():
                 self.cache[int(obj['id'])] = obj
+        else:
+            metrics.incr('cache_hits', label=self.name)
 
-        return self.cache.values()
+        return [select_fields(x, fields) for x in self.cache.values()]
+
+    def get_many(self, ids, fields=None):
+        if self.cache is None:
+            metrics.incr('cache_misses', label=self.name)
+            return self.base.get_many(ids, fields=fields)
+
+        return super(CachedAbstraction, self).get_many(ids, fields=fields)
+
+    def get_page(self, limit=None, sort='id', descending=False,
+                 after=None, fields=None):
+        if self.cache is None:
+            # one page doesn't warrant building the whole cache
+            metrics.incr('cache_misses', label=self.name)
+            return self.base.get_page(limit, sort, descending,
+                                      after, fields)
+
+        return super(CachedAbstraction, self).get_page(
+            limit, sort, descending, after, fields)
 
     def get_schema(self):
         return self.base.get_schema()
@@ -558,17 +1175,64 @@ class CachedAbstraction(DbAbstraction):
         self.api.destroy_cache()
         return result
 
-    def get(self, id):
+    def delete_by_query(self, query, limit=None):
+        result = self.base.delete_by_query(query, limit)
+        if result > 0:
+            self.api.destroy_cache()
+        return result
+
+    def move_by_query(self, query, target, limit=None, values=None):
+        result = self.base.move_by_query(query, target, limit, values)
+        if result > 0:
+            self.api.destroy_cache()
+        return result
+
+    def set_key_values(self, key, values, journal_as=None):
+        result = self.base.set_key_values(key, values, journal_as)
+        if result:
+            self.api.destroy_cache()
+        return result
+
+    def update_many(self, ids, data):
+        result = self.base.update_many(ids, data)
+        self.api.destroy_cache()
+        return result
+
+    def create_with_keys(self, data, keys):
+        result = self.base.create_with_keys(data, keys)
+        self.api.destroy_cache()
+        return result
+
+    def update_keys(self, id, keys):
+        self.base.update_keys(id, keys)
+        self.api.destroy_cache()
+
+    def get_by_fields(self, terms):
+        if self.cache is None:
+            return self.base.get_by_fields(terms)
+        return None
+
+    def get_by_field_values(self, field, values):
+        if self.cache is None:
+            metrics.incr('cache_misses', label=self.name)
+            return self.base.get_by_field_values(field, values)
+
+        return super(CachedAbstraction, self).get_by_field_values(field,
+                                                                  values)
+
+    def get(self, id, fields=None):
         id = self._validate_id_format(id)
 
         if self.cache is None:
-            return self.base.get(id)
+            metrics.incr('cache_misses', label=self.name)
+            return self.base.get(id, fields=fields)
         else:
+            metrics.incr('cache_hits', label=self.name)
             if not id in self.cache:
                 raise exceptions.IdNotFound(
                     message='%s id %d does not exist' % (self.model, int(id)))
             else:
-                return self.cache[int(id)]
+                return select_fields(self.cache[int(id)], fields)
 
     def update(self, id, data):
         id = self._validate_id_format(id)
@@ -581,43 +1245,90 @@ class CachedAbstraction(DbAbstraction):
 
 
 class EphemeralAbstraction(DbAbstraction):
-    def __init__(self, api, model, name, base_abstraction):
+    """
+    Changes held in memory on top of base_abstraction.  With a
+    parent (another EphemeralAbstraction on the same base), only
+    the changes made here are held, and the parent's changes show
+    through beneath them.
+
+    The changes of every layer down are merged into one view, kept
+    until this layer changes.  A parent must not change once it has
+    children, or their views go stale.
+    """
+    def __init__(self, api, model, name, base_abstraction, parent=None):
         self.del_obj = []
         self.new_obj = {}
         self.upd_obj = {}
         self.current_max = 100000000
+        self.parent = parent
+        self.merged = None
+
+        if parent is not None:
+            self.current_max = parent.current_max
 
         self.base = base_abstraction
 
         super(EphemeralAbstraction, self).__init__(api, model, name)
 
+    def _merge(self):
+        # (deleted ids, created objects, updates by id) of this
+        # layer and all those beneath it
+        if self.merged is None:
+            if self.parent is None:
+                deleted, created, updated = [], {}, {}
+            else:
+                deleted, created, updated = self.parent._merge()
+
+            deleted = deleted + self.del_obj
+            created = dict(created)
+            created.update(self.new_obj)
+            updated = dict(updated)
+            for id, fields in self.upd_obj.items():
+                updated[id] = dict(updated.get(id, {}))
+                updated[id].update(fields)
+
+            self.merged = (deleted, created, updated)
+
+        return self.merged
+
+    def _deleted(self, id):
+        return id in self._merge()[0]
+
+    def _created(self):
+        return self._merge()[1]
+
+    def _updates(self, id):
+        return self._merge()[2].get(id, {})
+
     def transactions(self):
         result = {}
-        if len(self.del_obj) > 0:
-            result['deleted'] = self.del_obj
-        if len(self.new_obj) > 0:
-            result['new'] = self.new_obj
-        if len(self.upd_obj) > 0:
-            result['updated'] = self.upd_obj
+        deleted, created, updated = self._merge()
+        if len(deleted) > 0:
+            result['deleted'] = list(deleted)
+        if len(created) > 0:
+            result['new'] = created
+        if len(updated) > 0:
+            result['updated'] = updated
         if result == {}:
             return None
         return result
 
     def _update_object(self, underlying):
-        if underlying['id'] in self.del_obj:
+        if self._deleted(underlying['id']):
             return None
 
-        if not underlying['id'] in self.upd_obj:
+        updates = self._updates(underlying['id'])
+        if not updates:
             return underlying
 
         updated_object = copy.deepcopy(underlying)
-        updated_object.update(self.upd_obj[underlying['id']])
+        updated_object.update(updates)
         return updated_object
 
     def get_columns(self):
         return self.base.get_columns()
 
-    def get_all(self):
+    def get_all(self, fields=None):
         result = []
 
         for obj in self.base.get_all():
@@ -625,13 +1336,13 @@ class EphemeralAbstraction(DbAbstraction):
             if new_obj is not None:
                 r = self.model(**(self._sanitize_for_create(new_obj)))
                 r.id = new_obj['id']
-                new_obj = r.jsonify(api=self.api)
+                new_obj = r.jsonify(api=self.api, fields=fields)
                 result.append(new_obj)
 
-        for id, obj in self.new_obj.items():
+        for id, obj in self._created().items():
             new_obj = self._update_object(obj)
             if new_obj is not None:
-                result.append(new_obj)
+                result.append(select_fields(new_obj, fields))
 
         return result
 
@@ -654,12 +1365,13 @@ class EphemeralAbstraction(DbAbstraction):
         new_data['id'] = self._get_new_id()
 
         self.new_obj[new_data['id']] = new_data
+        self.merged = None
         return new_data
 
     def delete(self, id):
         id = self._validate_id_format(id)
 
-        if id in self.del_obj:
+        if self._deleted(id):
             raise exceptions.IdNotFound(message='id %d does not exist' % id)
 
         obj = self.base.get(id)
@@ -667,9 +1379,10 @@ class EphemeralAbstraction(DbAbstraction):
             raise exceptions.IdNotFound(message='id %d does not exist' % id)
 
         self.del_obj.append(id)
+        self.merged = None
         return True
 
-    def get(self, id):
+    def get(self, id, fields=None):
         id = self._validate_id_format(id)
 
         new_obj = None
@@ -679,8 +1392,7 @@ class EphemeralAbstraction(DbAbstraction):
             new_obj = self._update_object(obj)
         else:
             # maybe newly created thing
-            if id in self.new_obj:
-                new_obj = self.new_obj[id]
+            new_obj = self._created().get(id)
 
         if new_obj is None:
             raise exceptions.IdNotFound(message='id %d does not exist' % id)
@@ -688,14 +1400,14 @@ class EphemeralAbstraction(DbAbstraction):
         r = self.model(**(self._sanitize_for_create(new_obj)))
         r.id = id
 
-        result = r.jsonify(api=self.api)
+        result = r.jsonify(api=self.api, fields=fields)
         return result
 
     def update(self, id, data):
         id = self._validate_id_format(id)
         new_data = self._sanitize_for_update(data)
 
-        if id in self.del_obj:
+        if self._deleted(id):
             raise exceptions.IdNotFound(message='%s id %d does not exist' %
                                         (self.model, id))
 
@@ -704,8 +1416,7 @@ class EphemeralAbstraction(DbAbstraction):
         try:
             obj = self.base.get(id)
         except exceptions.IdNotFound:
-            if id in self.new_obj:
-                obj = self.new_obj[id]
+            obj = self._created().get(id)
 
         if not obj:
             raise exceptions.IdNotFound(message='%s id %d does not exist' %
@@ -719,6 +1430,7 @@ class EphemeralAbstraction(DbAbstraction):
         for field in new_data:
             if existing_obj[field] != new_data[field]:
                 self.upd_obj[id][field] = new_data[field]
+        self.merged = None
 
         new_obj = self._update_object(existing_obj)
         return new_obj
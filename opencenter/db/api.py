@@ -129,11 +129,23 @@ class OpenCenterApi(object):
 
         return result
 
-    def _model_get_all(self, model):
-        return self._call_model('get_all', model)
+    def _model_get_all(self, model, fields=None):
+        return self._call_model('get_all', model, fields=fields)
 
-    def _model_get_by_id(self, model, id):
-        return self._call_model('get', model, id)
+    def _model_get_many(self, model, ids, fields=None):
+        return self._call_model('get_many', model, ids, fields=fields)
+
+    def _model_get_by_field_values(self, model, field, values):
+        return self._call_model('get_by_field_values', model, field, values)
+
+    def _model_get_page(self, model, limit=None, sort='id',
+                        descending=False, after=None, fields=None):
+        return self._call_model('get_page', model, limit=limit, sort=sort,
+                                descending=descending, after=after,
+                                fields=fields)
+
+    def _model_get_by_id(self, model, id, fields=None):
+        return self._call_model('get', model, id, fields=fields)
 
     def _model_get_columns(self, model):
         return self._call_model('get_columns', model)
@@ -150,12 +162,33 @@ class OpenCenterApi(object):
     def _model_query(self, model, query):
         return self._call_model('query', model, query)
 
+    def _model_delete_by_query(self, model, query, limit=None):
+        return self._call_model('delete_by_query', model, query, limit)
+
+    def _model_move_by_query(self, model, target, query, limit=None,
+                             values=None):
+        return self._call_model('move_by_query', model, query, target,
+                                limit, values)
+
+    def _model_set_key_values(self, model, key, values, journal_as=None):
+        return self._call_model('set_key_values', model, key, values,
+                                journal_as)
+
     def _model_get_first_by_query(self, model, query):
         return self._call_model('first_by_query', model, query)
 
     def _model_update_by_id(self, model, id, data):
         return self._call_model('update', model, id, data)
 
+    def _model_update_many(self, model, ids, data):
+        return self._call_model('update_many', model, ids, data)
+
+    def _model_create_with_keys(self, model, data, keys):
+        return self._call_model('create_with_keys', model, data, keys)
+
+    def _model_update_keys(self, model, id, keys):
+        return self._call_model('update_keys', model, id, keys)
+
     def add_model(self, name, abstracted_backend):
         model = name.lower()
         sing = model[:-1]
@@ -176,6 +209,8 @@ class OpenCenterApi(object):
                 partial(self._model_update_by_id, model))
         setattr(self, '%s_query' % model,
                 partial(self._model_query, model))
+        setattr(self, '%s_delete_by_query' % model,
+                partial(self._model_delete_by_query, model))
         setattr(self, '%s_get_first_by_query' % sing,
                 partial(self._model_get_first_by_query, model))
 
@@ -261,6 +296,66 @@ def ephemeral_api_from_api(backed_api):
     return new_api
 
 
+def layered_api_from_api(ephemeral_api):
+    # a new ephemeral data source holding only its own changes,
+    # with those of ephemeral_api showing through beneath
+    new_api = OpenCenterApi()
+
+    for name, layer in ephemeral_api.model_list.items():
+        abst = abstraction.EphemeralAbstraction(new_api, layer.model,
+                                                name, layer.base,
+                                                parent=layer)
+        new_api.add_model(name, abst)
+
+    return new_api
+
+
+# what solving reads, and so what a snapshot for it holds
+snapshot_models = ('nodes', 'facts', 'attrs', 'filters', 'primitives')
+
+
+def snapshot_from_api(backed_api, models=snapshot_models, node_ids=None):
+    # copy the rows of each model out as plain data, which can be
+    # pickled over to another process and made into an api there
+    # with api_from_snapshot.  With node_ids, only those nodes and
+    # their facts and attrs are copied.
+    snapshot = {}
+
+    if node_ids is not None:
+        node_ids = sorted(node_ids)
+
+    for name in models:
+        if node_ids is None or not name in ('nodes', 'facts', 'attrs'):
+            rows = backed_api._model_get_all(name)
+        elif name == 'nodes':
+            rows = backed_api._model_get_many(name, node_ids)
+        else:
+            rows = backed_api._model_get_by_field_values(name, 'node_id',
+                                                         node_ids)
+
+        snapshot[name] = {'columns': backed_api._model_get_columns(name),
+                          'schema': backed_api._model_get_schema(name),
+                          'rows': rows}
+
+    return snapshot
+
+
+def api_from_snapshot(snapshot):
+    from opencenter.db import models
+
+    new_api = OpenCenterApi()
+
+    for name, data in snapshot.items():
+        rows = dict([(int(x['id']), x) for x in data['rows']])
+        abst = abstraction.SnapshotAbstraction(new_api,
+                                               getattr(models, name.title()),
+                                               name, rows, data['columns'],
+                                               data['schema'])
+        new_api.add_model(name, abst)
+
+    return new_api
+
+
 def cached_api_from_api(backed_api):
     # run through the existing backends and create a new
     # ephemeral data source backed by those backends
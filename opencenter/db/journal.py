@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+from sqlalchemy import func
+
+from opencenter.db.database import session
+from opencenter.db.models import Changes
+
+
+# Read side of the change journal.  Rows are written by the flush
+# listener in models.py; these queries go straight to sql rather
+# than through the api, since the journal is append-only and far
+# too large to cache.
+
+
+def latest_seq():
+    """the sequence number of the newest change, or 0"""
+    return session.query(func.max(Changes.id)).scalar() or 0
+
+
+def first_seq():
+    """the sequence number of the oldest retained change, or None"""
+    return session.query(func.min(Changes.id)).scalar()
+
+
+def changes_since(seq, models, limit=None):
+    """
+    return up to limit changes to any of models after seq, oldest
+    first, as (id, model, object_id, node_id) tuples
+    """
+    query = session.query(Changes.id, Changes.model,
+                          Changes.object_id, Changes.node_id).filter(
+                              Changes.id > seq).filter(
+                                  Changes.model.in_(models)).order_by(
+                                      Changes.id)
+    if limit is not None:
+        query = query.limit(limit)
+
+    return query.all()
+
+
+def prune(before, limit=None):
+    """
+    delete up to limit changes older than the before timestamp,
+    returning the number deleted
+    """
+    # always keep the newest change, so the latest sequence
+    # number is never lost
+    id_query = session.query(Changes.id).filter(
+        Changes.timestamp < before).filter(
+            Changes.id < latest_seq()).order_by(Changes.id)
+    if limit is not None:
+        id_query = id_query.limit(limit)
+
+    ids = [x[0] for x in id_query]
+    if len(ids) == 0:
+        return 0
+
+    try:
+        Changes.query.filter(Changes.id.in_(ids)).delete(
+            synchronize_session=False)
+        session.commit()
+    except:
+        session.rollback()
+        raise
+
+    return len(ids)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+from sqlalchemy import *
+from sqlalchemy.engine import reflection
+from migrate import *
+
+
+def _has_index(migrate_engine):
+    # create_all makes it on new databases
+    inspector = reflection.Inspector.from_engine(migrate_engine)
+    return 'ix_nodes_name' in [x['name'] for x in
+                               inspector.get_indexes('nodes')]
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    nodes = Table('nodes', meta, autoload=True)
+
+    if not _has_index(migrate_engine):
+        Index('ix_nodes_name', nodes.c.name).create()
+
+
+def downgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    nodes = Table('nodes', meta, autoload=True)
+
+    if _has_index(migrate_engine):
+        Index('ix_nodes_name', nodes.c.name).drop()
@@ -27,10 +27,12 @@ import copy
 import json
 import logging
 import time
+import weakref
 
 from sqlalchemy import Column, Integer, String, ForeignKey, Enum, event
-from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.schema import Index, UniqueConstraint
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.session import Session
 import sqlalchemy.types as types
 from sqlalchemy.exc import InvalidRequestError
 
@@ -90,12 +92,16 @@ class JsonRenderer(object):
             '%s.%s' % (__name__, classname))
         return obj
 
-    def jsonify(self, api=None):
+    def jsonify(self, api=None, fields=None):
         if api is None:
             api = db_api.api_from_models()
 
         classname = self.__class__.__name__.lower()
         field_list = api._model_get_columns(classname)
+        if fields is not None:
+            # skip the columns not asked for -- in particular the
+            # synthesized ones, which are expensive to build
+            field_list = [c for c in field_list if c in fields]
 
         newself = self
         if api != self.api:
@@ -150,6 +156,179 @@ def task_state_mungery(target, value, oldvalue, initiator):
         target.completed = int(time.time())
 
 
+class Archives(JsonRenderer, Base):
+    """
+    completed tasks, moved out of the tasks table by the task
+    reaper so the tasks table only holds outstanding work.  Archived
+    tasks keep the id they had in the tasks table.
+    """
+    __tablename__ = 'archives'
+
+    id = Column(Integer, primary_key=True)
+    node_id = Column(Integer, nullable=False)
+    action = Column(String(40), nullable=False)
+    payload = Column(JsonBlob, default={}, nullable=False)
+    state = Column(
+        Enum('pending', 'delivered', 'running',
+             'done', 'timeout', 'cancelled'))
+    parent_id = Column(Integer, default=None)
+    result = Column(JsonBlob, default={})
+    submitted = Column(Integer)
+    completed = Column(Integer)
+    expires = Column(Integer)
+    archived = Column(Integer)
+
+    _non_updatable_fields = ['id', 'node_id', 'action', 'payload', 'state',
+                             'parent_id', 'result', 'submitted', 'completed',
+                             'expires', 'archived']
+
+    def __init__(self, node_id, action, payload, state='done',
+                 parent_id=None, result=None, submitted=None,
+                 completed=None, expires=None, archived=None):
+        self.node_id = node_id
+        self.action = action
+        self.payload = payload
+        self.state = state
+        self.parent_id = parent_id
+        self.result = result
+        self.submitted = submitted
+        self.completed = completed
+        self.expires = expires
+        self.archived = archived
+
+    def __repr__(self):
+        return '<Archive %r>' % (self.id)
+
+
+class Changes(JsonRenderer, Base):
+    """
+    durable change journal.  A row is written for every object
+    created, updated or deleted, in the same transaction as the change
+    itself, so the row id is a sequence number that clients can resume
+    from across server restarts.
+    """
+    __tablename__ = 'changes'
+    # autoincrement, so sqlite never reuses the id of a pruned change
+    __table_args__ = (Index('ix_changes_model_id', 'model', 'id'),
+                      {'sqlite_autoincrement': True})
+
+    id = Column(Integer, primary_key=True)
+    model = Column(String(32), nullable=False)
+    object_id = Column(Integer, nullable=False)
+    node_id = Column(Integer)
+    timestamp = Column(Integer)
+
+    _non_updatable_fields = ['id', 'model', 'object_id', 'node_id',
+                             'timestamp']
+
+    def __init__(self, model, object_id, node_id=None, timestamp=None):
+        self.model = model
+        self.object_id = object_id
+        self.node_id = node_id
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return '<Change %r>' % (self.id)
+
+
+# callables taking (model, object_ids, node_ids, keys), called once
+# the transaction that made the changes commits.  This is how
+# in-process caches hear about every write.  keys are the fact or
+# attr keys written, where known.
+change_listeners = []
+
+# changes journaled by each session but not yet committed
+_uncommitted = weakref.WeakKeyDictionary()
+
+# whether changes are written to the journal table.  Off when the
+# server keeps change history in memory only: nothing would read or
+# prune the rows, but listeners still hear every write.
+journal_enabled = True
+
+
+def add_change_listener(listener):
+    change_listeners.append(listener)
+
+
+def remove_change_listener(listener):
+    if listener in change_listeners:
+        change_listeners.remove(listener)
+
+
+def journal_changes(db_session, model, object_ids, node_ids=None,
+                    keys=None):
+    """
+    write change journal rows for object_ids in table model, as part
+    of db_session's current transaction, and queue them for the
+    change listeners.  This is for bulk statements that bypass the
+    flush listener below.
+    """
+    if not object_ids or model == Changes.__tablename__:
+        return
+
+    if hasattr(db_session, 'registry'):
+        # a scoped session; queue against the real one
+        db_session = db_session.registry()
+
+    if node_ids is None:
+        node_ids = [None] * len(object_ids)
+
+    if keys is None:
+        keys = [None] * len(object_ids)
+
+    if journal_enabled:
+        now = int(time.time())
+        db_session.execute(
+            Changes.__table__.insert(),
+            [{'model': model,
+              'object_id': object_id,
+              'node_id': node_id,
+              'timestamp': now}
+             for object_id, node_id in zip(object_ids, node_ids)])
+
+    _uncommitted.setdefault(db_session, []).append(
+        (model, object_ids, node_ids, keys))
+
+
+# tell the listeners only once the changes are durable
+@event.listens_for(Session, 'after_commit')
+def deliver_changes(db_session):
+    for change in _uncommitted.pop(db_session, []):
+        for listener in list(change_listeners):
+            listener(*change)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changes(db_session):
+    _uncommitted.pop(db_session, None)
+
+
+# journal every object the flush wrote, before the commit
+@event.listens_for(Session, 'after_flush')
+def journal_flush(db_session, flush_context):
+    changed = list(db_session.new) + list(db_session.deleted) + [
+        obj for obj in db_session.dirty if db_session.is_modified(obj)]
+
+    rows = {}
+    for obj in changed:
+        model = getattr(obj, '__tablename__', None)
+        if model is None or model == Changes.__tablename__:
+            continue
+
+        if model == 'nodes':
+            node_id = obj.id
+        else:
+            node_id = getattr(obj, 'node_id', None)
+
+        ids, node_ids, keys = rows.setdefault(model, ([], [], []))
+        ids.append(obj.id)
+        node_ids.append(node_id)
+        keys.append(getattr(obj, 'key', None))
+
+    for model, (ids, node_ids, keys) in rows.items():
+        journal_changes(db_session, model, ids, node_ids, keys)
+
+
 class Facts(JsonRenderer, Base):
     __tablename__ = 'facts'
     id = Column(Integer, primary_key=True)
@@ -191,6 +370,8 @@ class Nodes(JsonRenderer, Base):
     task_id = Column(Integer, ForeignKey('tasks.id',
                                          use_alter=True,
                                          name='fk_task_id'), default=None)
+    # agents look themselves up by name in whoami
+    __table_args__ = (Index('ix_nodes_name', 'name'),)
 
     _non_updatable_fields = ['id', 'name']
     _synthesized_fields = ['facts', 'attrs']
@@ -26,13 +26,11 @@
 import daemon
 import fcntl
 import getopt
+import hashlib
 import logging
 import os
-import random
-import string
 import sys
 import traceback
-import time
 
 from ConfigParser import ConfigParser
 from flask import Flask, jsonify, request
@@ -40,19 +38,32 @@ from flask import Flask, jsonify, request
 # from opencenter import backends
 from opencenter.db import models
 from opencenter.db.api import api_from_models
+from opencenter.webapp import availability
+from opencenter.webapp import dispatcher
 from opencenter.webapp import generic
+from opencenter.webapp import heartbeats
+from opencenter.webapp import metrics
+from opencenter.webapp import notifier
+from opencenter.webapp import pool
+from opencenter.webapp import tasks
+from opencenter.webapp import transactions
 from opencenter.webapp import utility
+from opencenter.webapp import versions
 from opencenter.webapp.ast import FilterBuilder, FilterTokenizer
 from opencenter.webapp.adventures import bp as adventures_bp
+from opencenter.webapp.archives import bp as archives_bp
 from opencenter.webapp.attrs import bp as attrs_bp
+from opencenter.webapp.batch import bp as batch_bp
 from opencenter.webapp.facts import bp as facts_bp
 from opencenter.webapp.facts_please import bp as facts_please
 from opencenter.webapp.filters import bp as filters_bp
 from opencenter.webapp.index import bp as index_bp
+from opencenter.webapp.metrics import bp as metrics_bp
 from opencenter.webapp.nodes import bp as nodes_bp
 # from opencenter.webapp.nodes_please import bp as nodes_please
 from opencenter.webapp.plan import bp as plan_bp
 from opencenter.webapp.primitives import bp as primitives_bp
+from opencenter.webapp.stream import bp as stream_bp
 from opencenter.webapp.tasks import bp as tasks_bp
 
 
@@ -94,9 +105,6 @@ class WebServer(Flask):
                  confighash=None, debug=False):
         daemonize = False
         self.registered_models = []
-        self.transactions = {
-            'session_key': "".join([random.choice(string.hexdigits)
-                                   for n in xrange(30)])}
 
         super(WebServer, self).__init__(name)
 
@@ -134,6 +142,23 @@ class WebServer(Flask):
                 'daemonize': False,
                 'pidfile': None,
                 'task_reaping_threshold': 1800,
+                'task_reaping_interval': 60,
+                'task_reaping_batch_size': 500,
+                'task_archive_retention': 604800,
+                'change_journal': True,
+                'change_journal_retention': 86400,
+                'notification_window': 0.05,
+                'delta_budget': 262144,
+                'max_page_size': 1000,
+                'max_batch_size': 100,
+                'max_task_delivery': 100,
+                'heartbeat_interval': 10,
+                'heartbeat_batch_size': 500,
+                'stream_keepalive': 15,
+                'stream_retry': 3000,
+                'solver_search': 'breadth',
+                'solver_workers': 0,
+                'solver_timeout': 300,
                 'hostidfile': '/etc/opencenter/hostid'
             }
         }
@@ -187,6 +212,20 @@ class WebServer(Flask):
 
         self.config.update(defaults['main'])
 
+        models.journal_enabled = str(
+            self.config['change_journal']).lower() in ('true', 'yes',
+                                                       'on', '1')
+        if models.journal_enabled:
+            # the session key follows the database, not the process,
+            # so clients can resume across restarts
+            session_key = hashlib.sha1(
+                self.config['database_uri']).hexdigest()[:30]
+            self.transactions = transactions.JournalLog(
+                session_key,
+                retention=int(self.config['change_journal_retention']))
+        else:
+            self.transactions = transactions.TransactionLog()
+
         print("daemonize: %s, debug: %s, configfile: %s, loglevel: %s " %
               (daemonize, debug, configfile,
                logging.getLevelName(LOG.getEffectiveLevel())))
@@ -196,6 +235,8 @@ class WebServer(Flask):
         self.register_blueprint(nodes_bp, url_prefix='/admin/nodes')
         self.register_blueprint(tasks_bp, url_prefix='/tasks')
         self.register_blueprint(tasks_bp, url_prefix='/admin/tasks')
+        self.register_blueprint(archives_bp, url_prefix='/archives')
+        self.register_blueprint(archives_bp, url_prefix='/admin/archives')
         self.register_blueprint(adventures_bp, url_prefix='/adventures')
         self.register_blueprint(adventures_bp, url_prefix='/admin/adventures')
         self.register_blueprint(filters_bp, url_prefix='/filters')
@@ -208,11 +249,51 @@ class WebServer(Flask):
         self.register_blueprint(primitives_bp, url_prefix='/admin/primitives')
         self.register_blueprint(plan_bp, url_prefix='/plan')
         self.register_blueprint(plan_bp, url_prefix='/admin/plan')
+        self.register_blueprint(stream_bp, url_prefix='/stream')
+        self.register_blueprint(stream_bp, url_prefix='/admin/stream')
+        self.register_blueprint(batch_bp, url_prefix='/batch')
+        self.register_blueprint(batch_bp, url_prefix='/admin/batch')
+        self.register_blueprint(metrics_bp, url_prefix='/admin/metrics')
         self.testing = debug
 
-        # Define transaction dict for all models
+        self.metrics = metrics.Metrics()
+        self.metrics.install(self)
+
+        # Define transaction log for all models
         for model in self.registered_models:
-            self.transactions[model] = {time.time(): set([])}
+            self.transactions.add_model(model)
+        self.transactions.add_model(heartbeats.Heartbeats.model)
+
+        self.notifier = notifier.Notifier(
+            self.transactions,
+            window=float(self.config['notification_window']))
+
+        self.heartbeats = heartbeats.Heartbeats(
+            self.notifier,
+            interval=self.config['heartbeat_interval'],
+            batch_size=self.config['heartbeat_batch_size'])
+
+        # every table the change journal covers
+        self.versions = versions.VersionIndex(
+            [x for x in models.Base.metadata.tables
+             if x != models.Changes.__tablename__])
+        models.add_change_listener(self.versions.bump)
+
+        self.dispatcher = dispatcher.Dispatcher()
+        models.add_change_listener(self.dispatcher.changed)
+
+        self.availability = availability.AvailabilityIndex()
+        models.add_change_listener(self.availability.changed)
+
+        self.solver_pool = pool.SolverPool(
+            size=self.config['solver_workers'],
+            timeout=self.config['solver_timeout'])
+
+        self.task_reaper = tasks.TaskReaper(
+            threshold=self.config['task_reaping_threshold'],
+            interval=self.config['task_reaping_interval'],
+            batch_size=self.config['task_reaping_batch_size'],
+            retention=self.config['task_archive_retention'])
 
         if debug:
             self.config['TESTING'] = True
@@ -220,6 +301,30 @@ class WebServer(Flask):
         if daemonize:
             self.config['daemonize'] = True
 
+    def start_workers(self):
+        """
+        Start the background greenlets that do housekeeping
+        outside of the request path.  This should be called
+        once the database has been initialized.
+        """
+        # fork the solver workers before the other greenlets exist
+        self.solver_pool.start()
+        self.dispatcher.load()
+        self.task_reaper.start()
+        self.heartbeats.start()
+
+    def close(self):
+        """
+        Stop the background greenlets and detach from the change
+        journal.  The server can't be used after this.
+        """
+        self.heartbeats.stop()
+        self.task_reaper.stop()
+        self.solver_pool.stop()
+        models.remove_change_listener(self.versions.bump)
+        models.remove_change_listener(self.dispatcher.changed)
+        models.remove_change_listener(self.availability.changed)
+
     def usage(self):
         """Print a usage message."""
 
@@ -245,13 +350,21 @@ class WebServer(Flask):
             def f():
                 resp = None
 
+                try:
+                    fields = generic.requested_fields(what)
+                except ValueError as e:
+                    return generic.http_badrequest(msg=str(e))
+
                 builder = FilterBuilder(
                     FilterTokenizer(),
                     '%s: %s' % (what, request.json['filter']),
                     api=api_from_models())
 
                 # try:
-                result = builder.filter()
+                # the filter has to see whole objects, so the
+                # projection happens after it runs
+                result = [generic.project(x, fields)
+                          for x in builder.filter()]
                 resp = jsonify({'status': 200,
                                 'message': 'success',
                                 what: result})
@@ -266,12 +379,19 @@ class WebServer(Flask):
         def filter_object_by_id(what):
             def f(filter_id):
                 api = api_from_models()
+
+                try:
+                    fields = generic.requested_fields(what, api)
+                except ValueError as e:
+                    return generic.http_badrequest(msg=str(e))
+
                 filter_obj = api.filter_get_by_id(filter_id)
                 full_expr = filter_obj['full_expr']
                 builder = FilterBuilder(FilterTokenizer(),
                                         '%s: %s' % (what, full_expr))
 
-                return jsonify({what: builder.filter()})
+                return jsonify({what: [generic.project(x, fields)
+                                       for x in builder.filter()]})
 
             return f
 
@@ -280,15 +400,7 @@ class WebServer(Flask):
                 """
                 Accepts a transaction id, and returns a list of
                 updated nodes from input transaction_id to latest
-                transaction_id.  transaction dict.
-
-                FIXME: As an optimization, the changes could be
-                accumulated in a single set up until the point
-                that someone got a new txid.  Then we could avoid
-                having a long list of one-element transactions, and
-                instead only create db version intervals on the intervals
-                that we know people could possibly refer from.  If that
-                makes sense.
+                transaction_id.
 
                 Arguments:
                 txid -- transaction id (opaque)
@@ -299,34 +411,67 @@ class WebServer(Flask):
 
                 nodes -- list of updated node_ids from trx_id to
                 latest transaction id
+
+                delta -- with ?delta=objects or ?delta=diff, the
+                changed objects themselves (see generic.updates_delta)
                 """
 
-                trans = self.transactions[what]
-                current_txid = time.time()
+                trans = self.transactions
 
-                if session_key != self.transactions['session_key']:
+                # make sure queued changes are in the log
+                self.notifier.flush()
+
+                if session_key != trans.session_key:
                     return generic.http_response(410, 'Invalid session_key')
 
-                txid = float(txid)
+                try:
+                    txid = int(txid)
+                except ValueError:
+                    return generic.http_response(410, 'Invalid transaction id')
 
                 if 'poll' in request.args:
-                    # we'll poll if we have no changes
-                    if txid >= max(trans.keys()):
-                        semaphore = '%s-changes' % (what)
-                        utility.wait(semaphore)
-
-                if txid < min(trans.keys()):
+                    # we'll poll if we have no changes.  The event
+                    # carries the changed ids, but the transaction
+                    # log has them too, so just use it to wake.
+                    semaphore = '%s-changes' % (what)
+                    with utility.subscribe(semaphore) as subscription:
+                        if trans.changes_since(what, txid) == []:
+                            subscription.get(30)
+
+                retval = trans.ids_since(what, txid)
+                if retval is None:
                     return generic.http_response(410, 'Expired transaction id')
 
-                retval = set()
-                for x in (trans[tx] for tx in trans.keys() if tx > txid):
-                    retval.update(x)
+                result = {"transaction": {'session_key': session_key,
+                                          'txid': str(trans.issue())},
+                          what: list(retval)}
+
+                # optionally embed the changed objects, so the
+                # client needn't GET them one at a time
+                mode = request.args.get('delta')
+                if mode is not None:
+                    if not mode in ('objects', 'diff'):
+                        return generic.http_badrequest(
+                            msg='delta must be objects or diff')
+
+                    budget = int(self.config['delta_budget'])
+                    if 'budget' in request.args:
+                        try:
+                            budget = min(budget,
+                                         int(request.args['budget']))
+                        except ValueError:
+                            return generic.http_badrequest(
+                                msg='budget must be an integer')
+
+                    keys = None
+                    if mode == 'diff' and what == 'nodes':
+                        keys = generic.changed_keys(trans, txid)
+
+                    result['delta'] = generic.updates_delta(
+                        what, retval, mode, budget, keys)
 
                 return generic.http_response(
-                    200, 'Updated %s' % what.title(),
-                    **{"transaction": {'session_key': session_key,
-                                       'txid': '%.6f' % current_txid},
-                       what: list(retval)})
+                    200, 'Updated %s' % what.title(), **result)
             return f
 
         def root_schema():
@@ -335,7 +480,7 @@ class WebServer(Flask):
 
         def root_updates():
             """Returns the latest transaction information from the
-            in-memory transaction dict.  Realize that this is only
+            in-memory transaction log.  Realize that this is only
             accurate at the time of the request.  So clearly, one
             should call this BEFORE serializing stuffs.
 
@@ -346,12 +491,11 @@ class WebServer(Flask):
             json object containing: the unique session key,
                                     the latest transaction id
             """
-            session_key = self.transactions['session_key']
-            txid = time.time()
+            self.notifier.flush()
 
             return generic.http_response(
-                transaction={'session_key': session_key,
-                             'txid': '%.6f' % txid})
+                transaction={'session_key': self.transactions.session_key,
+                             'txid': str(self.transactions.issue())})
 
         bpname = blueprint.name
         if bpname.endswith('_please'):
@@ -417,6 +561,7 @@ class WebServer(Flask):
             if context:
                 context.open()
 
+            self.start_workers()
             super(WebServer, self).run(host=self.config['bind_address'],
                                        port=self.config['bind_port'])
         except KeyboardInterrupt:
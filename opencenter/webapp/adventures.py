@@ -29,7 +29,7 @@ from opencenter.db.api import api_from_models
 from opencenter.db import exceptions
 from opencenter.webapp import generic
 # from opencenter.webapp import solver
-# from opencenter.webapp import utility
+from opencenter.webapp import utility
 
 
 object_type = 'adventures'
@@ -41,6 +41,55 @@ def list():
     return generic.list(object_type)
 
 
+@bp.route('/available', methods=['POST'])
+def available():
+    """
+    The adventures available to each of a list of nodes, or to every
+    node under a container, in one request.  Takes either
+    {'nodes': [node ids]} or {'container': node id}.
+    """
+    data = flask.request.json
+    api = api_from_models()
+
+    if not isinstance(data, dict) or \
+            ('nodes' in data) == ('container' in data):
+        return generic.http_badrequest(
+            msg='specify one of nodes or container')
+
+    if 'container' in data:
+        try:
+            container = api._model_get_by_id('nodes', data['container'],
+                                             fields=['id'])
+        except exceptions.IdNotFound:
+            return generic.http_notfound(
+                msg='Not Found: Node %s' % data['container'])
+        except exceptions.IdInvalid:
+            return generic.http_badrequest(msg='container must be an id')
+
+        node_ids = sorted(utility.expand_subtree(
+            utility.children_index(api), [container['id']]))
+    else:
+        node_ids = data['nodes']
+        # list is shadowed by the view above
+        if not isinstance(node_ids, type([])):
+            return generic.http_badrequest(msg='nodes must be a list')
+
+    try:
+        adventures, available = flask.current_app.availability.available_many(
+            node_ids, api)
+    except exceptions.IdInvalid:
+        return generic.http_badrequest(msg='node ids must be integers')
+
+    used = set()
+    for ids in available.values():
+        used.update(ids)
+
+    return generic.http_response(
+        adventures=[x for x in adventures if x['id'] in used],
+        nodes=dict([(str(k), sorted(v)) for k, v in available.items()]),
+        missing=[x for x in node_ids if not int(x) in available])
+
+
 @bp.route('/<object_id>', methods=['GET', 'PUT', 'DELETE'])
 def by_id(object_id):
     return generic.object_by_id(object_type, object_id)
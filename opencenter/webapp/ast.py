@@ -27,6 +27,8 @@ import logging
 import re
 import copy
 
+from opencenter.webapp import metrics
+
 
 # some utility functions for inverting and
 # concretizing expressions
@@ -383,6 +385,7 @@ class AstBuilder(object):
         self.input_expression = input_expression
 
     def build(self):
+        metrics.incr('filter_parses')
         self.tokenizer.parse(self.input_expression)
         root_node = self.parse()
         return root_node
@@ -440,6 +443,7 @@ class FilterBuilder(AstBuilder):
             raise SyntaxError('unknown filter type')
 
         nodes = self.api._model_get_all(input_type)
+        metrics.incr('filter_evaluations', len(nodes))
 
         result = []
 
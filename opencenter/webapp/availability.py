@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import logging
+
+from opencenter.db import exceptions
+from opencenter.db.api import api_from_models
+from opencenter.webapp import ast
+from opencenter.webapp import metrics
+from opencenter.webapp import utility
+
+
+LOG = logging.getLogger(__name__)
+
+
+def criteria_keys(root):
+    """
+    The node fields an expression reads, as names like 'name',
+    'facts.backends' or 'attrs.converged', or None if that can't be
+    known statically -- the expression calls functions (which can
+    look at other nodes) or interpolates identifiers.
+    """
+    if root.op == 'FUNCTION':
+        return None
+
+    if root.op in ('NUMBER', 'BOOL', 'NONE'):
+        return set()
+
+    if root.op in ('STRING', 'IDENTIFIER'):
+        if '{' in str(root.lhs):
+            return None
+        if root.op == 'STRING':
+            return set()
+
+        parts = root.lhs.split('.')
+        if parts[0] in ('facts', 'attrs'):
+            if len(parts) == 1:
+                # the whole dict
+                return None
+            return set(['%s.%s' % (parts[0], parts[1])])
+        return set([parts[0]])
+
+    keys = set()
+    for side in (root.lhs, root.rhs):
+        if isinstance(side, ast.Node):
+            side_keys = criteria_keys(side)
+            if side_keys is None:
+                return None
+            keys.update(side_keys)
+    return keys
+
+
+class Criteria(object):
+    """An adventure's criteria, parsed once."""
+
+    def __init__(self, adventure, api):
+        self.adventure_id = adventure['id']
+        self.criteria = adventure['criteria']
+        self.root = None
+        self.keys = set()
+
+        builder = ast.FilterBuilder(ast.FilterTokenizer(), self.criteria,
+                                    api=api)
+        self.functions = builder.functions
+        try:
+            self.root = builder.build()
+            self.keys = criteria_keys(self.root)
+        except Exception as e:
+            LOG.warn('adv err %s: %s' % (adventure['name'], str(e)))
+
+    def affected_by(self, changed):
+        """
+        Whether a change to the given keys (None meaning any) could
+        change this criteria's answer.
+        """
+        if changed is None or self.keys is None:
+            return True
+        return bool(self.keys & changed)
+
+    def matches(self, node):
+        if self.root is None:
+            return False
+
+        metrics.incr('filter_evaluations')
+        try:
+            return bool(self.root.eval_node(node, self.functions))
+        except Exception as e:
+            LOG.warn('adv err %s on node %s: %s' % (
+                self.adventure_id, node.get('id'), str(e)))
+            return False
+
+
+class AvailabilityIndex(object):
+    """
+    Which adventures each node qualifies for.
+
+    Adventure criteria are parsed once per adventure version, and the
+    answer for each node is kept until something it depends on
+    changes.  Changes come from the change journal hook in models.py.
+    A fact or attr write only re-evaluates the criteria that read that
+    key, and only on the nodes it touched.  For facts, that is the
+    whole subtree, since facts are inherited.  Criteria that call
+    functions may depend on other nodes, so they are evaluated on
+    every lookup.
+
+    The change hook runs as the writing transaction commits, where it
+    can't query, so changes are queued there and applied on the next
+    lookup.  Rolled back writes never reach it.
+    """
+
+    # past this many queued changes, it's cheaper to start over
+    max_pending = 10000
+
+    def __init__(self):
+        # adventure_id -> Criteria
+        self.compiled = {}
+        # node_id -> {adventure_id: bool}
+        self.results = {}
+        # node_id -> set of changed keys, or None for anything
+        self.dirty = {}
+        # (model, object_ids, node_ids, keys) from the change hook
+        self.pending = []
+        # parent_id -> child ids, for expanding fact changes
+        self.children = None
+
+        self.stats = {'compiles': 0,
+                      'evaluations': 0,
+                      'hits': 0}
+
+    def changed(self, model, object_ids, node_ids=None, keys=None):
+        """change journal listener"""
+        # the children index is kept even with nothing cached, so a
+        # move has to drop it whether or not the change gets queued
+        if model == 'nodes' or (model == 'facts' and (
+                keys is None or
+                any([x in (None, 'parent_id') for x in keys]))):
+            self.children = None
+
+        if model == 'adventures' or (self.results and model in (
+                'nodes', 'facts', 'attrs', 'checkins')):
+            self.pending.append((model, object_ids, node_ids, keys))
+
+        if len(self.pending) > self.max_pending:
+            self.clear()
+
+    def clear(self):
+        self.compiled = {}
+        self.results = {}
+        self.dirty = {}
+        self.pending = []
+        self.children = None
+
+    def _mark(self, node_ids, changed):
+        for node_id in node_ids:
+            if not node_id in self.results:
+                continue
+            if changed is None:
+                self.dirty[node_id] = None
+            elif self.dirty.get(node_id, set()) is not None:
+                self.dirty.setdefault(node_id, set()).update(changed)
+
+    def _subtree(self, node_id, api):
+        if self.children is None:
+            self.children = utility.children_index(api)
+        return utility.expand_subtree(self.children, [node_id])
+
+    def _settle(self, api):
+        pending, self.pending = self.pending, []
+
+        for model, object_ids, node_ids, keys in pending:
+            if model == 'adventures':
+                for adventure_id in object_ids:
+                    self.compiled.pop(adventure_id, None)
+                    for results in self.results.values():
+                        results.pop(adventure_id, None)
+                continue
+
+            if model == 'nodes':
+                # renamed, moved or deleted
+                for node_id in object_ids:
+                    self.results.pop(node_id, None)
+                    self.dirty.pop(node_id, None)
+                self.children = None
+                continue
+
+            if model == 'checkins':
+                model = 'attrs'
+
+            if node_ids is None:
+                # don't know which nodes, so it could be any of them
+                self.results = {}
+                self.dirty = {}
+                continue
+            if keys is None:
+                keys = [None] * len(object_ids)
+
+            for node_id, key in zip(node_ids, keys):
+                if node_id is None:
+                    continue
+
+                changed = None
+                if key is not None:
+                    changed = set(['%s.%s' % (model, key)])
+
+                if model == 'facts':
+                    if key in (None, 'parent_id'):
+                        # moved, so everything it inherits may differ
+                        self.children = None
+                        changed = None
+                    self._mark(self._subtree(node_id, api), changed)
+                else:
+                    self._mark([node_id], changed)
+
+    def _criteria(self, adventure, api):
+        compiled = self.compiled.get(adventure['id'])
+        if compiled is None or compiled.criteria != adventure['criteria']:
+            compiled = Criteria(adventure, api)
+            self.compiled[adventure['id']] = compiled
+            self.stats['compiles'] += 1
+        return compiled
+
+    def available(self, node_id, api=None):
+        """
+        The adventures available to node_id.
+
+        Raises:
+        IdInvalid, IdNotFound -- as for a node lookup
+        """
+        adventures, available = self.available_many([node_id], api)
+        if not available:
+            raise exceptions.IdNotFound(
+                message='Object not found: nodes: %s' % node_id)
+
+        ids = available.values()[0]
+        return [x for x in adventures if x['id'] in ids]
+
+    def available_many(self, node_ids, api=None):
+        """
+        The adventures available to each of node_ids.  Nodes that
+        need re-evaluating are fetched together, and each criteria is
+        run over all of them in one pass.
+
+        Returns:
+        (all adventures, {node_id: set of available adventure ids}),
+        leaving out nodes that don't exist
+
+        Raises:
+        IdInvalid -- if any node id isn't an integer
+        """
+        if api is None:
+            api = api_from_models()
+
+        try:
+            node_ids = [int(x) for x in node_ids]
+        except (TypeError, ValueError):
+            msg = 'IdInvalid: id must be an integer.'
+            raise exceptions.IdInvalid(message=msg)
+
+        self._settle(api)
+        adventures = api._model_get_all('adventures')
+        compiled = [(x['id'], self._criteria(x, api)) for x in adventures]
+
+        # adventure_id -> node ids to evaluate it on
+        stale = dict([(x['id'], []) for x in adventures])
+        unknown = []
+        for node_id in node_ids:
+            results = self.results.get(node_id)
+            if results is None:
+                # first look at this node, which also checks it exists
+                unknown.append(node_id)
+                continue
+
+            changed = self.dirty.pop(node_id, set())
+            for adventure_id, criteria in compiled:
+                if adventure_id in results and \
+                        not criteria.affected_by(changed):
+                    self.stats['hits'] += 1
+                else:
+                    stale[adventure_id].append(node_id)
+
+        wanted = set(unknown)
+        for ids in stale.values():
+            wanted.update(ids)
+
+        nodes = {}
+        if wanted:
+            nodes = dict([(x['id'], x) for x in api._model_get_many(
+                'nodes', sorted(wanted))])
+
+        for node_id in unknown:
+            if node_id in nodes:
+                self.results[node_id] = {}
+                for adventure_id in stale:
+                    stale[adventure_id].append(node_id)
+
+        for adventure_id, criteria in compiled:
+            for node_id in stale[adventure_id]:
+                if node_id in nodes:
+                    self.results[node_id][adventure_id] = \
+                        criteria.matches(nodes[node_id])
+                    self.stats['evaluations'] += 1
+
+        available = {}
+        for node_id in node_ids:
+            results = self.results.get(node_id)
+            if results is None:
+                continue
+            if any([not x in results for x, _ in compiled]):
+                # deleted since it was last looked at
+                del self.results[node_id]
+                continue
+
+            # only adventures that still exist
+            results = dict([(x, results[x]) for x, _ in compiled])
+            self.results[node_id] = results
+            available[node_id] = set(
+                [x for x, matched in results.items() if matched])
+
+        return adventures, available
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+import logging
+import urlparse
+
+import flask
+
+from opencenter.webapp import generic
+from opencenter.webapp.auth import requires_auth
+
+
+# Runs a list of sub-requests in one round trip:
+#
+#   POST /batch/
+#   {"requests": [{"method": "GET", "path": "/nodes/?ids=1,2"},
+#                 {"method": "PUT", "path": "/attrs/4",
+#                  "body": {"value": true}}]}
+#
+# Sub-requests run in order, each through the full request handling
+# of its own endpoint, and the response carries one
+# {"status": ..., "body": ...} per sub-request.  A failed sub-request
+# doesn't stop the rest.
+#
+# There is no batch-scoped object cache: sub-requests run in this
+# process, so their reads already go through the api's process-wide
+# CachedAbstraction.  The batch only keeps a memo of GET responses by
+# exact path, so a repeated GET of the same path (query string
+# included) answers from the memo.  Any write drops the memo.
+object_type = 'batch'
+bp = flask.Blueprint(object_type, __name__)
+
+LOG = logging.getLogger(__name__)
+
+batch_methods = ['GET', 'PUT', 'POST']
+
+# long-lived or recursive requests have no place in a batch
+excluded_prefixes = ['/batch', '/stream', '/admin/batch', '/admin/stream']
+
+# ...and neither do requests that block waiting for a change
+blocking_suffixes = ('/tasks_blocking',)
+blocking_args = ['poll', 'watch']
+
+
+def _excluded(path):
+    if not path.startswith('/') or [x for x in excluded_prefixes
+                                    if path.startswith(x)]:
+        return True
+
+    base, _, query = path.partition('?')
+    if base.rstrip('/').endswith(blocking_suffixes):
+        return True
+
+    args = urlparse.parse_qs(query, keep_blank_values=True)
+    return len([x for x in blocking_args if x in args]) > 0
+
+
+def _item_error(status, msg):
+    return {'status': status, 'body': {'status': status, 'message': msg}}
+
+
+def _run(item, memo):
+    if not isinstance(item, dict) or not 'path' in item:
+        return _item_error(400, 'sub-request needs a path')
+
+    method = str(item.get('method', 'GET')).upper()
+    path = str(item['path'])
+
+    if not method in batch_methods:
+        return _item_error(405, 'method %s not allowed in a batch' % method)
+
+    if _excluded(path):
+        return _item_error(400, 'path %s not allowed in a batch' % path)
+
+    if method == 'GET' and path in memo:
+        return memo[path]
+
+    if method != 'GET':
+        memo.clear()
+
+    headers = {}
+    if 'Authorization' in flask.request.headers:
+        headers['Authorization'] = flask.request.headers['Authorization']
+
+    data = None
+    if 'body' in item:
+        data = json.dumps(item['body'])
+
+    app = flask.current_app._get_current_object()
+    with app.test_request_context(path, method=method, data=data,
+                                  content_type='application/json',
+                                  headers=headers):
+        try:
+            resp = app.full_dispatch_request()
+        except Exception as e:
+            LOG.exception('batch %s %s failed' % (method, path))
+            return _item_error(500, str(e))
+
+    try:
+        body = json.loads(resp.data)
+    except ValueError:
+        body = resp.data
+
+    result = {'status': resp.status_code, 'body': body}
+    if method == 'GET' and resp.status_code == 200:
+        memo[path] = result
+    return result
+
+
+@bp.route('/', methods=['POST'])
+@requires_auth()
+def batch():
+    body = flask.request.json
+    if not isinstance(body, dict) or \
+            not isinstance(body.get('requests'), list):
+        return generic.http_badrequest(msg='requests must be a list')
+
+    max_size = int(flask.current_app.config['max_batch_size'])
+    if len(body['requests']) > max_size:
+        return generic.http_badrequest(
+            msg='at most %d requests per batch' % max_size)
+
+    memo = {}
+    responses = [_run(item, memo) for item in body['requests']]
+    return generic.http_response(200, 'success', responses=responses)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import bisect
+import logging
+
+from opencenter.db import exceptions
+from opencenter.db.api import api_from_models
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Dispatcher(object):
+    """
+    Per-node queues of pending task ids, so handing an agent its
+    next task doesn't mean querying the whole tasks table.
+
+    The queues are loaded from the database on first use, and kept
+    up to date from the change journal hook in models.py, which sees
+    every committed task write, however it was made.  That hook doesn't say
+    what changed, so any written task is queued for its node, and
+    tasks that turn out not to be pending (done, deleted, moved to
+    another node) are dropped when they reach the head of the queue.
+
+    Tasks are handed out oldest first.
+    """
+
+    def __init__(self):
+        # node_id -> sorted list of task ids
+        self.queues = None
+        self.stats = {'dispatched': 0,
+                      'dropped': 0}
+
+    def load(self, api=None):
+        if api is None:
+            api = api_from_models()
+
+        queues = {}
+        for task in api._model_query('tasks', 'state = "pending"'):
+            queues.setdefault(int(task['node_id']), []).append(task['id'])
+
+        for queue in queues.values():
+            queue.sort()
+
+        self.queues = queues
+
+    def changed(self, model, object_ids, node_ids=None, keys=None):
+        """change journal listener"""
+        if model != 'tasks' or self.queues is None:
+            # not loaded yet; the load will see this change
+            return
+
+        for task_id, node_id in zip(object_ids, node_ids or []):
+            if node_id is None:
+                continue
+
+            queue = self.queues.setdefault(int(node_id), [])
+            index = bisect.bisect_left(queue, task_id)
+            if index == len(queue) or queue[index] != task_id:
+                queue.insert(index, task_id)
+
+    def pending(self, node_id, limit=1, api=None):
+        """
+        Get up to limit pending tasks for node_id, oldest first.
+        """
+        if api is None:
+            api = api_from_models()
+
+        if self.queues is None:
+            self.load(api)
+
+        node_id = int(node_id)
+        queue = self.queues.get(node_id, [])
+        result = []
+        index = 0
+
+        while index < len(queue) and len(result) < limit:
+            try:
+                task = api._model_get_by_id('tasks', queue[index])
+            except exceptions.IdNotFound:
+                task = None
+
+            if task is None or task['state'] != 'pending' or \
+                    int(task['node_id']) != node_id:
+                queue.pop(index)
+                self.stats['dropped'] += 1
+                continue
+
+            result.append(task)
+            index += 1
+
+        if not queue:
+            self.queues.pop(node_id, None)
+
+        self.stats['dispatched'] += len(result)
+        return result
+
+    def next_task(self, node_id, api=None):
+        """the oldest pending task for node_id, or None"""
+        tasks = self.pending(node_id, 1, api)
+        if tasks:
+            return tasks[0]
+        return None
@@ -23,10 +23,13 @@
 #
 ##############################################################################
 
-import time
+import base64
+import json
+import urllib
 
 import flask
 import gevent
+import gevent.util
 
 from opencenter.db import exceptions
 from opencenter.db.api import api_from_models
@@ -86,9 +89,188 @@ def http_conflict(result=409, msg=None, **kwargs):
     return http_response(result, msg, **kwargs)
 
 
+def request_variant():
+    """
+    the request's query string, normalized, for telling apart the
+    representations of one version of an object or collection
+    """
+    args = sorted(flask.request.args.items(multi=True))
+    return urllib.urlencode([(k.encode('utf-8'), v.encode('utf-8'))
+                             for k, v in args])
+
+
+def http_not_modified(etag):
+    """
+    Returns a 304 response if the request's If-None-Match matches
+    etag, otherwise None.
+    """
+    if etag is None or not flask.request.if_none_match.contains(etag):
+        return None
+
+    resp = flask.current_app.response_class(status=304)
+    resp.set_etag(etag)
+    return resp
+
+
+def requested_fields(object_type, api=None):
+    """
+    Parse the fields= request argument, a comma separated list like
+    "id,name,facts.parent_id".  A dotted name picks single keys out
+    of a dict valued field such as facts or attrs.
+
+    Returns:
+    None if no fields were asked for, else
+    {field: None (the whole field) or set(keys)}
+
+    Raises:
+    ValueError -- on a field the model doesn't have
+    """
+    value = flask.request.args.get('fields')
+    if value is None:
+        return None
+
+    if api is None:
+        api = api_from_models()
+
+    columns = api._model_get_columns(object_type)
+    fields = {}
+
+    for name in [x.strip() for x in value.split(',') if x.strip()]:
+        field, _, key = name.partition('.')
+        if not field in columns:
+            raise ValueError('unknown field %s' % field)
+
+        if not key:
+            fields[field] = None
+        elif fields.get(field, set()) is not None:
+            fields.setdefault(field, set()).add(key)
+
+    return fields
+
+
+def project(obj, fields):
+    """
+    Trim obj to the fields returned by requested_fields().
+    """
+    if fields is None:
+        return obj
+
+    result = {}
+    for field, keys in fields.items():
+        if not field in obj:
+            continue
+
+        if keys is None or not isinstance(obj[field], dict):
+            result[field] = obj[field]
+        else:
+            result[field] = dict([(k, obj[field][k]) for k in keys
+                                  if k in obj[field]])
+    return result
+
+
+def requested_ids():
+    """
+    Parse the ids= request argument, a comma separated list of ids.
+
+    Returns:
+    None if no ids were asked for, else a list of integer ids
+
+    Raises:
+    ValueError -- on an id that isn't an integer
+    """
+    value = flask.request.args.get('ids')
+    if value is None:
+        return None
+
+    try:
+        return [int(x) for x in value.split(',') if x.strip()]
+    except ValueError:
+        raise ValueError('ids must be integers')
+
+
+def encode_cursor(sort, descending, obj):
+    """
+    Make the opaque cursor for the page following obj.
+    """
+    return base64.urlsafe_b64encode(
+        json.dumps([sort, descending, obj.get(sort), obj['id']]))
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+    (sort, descending, (sort value, id)) from an encode_cursor() cursor
+
+    Raises:
+    ValueError -- on a cursor we didn't make
+    """
+    try:
+        sort, descending, value, last_id = json.loads(
+            base64.urlsafe_b64decode(str(cursor)))
+        return sort, bool(descending), (value, int(last_id))
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor')
+
+
+def requested_page():
+    """
+    Parse the limit=, sort= and cursor= request arguments.  sort
+    names a field, prefixed with "-" to sort descending.
+
+    Returns:
+    None if the request isn't paged, else a dict of limit, sort,
+    descending and after, for api._model_get_page
+
+    Raises:
+    ValueError -- on bad arguments
+    """
+    args = flask.request.args
+    if not [x for x in ('limit', 'sort', 'cursor') if x in args]:
+        return None
+
+    page = {'limit': None, 'sort': 'id', 'descending': False, 'after': None}
+
+    if 'limit' in args:
+        try:
+            page['limit'] = int(args['limit'])
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        if page['limit'] < 1:
+            raise ValueError('limit must be positive')
+
+        page['limit'] = min(page['limit'],
+                            int(flask.current_app.config['max_page_size']))
+
+    if 'sort' in args:
+        page['sort'] = args['sort'].lstrip('-')
+        page['descending'] = args['sort'].startswith('-')
+
+    if 'cursor' in args:
+        sort, descending, page['after'] = decode_cursor(args['cursor'])
+        if 'sort' in args and (sort, descending) != (page['sort'],
+                                                     page['descending']):
+            raise ValueError('cursor does not match sort')
+        page['sort'] = sort
+        page['descending'] = descending
+
+    return page
+
+
+def next_page_url(cursor):
+    args = [(k, v) for k, v in flask.request.args.items(multi=True)
+            if k != 'cursor']
+    args.append(('cursor', cursor))
+    return '%s?%s' % (flask.request.base_url, urllib.urlencode(args))
+
+
 def _notify(updated_object, object_type, object_id):
     semaphore = '%s-id-%s' % (object_type, object_id)
-    utility.notify(semaphore)
+    utility.notify(semaphore, ids=[object_id])
+
+    if object_type == 'tasks' and updated_object is not None and \
+            updated_object.get('node_id') is not None:
+        utility.notify('task-for-%s' % updated_object['node_id'],
+                       ids=[updated_object['id']])
 
     # TODO: Generalize the block of code with a TODO below here.
 #    if updated_object is not None and object_type in related_notifications:
@@ -97,74 +279,147 @@ def _notify(updated_object, object_type, object_id):
 #                semaphore = '%s-id-%s' % (entity, updated_object[field])
 #                utility.notify(semaphore)
 
-    # TODO (wilk or rpedde): Use specific notifications for inheritance
-    if object_type not in ('attrs', 'facts', 'nodes'):
-        return
-    try:
-        node_id = updated_object['node_id']
-        node = None
-    except KeyError:
-        node_id = updated_object['id']
-        node = updated_object
-    if object_type != "attrs":
-        api = api_from_models()
-        # We're just going to notify every child when containers are updated
-        if node is None:
-            try:
-                node = api._model_get_by_id('nodes', node_id)
-            except (exceptions.IdNotFound):
-                return
-
-        if 'container' in node['facts'].get('backends', []):
-            children = utility.get_direct_children(node, api)
-            for child in children:
-                semaphore = 'nodes-id-%s' % child['id']
-                utility.notify(semaphore)
-        # Update transaction for node and children
-        id_list = utility.fully_expand_nodelist([node], api)
-        # TODO(shep): this needs to be better abstracted
-    # Need a codepath to update transaction for attr modifications
-    else:
-        # TODO(shep): this needs to be better abstracted
-        id_list = [node_id]
-    _update_transaction_id('nodes', id_list)
+    # the subtree fan-out and transaction records are batched
+    flask.current_app.notifier.queue(updated_object, object_type, object_id)
 
 
-def _update_transaction_id(object_model, id_list=None):
+def _update_transaction_id(object_model, id_list=None, node_ids=None):
     """
-    Updates the in-memory transaction dict when object_models are updated.
+    Updates the in-memory transaction log when object_models are updated,
+    bypassing the notification window.
 
     Arguments:
     id_list -- A list of <object_model>_ids
+    node_ids -- The nodes the changed objects belong to, passed
+                along to change stream subscribers.  Defaults to
+                id_list for nodes.
 
     Returns:
     None
     """
     if id_list is not None:
-        trans = flask.current_app.transactions[object_model]
-        trans_time = time.time()
-        lock_name = '%s-txid' % object_model
+        flask.current_app.notifier.record(object_model, id_list, node_ids)
+
+
+def changed_keys(transactions, txid, api=None):
+    """
+    Work out which fact and attr keys changed on each node after
+    txid, for diff style update deltas.
+
+    Returns:
+    {node_id: {'facts': set(keys), 'attrs': set(keys)}}, or None if
+    that can't be known -- for instance a fact was deleted, and its
+    key went with it.
+    """
+    if api is None:
+        api = api_from_models()
+
+    result = {}
+    for model in ('facts', 'attrs'):
+        changes = transactions.changes_since(model, txid)
+        if changes is None:
+            return None
+
+        for _, ids in changes:
+            for object_id in ids:
+                try:
+                    obj = api._model_get_by_id(model, object_id)
+                except exceptions.IdNotFound:
+                    return None
+
+                keys = result.setdefault(obj['node_id'],
+                                         {'facts': set(), 'attrs': set()})
+                keys[model].add(obj['key'])
+    return result
 
-        utility.lock_acquire(lock_name)
 
+def _inherits_change(api, node_id, node_keys, changed):
+    """
+    Whether node_id's inherited facts may have changed, because it
+    was reparented or one of its ancestors is among changed.
+    """
+    if 'parent_id' in node_keys['facts']:
+        return True
+
+    seen = set([int(node_id)])
+    current = node_id
+    while True:
+        parent = api._model_query(
+            'facts', 'key="parent_id" and node_id=%d' % int(current))
+        if len(parent) != 1 or parent[0]['value'] is None:
+            return False
+
+        current = int(parent[0]['value'])
+        if current in seen:
+            return False
+        if current in changed:
+            return True
+        seen.add(current)
+
+
+def updates_delta(object_type, ids, mode, budget, keys=None, api=None):
+    """
+    Build the delta embedded in an updates response, so clients
+    need not GET each changed object.
+
+    Arguments:
+    mode -- 'objects' embeds each changed object.  'diff' embeds,
+            for nodes listed in keys, only the node's own fields and
+            the fact and attr keys that changed; any other node is
+            sent whole, as is a node that was reparented or has a
+            changed ancestor, since its inherited facts may differ.
+    budget -- approximate limit on the serialized size of the
+              embedded objects.  Objects past the budget are left out,
+              and complete is false: the client should GET those by id.
+    keys -- result of changed_keys(), for 'diff' mode
+
+    Returns:
+    dict with mode, objects, deleted (ids that no longer exist) and
+    complete
+    """
+    if api is None:
+        api = api_from_models()
+
+    if mode != 'diff':
+        keys = None
+
+    objects = []
+    deleted = []
+    size = 0
+    complete = True
+
+    changed = set([int(x) for x in ids])
+    if keys is not None:
+        changed.update([int(x) for x in keys])
+
+    for object_id in sorted(ids):
         try:
-            while trans_time in trans:
-                trans_time += 0.000001
+            obj = api._model_get_by_id(object_type, object_id)
+        except exceptions.IdNotFound:
+            deleted.append(object_id)
+            continue
 
-            trans[trans_time] = set(id_list)
-        except:
-            utility.lock_release(lock_name)
-            raise
+        if keys is not None and object_id in keys and \
+                not _inherits_change(api, object_id, keys[object_id],
+                                     changed):
+            diff = dict([(k, v) for k, v in obj.items()
+                         if k not in ('facts', 'attrs')])
+            for field in ('facts', 'attrs'):
+                diff[field] = dict([(k, obj[field].get(k))
+                                    for k in keys[object_id][field]])
+            obj = diff
 
-        utility.lock_release(lock_name)
+        size += len(json.dumps(obj))
+        if size > budget:
+            complete = False
+            break
 
-        # prune any updates > 5 min ago
-        trans_time_past = trans_time - (60 * 5)
-        for k in [x for x in trans.keys() if x < trans_time_past]:
-            del trans[k]
+        objects.append(obj)
 
-        semaphore_name = '%s-changes' % object_model
-        utility.notify(semaphore_name)
+    return {'mode': mode,
+            'objects': objects,
+            'deleted': deleted,
+            'complete': complete}
 
 
 @requires_auth()
@@ -187,8 +442,74 @@ def list(object_type):
         return http_response(201, '%s Created' % s_obj.capitalize(),
                              ref=href, **{s_obj: model_object})
     elif flask.request.method == 'GET':
-        model_objects = api._model_get_all(object_type)
-        return http_response(200, 'success', **{object_type: model_objects})
+        try:
+            fields = requested_fields(object_type, api)
+            page = requested_page()
+            ids = requested_ids()
+        except ValueError as e:
+            return http_badrequest(msg=str(e))
+
+        if ids is not None and page is not None:
+            return http_badrequest(msg='ids cannot be paged')
+
+        # take the version before reading, so a racing write can
+        # only make the etag too old, never too new
+        etag = flask.current_app.versions.etag(object_type,
+                                               variant=request_variant())
+        not_modified = http_not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+        query_fields = fields
+        if fields is not None:
+            # ids, and the sort key for a cursor, are needed even
+            # when not asked for
+            query_fields = dict(fields)
+            query_fields.setdefault('id', None)
+            if page is not None:
+                query_fields.setdefault(page['sort'], None)
+
+        extra = {}
+        if ids is not None:
+            model_objects = api._model_get_many(object_type, ids,
+                                                fields=query_fields)
+            found = set([x['id'] for x in model_objects])
+            extra['missing'] = [x for x in ids if not x in found]
+
+            if fields is not None:
+                model_objects = [project(x, fields) for x in model_objects]
+        elif page is not None:
+            limit = page['limit']
+
+            try:
+                # fetch one extra to see if there's another page
+                model_objects = api._model_get_page(
+                    object_type, None if limit is None else limit + 1,
+                    page['sort'], page['descending'], page['after'],
+                    fields=query_fields)
+            except ValueError as e:
+                return http_badrequest(msg=str(e))
+
+            if limit is not None and len(model_objects) > limit:
+                model_objects = model_objects[:limit]
+                extra['next'] = next_page_url(encode_cursor(
+                    page['sort'], page['descending'], model_objects[-1]))
+
+            if fields is not None:
+                model_objects = [project(x, fields) for x in model_objects]
+        elif fields is None:
+            model_objects = api._model_get_all(object_type)
+        else:
+            model_objects = [project(x, fields) for x in
+                             api._model_get_all(object_type, fields=fields)]
+
+        extra[object_type] = model_objects
+        resp = http_response(200, 'success', **extra)
+        if 'next' in extra:
+            resp.headers['Link'] = '<%s>; rel="next"' % extra['next']
+        if etag is not None:
+            resp.set_etag(etag)
+        return resp
     else:
         return http_notfound(msg='Unknown method %s' % flask.request.method)
 
@@ -229,13 +550,30 @@ def object_by_id(object_type, object_id):
             utility.wait(semaphore)
 
         try:
-            model_object = api._model_get_by_id(object_type, object_id)
+            fields = requested_fields(object_type, api)
+        except ValueError as e:
+            return http_badrequest(msg=str(e))
+
+        etag = flask.current_app.versions.etag(object_type, object_id,
+                                               variant=request_variant())
+        not_modified = http_not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+        try:
+            model_object = api._model_get_by_id(object_type, object_id,
+                                                fields=fields)
         except exceptions.IdNotFound:
             return http_notfound(msg='not found')
         except exceptions.IdInvalid:
             return http_badrequest()
 
-        return http_response(200, 'success', **{s_obj: model_object})
+        model_object = project(model_object, fields)
+
+        resp = http_response(200, 'success', **{s_obj: model_object})
+        if etag is not None:
+            resp.set_etag(etag)
+        return resp
     else:
         return http_notfound(msg='Unknown method %s' % flask.request.method)
 
@@ -246,11 +584,14 @@ def http_solver_request(node_id, constraints,
     if api is None:
         api = api_from_models()
 
+    search = flask.current_app.config['solver_search']
+    pool = flask.current_app.solver_pool
+
     subtask = gevent.spawn(
         gevent.util.wrap_errors(
             (ValueError, exceptions.IdNotFound),
             utility.solve_and_run), node_id,
-        constraints, api, plan)
+        constraints, api, plan, search, pool)
     gevent.sleep(0)
 
     st_result = subtask.get(block=True, timeout=None)
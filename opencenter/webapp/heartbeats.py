@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import logging
+import time
+
+import gevent
+
+from opencenter.db.api import api_from_models
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Heartbeats(object):
+    """
+    Agent checkins, kept in memory and written to the last_checkin
+    attr of each node in batches.
+
+    Every tasks_blocking poll is a checkin.  Writing each one as an
+    attr meant a create with full validation and a commit per poll,
+    and a change notification that woke every dashboard.  Instead
+    checkins are held here and flushed every interval seconds, in
+    one transaction, so last_checkin lags by at most interval.
+
+    Flushed checkins are journaled and announced as changes to the
+    'checkins' model rather than 'attrs', so they stay out of the
+    attrs change feed.  Clients that want them ask the change stream
+    for models=checkins.
+
+    With an interval of 0, every checkin is written as it arrives.
+    """
+
+    model = 'checkins'
+    key = 'last_checkin'
+
+    def __init__(self, notifier, interval=10, batch_size=500):
+        self.notifier = notifier
+        self.interval = float(interval)
+        self.batch_size = int(batch_size)
+        self.greenlet = None
+
+        # node_id -> checkin time, waiting to be written
+        self.pending = {}
+
+        self.stats = {'beats': 0,
+                      'flushes': 0,
+                      'written': 0}
+
+    def beat(self, node_id, when=None, api=None):
+        """
+        Record a checkin from node_id.
+
+        Raises:
+        IdInvalid, IdNotFound -- as for a node lookup
+        """
+        if api is None:
+            api = api_from_models()
+
+        # only the id is needed, so this skips fact inheritance
+        node = api._model_get_by_id('nodes', node_id, fields=['id'])
+
+        if when is None:
+            when = time.time()
+
+        self.pending[int(node['id'])] = int(when)
+        self.stats['beats'] += 1
+
+        if self.interval <= 0:
+            self.flush(api)
+
+    def flush(self, api=None):
+        """
+        Write out pending checkins, returning the number written.
+        If a write fails, the checkins not yet written are kept for
+        the next flush.
+        """
+        if api is None:
+            api = api_from_models()
+
+        pending, self.pending = self.pending, {}
+        node_ids = sorted(pending.keys())
+
+        written = 0
+        done = 0
+        try:
+            for start in range(0, len(node_ids), self.batch_size):
+                batch = dict([(x, pending[x]) for x in
+                              node_ids[start:start + self.batch_size]])
+                rows = api._model_set_key_values('attrs', self.key, batch,
+                                                 journal_as=self.model)
+                done = start + len(batch)
+                if rows:
+                    self.notifier.record(self.model, [x[0] for x in rows],
+                                         [x[1] for x in rows])
+                written += len(rows)
+        except:
+            # keep the rest, without clobbering newer checkins
+            for node_id in node_ids[done:]:
+                self.pending[node_id] = max(pending[node_id],
+                                            self.pending.get(node_id, 0))
+            raise
+
+        if node_ids:
+            self.stats['flushes'] += 1
+            self.stats['written'] += written
+
+        return written
+
+    def _run(self):
+        while True:
+            gevent.sleep(self.interval)
+
+            try:
+                self.flush()
+            except Exception as e:
+                LOG.error('error writing checkins: %s' % str(e))
+
+    def start(self):
+        if self.greenlet is None and self.interval > 0:
+            self.greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        if self.greenlet is not None:
+            self.greenlet.kill()
+            self.greenlet = None
+
+        # don't lose the checkins since the last flush
+        try:
+            self.flush()
+        except Exception as e:
+            LOG.error('error writing checkins: %s' % str(e))
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import time
+
+import flask
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+object_type = 'metrics'
+bp = flask.Blueprint(object_type, __name__)
+
+# Counters for code that runs outside of any one request, like the
+# filter language and the api cache.  They are keyed on
+# (name, label), label being None for unlabelled counters.
+counters = {}
+
+# upper bounds, in seconds, of the request latency histogram buckets
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_listening = []
+
+
+def incr(name, count=1, label=None):
+    key = (name, label)
+    counters[key] = counters.get(key, 0) + count
+
+
+def _count_statement(*args):
+    if flask.has_request_context():
+        flask.g.db_statements = getattr(flask.g, 'db_statements', 0) + 1
+
+
+class Metrics(object):
+    """
+    Request counts and latencies per route, requests in flight (most
+    of which are agents and streams in a long poll), database
+    statements per request, and the counters above.
+
+    Latencies are measured to when the view returns, so a streamed
+    response counts as done once its first byte is ready.
+    """
+
+    def __init__(self):
+        # (blueprint, route, method) -> counts, latency histogram
+        self.routes = {}
+        # route -> requests in progress
+        self.in_flight = {}
+
+        if not _listening:
+            event.listen(Engine, 'before_cursor_execute', _count_statement)
+            _listening.append(True)
+
+    def install(self, app):
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    def _route(self):
+        rule = flask.request.url_rule
+        if rule is None:
+            return None, 'unmatched'
+        return flask.request.blueprint, rule.rule
+
+    def before_request(self):
+        blueprint, route = self._route()
+        flask.g.metrics_start = time.time()
+        flask.g.db_statements = 0
+        self.in_flight[route] = self.in_flight.get(route, 0) + 1
+
+    def teardown_request(self, exc=None):
+        start = getattr(flask.g, 'metrics_start', None)
+        if start is None:
+            # failed before before_request got to run
+            return
+
+        elapsed = time.time() - start
+        blueprint, route = self._route()
+        self.in_flight[route] -= 1
+
+        key = (blueprint, route, flask.request.method)
+        stats = self.routes.get(key)
+        if stats is None:
+            stats = {'count': 0,
+                     'errors': 0,
+                     'latency_sum': 0.0,
+                     'latency_buckets': [0] * len(latency_buckets),
+                     'db_statements': 0}
+            self.routes[key] = stats
+
+        stats['count'] += 1
+        if exc is not None:
+            stats['errors'] += 1
+        stats['latency_sum'] += elapsed
+        stats['db_statements'] += flask.g.db_statements
+        for index, bound in enumerate(latency_buckets):
+            if elapsed <= bound:
+                stats['latency_buckets'][index] += 1
+                break
+
+    def snapshot(self, components=None):
+        """
+        All the metrics as a dict.  components maps names to objects
+        with a stats dict (the task reaper, notifier and so on), which
+        are included as they are.
+        """
+        routes = []
+        for (blueprint, route, method), stats in sorted(self.routes.items()):
+            cumulative = []
+            total = 0
+            for count in stats['latency_buckets']:
+                total += count
+                cumulative.append(total)
+
+            routes.append({
+                'blueprint': blueprint,
+                'route': route,
+                'method': method,
+                'count': stats['count'],
+                'errors': stats['errors'],
+                'latency_sum': stats['latency_sum'],
+                'latency_mean': stats['latency_sum'] / stats['count'],
+                'latency_buckets': dict(
+                    [(str(bound), cumulative[x])
+                     for x, bound in enumerate(latency_buckets)]),
+                'db_statements': stats['db_statements'],
+                'db_statements_per_request': (
+                    stats['db_statements'] / float(stats['count']))})
+
+        labelled = {}
+        for (name, label), count in counters.items():
+            if label is None:
+                labelled[name] = count
+            else:
+                labelled.setdefault(name, {})[label] = count
+
+        return {'routes': routes,
+                'in_flight': dict([(k, v) for k, v in self.in_flight.items()
+                                   if v]),
+                'counters': labelled,
+                'components': dict(
+                    [(name, dict(component.stats))
+                     for name, component in (components or {}).items()])}
+
+
+def _prometheus(snapshot):
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append('# HELP opencenter_%s %s' % (name, help_text))
+        lines.append('# TYPE opencenter_%s %s' % (name, kind))
+
+    def sample(name, value, **labels):
+        label_text = ','.join(
+            ['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+             for k, v in sorted(labels.items()) if v is not None])
+        if label_text:
+            label_text = '{%s}' % label_text
+        lines.append('opencenter_%s%s %s' % (name, label_text, value))
+
+    routes = snapshot['routes']
+
+    metric('http_requests_total', 'counter', 'Requests handled.')
+    for x in routes:
+        sample('http_requests_total', x['count'], blueprint=x['blueprint'],
+               route=x['route'], method=x['method'])
+
+    metric('http_request_errors_total', 'counter',
+           'Requests that raised an exception.')
+    for x in routes:
+        sample('http_request_errors_total', x['errors'],
+               blueprint=x['blueprint'], route=x['route'],
+               method=x['method'])
+
+    metric('http_request_duration_seconds', 'histogram',
+           'Time to produce a response.')
+    for x in routes:
+        labels = {'blueprint': x['blueprint'],
+                  'route': x['route'],
+                  'method': x['method']}
+        for bound in latency_buckets:
+            sample('http_request_duration_seconds_bucket',
+                   x['latency_buckets'][str(bound)], le=bound, **labels)
+        sample('http_request_duration_seconds_bucket', x['count'],
+               le='+Inf', **labels)
+        sample('http_request_duration_seconds_sum', x['latency_sum'],
+               **labels)
+        sample('http_request_duration_seconds_count', x['count'], **labels)
+
+    metric('http_request_db_statements_total', 'counter',
+           'Database statements run by requests.')
+    for x in routes:
+        sample('http_request_db_statements_total', x['db_statements'],
+               blueprint=x['blueprint'], route=x['route'],
+               method=x['method'])
+
+    metric('http_requests_in_flight', 'gauge',
+           'Requests in progress, long polls included.')
+    for route, count in sorted(snapshot['in_flight'].items()):
+        sample('http_requests_in_flight', count, route=route)
+
+    for name, value in sorted(snapshot['counters'].items()):
+        metric('%s_total' % name, 'counter', name.replace('_', ' ') + '.')
+        if isinstance(value, dict):
+            for label, count in sorted(value.items()):
+                sample('%s_total' % name, count, model=label)
+        else:
+            sample('%s_total' % name, value)
+
+    for component, stats in sorted(snapshot['components'].items()):
+        for stat, value in sorted(stats.items()):
+            if isinstance(value, (int, long, float)):
+                name = '%s_%s' % (component, stat)
+                metric(name, 'gauge', '%s %s.' % (component, stat))
+                sample(name, value)
+
+    return '\n'.join(lines) + '\n'
+
+
+@bp.route('/', methods=['GET'])
+def root():
+    # the filter language and db layer count things here, so this
+    # module can't import generic (and through it the db api) up top
+    from opencenter.webapp import generic
+
+    app = flask.current_app
+    snapshot = app.metrics.snapshot({'task_reaper': app.task_reaper,
+                                     'notifier': app.notifier,
+                                     'heartbeats': app.heartbeats,
+                                     'dispatcher': app.dispatcher,
+                                     'availability': app.availability,
+                                     'solver_pool': app.solver_pool})
+
+    wanted = flask.request.args.get('format')
+    if wanted is None:
+        best = flask.request.accept_mimetypes.best_match(
+            ['application/json', 'text/plain'])
+        wanted = 'prometheus' if best == 'text/plain' else 'json'
+
+    if wanted == 'prometheus':
+        return flask.Response(_prometheus(snapshot),
+                              mimetype='text/plain; version=0.0.4')
+    if wanted != 'json':
+        return generic.http_badrequest(msg='unknown format %s' % wanted)
+
+    return generic.http_response(metrics=snapshot)
@@ -29,7 +29,6 @@ import time
 
 from opencenter.db import exceptions
 from opencenter.db.api import api_from_models
-from opencenter.webapp import ast
 # from opencenter.webapp import auth
 from opencenter.webapp import generic
 from opencenter.webapp import utility
@@ -50,91 +49,119 @@ def by_id(object_id):
     return generic.object_by_id(object_type, object_id)
 
 
+def _requested_max():
+    """
+    Parse the max= argument agents pass to take several pending
+    tasks at once.  Returns None without it, or the number of tasks
+    to take, capped at max_task_delivery.
+    """
+    if not 'max' in flask.request.args:
+        return None
+
+    try:
+        count = int(flask.request.args['max'])
+    except ValueError:
+        raise ValueError('max must be an integer')
+    if count < 1:
+        raise ValueError('max must be positive')
+
+    return min(count, int(flask.current_app.config['max_task_delivery']))
+
+
+def _deliver(api, tasks):
+    """mark tasks delivered, in one transaction"""
+    tasks = api._model_update_many('tasks', [x['id'] for x in tasks],
+                                   {'state': 'delivered'})
+    for task in tasks:
+        generic._notify(task, 'tasks', task['id'])
+    return tasks
+
+
 @bp.route('/<node_id>/tasks_blocking', methods=['GET'])
 def tasks_blocking_by_node_id(node_id):
     api = api_from_models()
 
+    try:
+        count = _requested_max()
+    except ValueError as e:
+        return generic.http_badrequest(msg=str(e))
+
     # README(shep): Using last_checkin attr for agent-health
-    timestamp = int(time.time())
-    args = {'node_id': node_id, 'key': 'last_checkin', 'value': timestamp}
     try:
-        r = api.attr_create(args)
+        flask.current_app.heartbeats.beat(node_id, api=api)
     except exceptions.IdNotFound:
-        message = 'Node %s not found.' % args['node_id']
+        message = 'Node %s not found.' % node_id
         return generic.http_notfound(msg=message)
     except exceptions.IdInvalid:
         return generic.http_badrequest()
-    #DB does not hit updater, so we need to notify
-    generic._update_transaction_id('nodes', id_list=[node_id])
-    generic._update_transaction_id('attrs', id_list=[r['id']])
-
-    while True:
-        task = api.task_get_first_by_query("node_id=%d and state='pending'" %
-                                           int(node_id))
-        if task is None:
-            semaphore = 'task-for-%s' % node_id
+
+    # subscribe before looking, so a task posted between the
+    # lookup and the wait still wakes us
+    dispatcher = flask.current_app.dispatcher
+    semaphore = 'task-for-%s' % node_id
+    deadline = time.time() + 30
+
+    with utility.subscribe(semaphore) as subscription:
+        tasks = dispatcher.pending(node_id, count or 1, api)
+
+        while not tasks:
             flask.current_app.logger.debug('waiting on %s' % semaphore)
-            if not utility.wait(semaphore):
-                flask.current_app.logger.error("ERROR ON WAIT")
-                # utility.clear(semaphore)
+            if subscription.get(max(0, deadline - time.time())) is None:
                 return generic.http_notfound(msg='no task found')
-            else:
-                flask.current_app.logger.error("SUCCESS ON WAIT")
-        else:
-            # utility.clear(semaphore)
-            return generic.http_response(task=task)
 
-    #         utility.wait(semaphore)
+            tasks = dispatcher.pending(node_id, count or 1, api)
 
-    # task = api.task_get_first_by_query("node_id=%d and state='pending'" %
-    #                                    int(node_id))
-    # if task:
-    #     utility.clear(semaphore)
-    #     result = flask.jsonify({'task': task})
-    # else:
-    #     result = generic.http_notfound(msg='no task found')
-    # return result
+    if count is None:
+        return generic.http_response(task=tasks[0])
+
+    # several at once are marked delivered, or the next poll
+    # would hand them out again
+    return generic.http_response(tasks=_deliver(api, tasks))
 
 
 @bp.route('/<node_id>/tasks', methods=['GET'])
 def tasks_by_node_id(node_id):
     api = api_from_models()
+
+    try:
+        count = _requested_max()
+    except ValueError as e:
+        return generic.http_badrequest(msg=str(e))
+
     # Display only tasks with state=pending
-    task = api.task_get_first_by_query("node_id=%d and state='pending'" %
-                                       int(node_id))
+    try:
+        if count is not None:
+            tasks = flask.current_app.dispatcher.pending(node_id, count, api)
+            if not tasks:
+                return generic.http_notfound()
+            return generic.http_response(tasks=_deliver(api, tasks))
+
+        task = flask.current_app.dispatcher.next_task(node_id, api)
+    except ValueError:
+        return generic.http_badrequest()
+
     if not task:
         return generic.http_notfound()
     else:
         resp = generic.http_response(task=task)
         task['state'] = 'delivered'
-        api._model_update_by_id('tasks', task['id'], task)
+        task = api._model_update_by_id('tasks', task['id'], task)
+        generic._notify(task, 'tasks', task['id'])
         return resp
 
 
 @bp.route('/<node_id>/adventures', methods=['GET'])
 def adventures_by_node_id(node_id):
     api = api_from_models()
-    node = api.node_get_by_id(node_id)
-    if not node:
+    try:
+        available_adventures = flask.current_app.availability.available(
+            node_id, api)
+    except exceptions.IdNotFound:
         return generic.http_notfound()
-    else:
-        all_adventures = api.adventures_get_all()
-        available_adventures = []
-        for adventure in all_adventures:
-            builder = ast.FilterBuilder(ast.FilterTokenizer(),
-                                        adventure['criteria'],
-                                        api=api)
-            try:
-                root_node = builder.build()
-                if root_node.eval_node(node, builder.functions):
-                    available_adventures.append(adventure)
-            except Exception as e:
-                flask.current_app.logger.warn(
-                    'adv err %s: %s' % (adventure['name'], str(e)))
-
-        # adventures = api.adventures_get_by_node_id(node_id)
-        resp = flask.jsonify({'adventures': available_adventures})
-    return resp
+    except exceptions.IdInvalid:
+        return generic.http_badrequest()
+
+    return flask.jsonify({'adventures': available_adventures})
 
 
 def _whoami_backwards_compatibility(api, hostname):
@@ -143,10 +170,8 @@ def _whoami_backwards_compatibility(api, hostname):
     node = api.node_get_first_by_query(query)
     if node is None:
         return
-    api._model_create('attrs',
-                      {'node_id': node['id'],
-                       'key': 'registered',
-                       'value': True})
+    api._model_update_keys('nodes', node['id'],
+                           {'attrs': {'registered': True}})
     return node
 
 
@@ -170,26 +195,18 @@ def whoami():
         else:
             node = _whoami_backwards_compatibility(api, hostname)
             if node is None:
-                node = api._model_create('nodes', {'name': hostname})
-                api._model_create('facts',
-                                  {'node_id': node['id'],
-                                   'key': 'backends',
-                                   'value': ['node', 'agent']})
-                api._model_create('attrs',
-                                  {'node_id': node['id'],
-                                   'key': 'converged',
-                                   'value': True})
-                api._model_create('attrs',
-                                  {'node_id': node['id'],
-                                   'key': 'registered',
-                                   'value': False})
+                node = api._model_create_with_keys(
+                    'nodes', {'name': hostname},
+                    {'facts': {'backends': ['node', 'agent']},
+                     'attrs': {'converged': True,
+                               'registered': False}})
             return generic.http_response(200, 'Node ID assigned.',
                                          node_id=node['id'])
     log.info('Node id %s received.' % node_id)
     try:
         node = api._model_get_by_id('nodes', node_id)
     except exceptions.IdNotFound:
-        message = 'Node %s not found.' % node['node_id']
+        message = 'Node %s not found.' % node_id
         return generic.http_notfound(msg=message)
     except exceptions.IdInvalid:
         return generic.http_badrequest('Node ID must be an integer.')
@@ -210,31 +227,21 @@ def whoami():
             log.error('Unable to read server ID from %s.' % reg_file)
             server_id = None
         try:
-            server_node = api._model_get_by_id('nodes', server_id)
+            server_node = api._model_get_by_id('nodes', server_id,
+                                               fields=['id'])
         except (exceptions.IdInvalid, exceptions.IdNotFound):
             #log this as an error and assume agent not on server
             log.error('Server ID from in %s is invalid.' % reg_file)
             server_node = {'id': None}
+        # parent it and mark it registered in one transaction
+        keys = {'attrs': {'registered': True}}
         if server_node['id'] == node['id']:
-            api._model_create('facts',
-                              {'node_id': node['id'],
-                               'key': 'parent_id',
-                               'value': 3})
-            api._model_create('attrs',
-                              {'node_id': node['id'],
-                              'key': 'server-agent',
-                              'value': True})
+            keys['facts'] = {'parent_id': 3}
+            keys['attrs']['server-agent'] = True
         else:
             unprovisioned_id = unprovisioned_container()['id']
-            api._model_create('facts',
-                              {'node_id': node['id'],
-                               'key': 'parent_id',
-                               'value': unprovisioned_id})
-        #update registered attr to True
-        attr_query = "node_id=%d and key='registered'" % node['id']
-        reg_attr = api.attr_get_first_by_query(attr_query)
-        reg_attr['value'] = True
-        api._model_update_by_id('attrs', reg_attr['id'], reg_attr)
+            keys['facts'] = {'parent_id': unprovisioned_id}
+        api._model_update_keys('nodes', node['id'], keys)
         node = api._model_get_by_id('nodes', node['id'])
         log.info('Registration complete for %s' % node_id)
     return generic.http_response(200, 'success', **{'node': node})
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import logging
+
+import gevent
+
+from opencenter.db.api import api_from_models
+from opencenter.webapp import utility
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Notifier(object):
+    """
+    Queues change notifications and fans them out in batches.
+
+    A fact or node write changes the whole subtree below that node
+    (through inheritance), so each one used to look the node up,
+    wake every direct child and expand the subtree with a query per
+    container.  Instead, writes are queued for window seconds.  The
+    batch then builds a parent -> children index with one query and
+    does a single fan-out, however many writes it holds.
+
+    With a window of 0, every write is flushed as it is queued.
+    Readers that need to see every change (/updates) call flush()
+    first.
+    """
+
+    def __init__(self, transactions, window=0):
+        self.transactions = transactions
+        self.window = window
+        self.greenlet = None
+
+        # model -> {node_id: set of changed ids}
+        self.pending = {}
+        # nodes whose subtrees changed
+        self.expand = set()
+        # nodes that changed by themselves (attrs don't inherit)
+        self.touched = set()
+
+        self.stats = {'queued': 0,
+                      'flushes': 0}
+
+    def queue(self, updated_object, object_type, object_id):
+        if updated_object is None:
+            return
+
+        self.stats['queued'] += 1
+
+        # record the change against the object's own model, so
+        # <model>/updates and the change stream see facts, attrs
+        # and tasks too.  Nodes are recorded with their subtree.
+        if object_type != 'nodes':
+            by_node = self.pending.setdefault(object_type, {})
+            by_node.setdefault(updated_object.get('node_id'), set()).add(
+                updated_object.get('id', object_id))
+
+        if object_type == 'nodes':
+            self.expand.add(updated_object['id'])
+        elif object_type == 'facts':
+            self.expand.add(updated_object['node_id'])
+        elif object_type == 'attrs':
+            self.touched.add(updated_object['node_id'])
+
+        if self.window <= 0:
+            self.flush()
+        elif self.greenlet is None:
+            self.greenlet = gevent.spawn_later(self.window, self._run)
+
+    def record(self, model, ids, node_ids=None):
+        """
+        Record a transaction and wake anyone waiting on changes
+        to model.  This is not deferred.
+        """
+        if not model in self.transactions:
+            return
+
+        txid = self.transactions.record(model, ids)
+
+        if node_ids is None and model == 'nodes':
+            node_ids = ids
+
+        semaphore_name = '%s-changes' % model
+        if utility.notify(semaphore_name, ids=list(ids), txid=str(txid),
+                          model=model,
+                          node_ids=[] if node_ids is None else
+                          list(node_ids)):
+            # subscribers on the change stream now hold this txid
+            self.transactions.issue()
+
+    def _run(self):
+        try:
+            self.flush()
+        except Exception:
+            LOG.exception('error flushing notifications')
+
+    def flush(self):
+        if self.greenlet is not None:
+            if self.greenlet is not gevent.getcurrent():
+                self.greenlet.kill(block=False)
+            self.greenlet = None
+
+        pending, self.pending = self.pending, {}
+        expand, self.expand = self.expand, set()
+        touched, self.touched = self.touched, set()
+
+        if not (pending or expand or touched):
+            return
+
+        self.stats['flushes'] += 1
+
+        # one transaction per model and node, so change stream
+        # subscribers filtering by node can tell which ids are whose
+        for model, by_node in pending.items():
+            for node_id, ids in by_node.items():
+                self.record(model, ids,
+                            [] if node_id is None else [node_id])
+
+        if not (expand or touched):
+            return
+
+        subtree = set(touched)
+
+        if expand:
+            index = utility.children_index(api_from_models())
+
+            # children inherit from their parent, so wake them
+            for node_id in expand:
+                for child in index.get(node_id, ()):
+                    utility.notify('nodes-id-%s' % child, ids=[child])
+
+            subtree.update(utility.expand_subtree(index, expand))
+
+        self.record('nodes', subtree)
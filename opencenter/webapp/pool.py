@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import logging
+import multiprocessing
+import re
+
+import gevent
+import gevent.event
+
+from opencenter.db import api as db_api
+from opencenter.webapp import metrics
+from opencenter.webapp import solver
+from opencenter.webapp import utility
+
+
+LOG = logging.getLogger(__name__)
+
+
+def _start_worker():
+    solver.cooperative = False
+
+
+def _solve(snapshot, node_id, constraints, plan, search):
+    # runs in a worker process.  Errors are handed back rather than
+    # raised, since the pool only calls back on success.
+    before = dict(metrics.counters)
+
+    try:
+        api = db_api.api_from_snapshot(snapshot)
+        result = utility.solve_for_node(node_id, constraints, api=api,
+                                        plan=plan, search=search)
+    except Exception as e:
+        return None, {}, e
+
+    # hand back what the solve counted, for the server's metrics
+    counted = dict([(x, metrics.counters[x] - before.get(x, 0))
+                    for x in metrics.counters
+                    if metrics.counters[x] != before.get(x, 0)])
+
+    return result, counted, None
+
+
+# ifcount() of a literal interface name
+_ifcount = re.compile(r"""ifcount\(\s*(?:"([^"]*)"|'([^']*)')\s*\)""")
+
+
+def _interfaces_counted(expressions):
+    """
+    The interfaces expressions count the nodes of with ifcount(), or
+    None if they could read any node at all.
+    """
+    interfaces = set()
+    for expression in expressions:
+        expression = str(expression)
+        if 'filter(' in expression:
+            return None
+
+        counted = _ifcount.findall(expression)
+        if len(counted) != expression.count('ifcount('):
+            # counting an interface named at run time
+            return None
+        interfaces.update([x or y for x, y in counted])
+
+    return interfaces
+
+
+def solve_nodes(api, node_id, constraints):
+    """
+    The ids of the nodes a solve for node_id can read: the node, the
+    nodes that can satisfy an interface argument of any primitive
+    (the servers and containers it may be bound to) or that ifcount()
+    counts, and all their ancestors, which they inherit facts from.
+    None if the solve could read any node at all.
+    """
+    interfaces = _interfaces_counted(constraints)
+    if interfaces is None:
+        return None
+
+    for primitive in api._model_get_all('primitives'):
+        counted = _interfaces_counted(
+            (primitive.get('constraints') or []) +
+            (primitive.get('consequences') or []))
+        if counted is None:
+            return None
+        interfaces.update(counted)
+
+        for arg in (primitive.get('args') or {}).values():
+            if arg.get('type') == 'interface':
+                interfaces.add(arg['name'])
+
+    wanted = set([int(node_id)])
+    for name in interfaces:
+        query = 'filter_type="interface" and name="%s"' % name
+        for iface in api._model_query('filters', query):
+            wanted.update([int(x['id']) for x in
+                           api._model_query('nodes', iface['full_expr'])])
+
+    node_ids = set()
+    for node_id in wanted:
+        while node_id is not None and not node_id in node_ids:
+            node_ids.add(node_id)
+            parent = api._model_get_first_by_query(
+                'facts', 'key="parent_id" and node_id=%d' % node_id)
+            node_id = None
+            if parent is not None and parent['value'] is not None:
+                node_id = int(parent['value'])
+
+    return node_ids
+
+
+class SolverPool(object):
+    """
+    Worker processes to run solves in.
+
+    A solve is pure computation, yielding to other greenlets only
+    now and then, so a long one in the server process holds up every
+    request, long poll and agent checkin behind it.  In the pool,
+    each solve gets a snapshot of the nodes it can read (see
+    solve_nodes) with their facts and attrs, and of the filters and
+    primitives, and runs in a worker process.  The request greenlet
+    waits for the pool to call back, so the rest of the server
+    carries on, and a multi core controller can run as many solves
+    at once as it has workers.  A solve taking longer than timeout
+    seconds is given up on, though the worker runs it to the end.
+
+    With a size of 0, solves run in the server process as before.
+    """
+
+    def __init__(self, size=0, timeout=300):
+        self.size = int(size)
+        self.timeout = float(timeout)
+        self.pool = None
+
+        self.stats = {'workers': 0,
+                      'solves': 0,
+                      'in_process': 0,
+                      'timeouts': 0}
+
+    def start(self):
+        if self.pool is None and self.size > 0:
+            self.pool = multiprocessing.Pool(self.size,
+                                             initializer=_start_worker)
+            self.stats['workers'] = self.size
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.stats['workers'] = 0
+
+    def solve(self, node_id, constraints, api=None, plan=None,
+              search='breadth'):
+        """
+        Solve as utility.solve_for_node, in a worker if there are
+        any, returning (is_solvable, requires_input, solution_plan).
+
+        Raises:
+        ValueError, IdNotFound -- as solve_for_node, or ValueError
+                                  if the solve timed out
+        """
+        if self.pool is None:
+            self.stats['in_process'] += 1
+            return utility.solve_for_node(node_id, constraints, api=api,
+                                          plan=plan, search=search)
+
+        if api is None:
+            api = db_api.api_from_models()
+
+        snapshot = db_api.snapshot_from_api(
+            api, node_ids=solve_nodes(api, node_id, constraints))
+
+        # the pool calls back from a thread of its own, which can
+        # only wake the hub through an async watcher
+        outcome = []
+        done = gevent.event.AsyncResult()
+        wakeup = gevent.get_hub().loop.async()
+        wakeup.start(lambda: done.set(outcome[0]))
+
+        def callback(value):
+            outcome.append(value)
+            wakeup.send()
+
+        self.stats['solves'] += 1
+        try:
+            self.pool.apply_async(_solve, (snapshot, node_id, constraints,
+                                           plan, search),
+                                  callback=callback)
+            done.wait(self.timeout)
+        finally:
+            wakeup.stop()
+
+        if not done.ready():
+            self.stats['timeouts'] += 1
+            raise ValueError('solve timed out after %d seconds' %
+                             self.timeout)
+
+        result, counted, error = done.get()
+        if error is not None:
+            raise error
+
+        for (name, label), count in counted.items():
+            metrics.incr(name, count, label=label)
+
+        return result
@@ -23,7 +23,8 @@
 #
 ##############################################################################
 
-import copy
+import heapq
+import itertools
 import logging
 import re
 
@@ -32,18 +33,48 @@ import gevent
 import opencenter.backends
 from opencenter.db import api as db_api
 from opencenter.webapp import ast
+from opencenter.webapp import metrics
+
+
+def fingerprint(constraints, applied_consequences):
+    """
+    Identify a solver state by what has been applied and what is
+    left to solve, whatever order they came in.
+    """
+    return (frozenset(applied_consequences), frozenset(constraints))
+
+
+# whether a solve yields to other greenlets as it goes.  A solver
+# worker process (see pool.py) turns this off, as the greenlets it
+# inherits from the server are not its to run.
+cooperative = True
+
+
+def _yield():
+    if cooperative:
+        gevent.sleep(0)
+
+
+# ways solve() can walk the search tree: level by level, taking
+# the first plan found, or cheapest first by primitive weight.
+searches = ('breadth', 'weighted')
+
+# the weighted search gives up after expanding this many states
+max_expansions = 1000
 
 
 class Solver:
     def __init__(self, api, node_id, constraints,
                  parent=None, prim=None, ns=None, applied_consequences=None):
 
-        self.constraints = copy.deepcopy([api.regularize_expression(x)
-                                          for x in constraints])
+        # constraints and consequences are strings, so tuples of
+        # them can be shared down the tree without copying
+        self.constraints = tuple([api.regularize_expression(x)
+                                  for x in constraints])
         self.node_id = node_id
         self.base_api = api
-        self.applied_consequences = copy.deepcopy(applied_consequences) if \
-            applied_consequences is not None else []
+        self.applied_consequences = tuple(applied_consequences) if \
+            applied_consequences is not None else ()
 
         self.children = []
         classname = self.__class__.__name__.lower()
@@ -54,21 +85,52 @@ class Solver:
         self.adventures = []
         self.ns = ns if ns is not None else {}
 
+        # states already reached anywhere in this search, and how
+        # much searching it took, shared by the whole tree
+        if parent is None:
+            self.table = {}
+            self.stats = {'generated': 1, 'expanded': 0, 'pruned': 0}
+        else:
+            self.table = parent.table
+            self.stats = parent.stats
+
+        # total weight of the primitives taken to get here
+        self.cost = 0
+        if parent is not None:
+            self.cost = parent.cost
+        if prim is not None:
+            self.cost += int(prim['weight'])
+
         self.logger.info('New solver for constraints %s' % constraints)
         self.logger.info('With applied constraints %s' % applied_consequences)
 
         # roll the applied consequences forward in an ephemeral
-        # api, and do our resolution from that.
-        self.api = db_api.ephemeral_api_from_api(self.base_api)
+        # api, and do our resolution from that.  A child builds on
+        # its parent's state, so only its own consequences are new.
+        inherited = ()
+        if parent is not None:
+            inherited = parent.applied_consequences
+
+        if parent is not None and \
+                self.applied_consequences[:len(inherited)] == inherited:
+            self.api = db_api.layered_api_from_api(parent.api)
+            consequences = self.applied_consequences[len(inherited):]
+        else:
+            self.api = db_api.ephemeral_api_from_api(self.base_api)
+            consequences = self.applied_consequences
+
         pre_node = self.api._model_get_by_id('nodes', self.node_id)
 
-        for consequence in self.applied_consequences:
+        for consequence in consequences:
             node = self.api._model_get_by_id('nodes', self.node_id)
             ast.apply_expression(node, consequence, self.api)
 
         # get rid of constraints we've already solved
-        self.constraints = [x for x in self.constraints if not
-                            self._constraint_satisfied(x)]
+        self.constraints = tuple([x for x in self.constraints if not
+                                  self._constraint_satisfied(x)])
+
+        if parent is None:
+            self.table[self.fingerprint()] = self
 
         node = self.api._model_get_by_id('nodes', self.node_id)
 
@@ -100,10 +162,18 @@ class Solver:
 
         self.logger.debug('Node before applying consequences: %s' % pre_node)
         self.logger.debug('Applied consequences: %s' %
-                          self.applied_consequences)
+                          list(self.applied_consequences))
         # ephemeral_node = self.api._model_get_by_id('nodes', self.node_id)
         self.logger.debug('Node after applying consequences: %s' % node)
 
+    def fingerprint(self):
+        return fingerprint(self.constraints, self.applied_consequences)
+
+    def _cheaper(self, key, cost):
+        """whether cost beats every way to state key found so far"""
+        known = self.table.get(key)
+        return known is None or cost < known.cost
+
     @classmethod
     def from_plan(cls, api, node_id, constraints, plan,
                   applied_consequences=None):
@@ -398,19 +468,25 @@ class Solver:
         self.logger.debug('Answer: %s' % valid_solutions)
         return valid_solutions
 
-    def solve_one(self, proposed_plan=None):
+    def solve_one(self, proposed_plan=None, first_solution=True):
         """
         run a single pass of the solver, trying to find all the
         available primitives that can solve any existing constraint.
+
+        With first_solution, it stops at (and returns) the first
+        child that solves everything, otherwise all children are
+        made.
         """
 
         self.logger.debug("solving %s with plan %s" % (self.constraints,
                                                        proposed_plan))
+        self.stats['expanded'] += 1
+
         # first, build up asts of all my unsolved constraints
         constraint_list = self._build_constraints(self.constraints)
 
         # fix/regularize our internal constraint list
-        self.constraints = [x['constraint'] for x in constraint_list]
+        self.constraints = tuple([x['constraint'] for x in constraint_list])
 
         self.logger.info('New solver for constraints: %s (plan: %s)' %
                          (self.constraints, proposed_plan))
@@ -527,15 +603,15 @@ class Solver:
 
         for solution in candidate_solutions:
             # yield for gevent
-            gevent.sleep(0)
+            _yield()
 
             self.logger.info("%s with %s, solving %s" %
                              (solution['primitive']['name'],
                               solution['ns'],
                               solution['solves']))
 
-            constraints = copy.deepcopy(self.constraints)
-            applied_consequences = copy.deepcopy(self.applied_consequences)
+            constraints = list(self.constraints)
+            applied_consequences = list(self.applied_consequences)
 
             # if not solution['solves'] in constraints:
             #     raise RuntimeError('constraint disappeared?!?!')
@@ -622,15 +698,38 @@ class Solver:
                 #     applied_consequences.append(concrete_consequence)
                 #     constraints.remove(solution['solves'])
 
+                # a plan is followed step by step, so only a search
+                # can skip states it has already been through, unless
+                # this is a cheaper way there
+                key = fingerprint(constraints + new_constraints,
+                                  applied_consequences)
+                cost = self.cost + int(solution['primitive']['weight'])
+                if proposed_plan is None and not self._cheaper(key, cost):
+                    self.logger.info(' - already reached this state')
+                    self.stats['pruned'] += 1
+                    continue
+
                 self.logger.info(' - Implementing as new solve step: %s' %
                                  constraints)
                 new_solver = Solver(self.base_api, self.node_id,
                                     constraints + new_constraints, self,
                                     solution['primitive'], ns=solution['ns'],
                                     applied_consequences=applied_consequences)
+                self.stats['generated'] += 1
+
+                if proposed_plan is None:
+                    # constraints the node already meets are dropped
+                    # once applied, which can land on a known state
+                    settled = new_solver.fingerprint()
+                    self.table[key] = new_solver
+                    if settled != key and not self._cheaper(settled, cost):
+                        self.logger.info(' - already reached this state')
+                        self.stats['pruned'] += 1
+                        continue
+                    self.table[settled] = new_solver
 
                 self.children.append(new_solver)
-                if new_solver.constraints == []:
+                if first_solution and not new_solver.constraints:
                     return new_solver
 
         return None
@@ -647,7 +746,7 @@ class Solver:
                 '  ' * level, self.applied_consequences))
         else:
             self.logger.info('ROOT NODE')
-            self.logger.info('Constraints: %s' % self.constraints)
+            self.logger.info('Constraints: %s' % list(self.constraints))
 
         self.logger.info('%s (with %d children)' % (
             '  ' * level, len(self.children)))
@@ -665,23 +764,16 @@ class Solver:
 
         return False
 
-    def solve(self):
+    def _search_breadth(self):
         """
-        Try to solve a set of constraints.  This sets up the
-        initial constraint set, then splays all the possible
-        primitives that move us close to solution.  Then it
-        walks through all those in series to bring another
-        solution generation, so on until one of the solution
-        plans is successful, or there are no more primitives
-        to consider moving us toward the goal.
+        Splay all the possible primitives that move us closer to
+        solution, then walk through all those in series to bring
+        another solution generation, so on until one of the
+        solution plans is successful, or there are no more
+        primitives to consider moving us toward the goal.
 
-        It returns (is_solvable, requires_input, plan), where
-        solvable is the ability to solve the plan without any
-        input, requires_input describes the ability to solve
-        the plan if given some additional input, and plan is
-        the considered solve plan
+        Returns the solved node, or None.
         """
-
         top_level = self
         current_leaves = [self]
         solution_node = None
@@ -692,7 +784,7 @@ class Solver:
             for leaf in current_leaves:
                 solution_node = leaf.solve_one()
                 # yeild to gevent
-                gevent.sleep(0)
+                _yield()
                 if solution_node:
                     break
 
@@ -717,6 +809,107 @@ class Solver:
                 current_leaves = new_leaves
                 top_level.print_tree()
 
+        return solution_node
+
+    def _estimate(self, cheapest):
+        """
+        Weight still to pay, never more than it will be: at least
+        one more primitive while any constraint is left, none once
+        they are all met.
+        """
+        if len(self.constraints) > 0:
+            return cheapest
+        return 0
+
+    def _search_weighted(self):
+        """
+        Expand the cheapest state first, by the weight of the
+        primitives taken to reach it plus an estimate of the weight
+        still to pay.  The estimate never overshoots, so the first
+        solved state off the queue is the cheapest plan, and states
+        that can't beat a solution already found are dropped rather
+        than expanded.  After max_expansions states, the cheapest
+        solution found so far is taken, if there is one.
+
+        Returns the solved node, or None.
+        """
+        primitives = [x for x in self._get_all_primitives()
+                      if x['consequences'] != []]
+        if not primitives:
+            return None
+
+        cheapest = min([int(x['weight']) for x in primitives])
+
+        order = itertools.count()
+        queue = [(self._estimate(cheapest), next(order), self)]
+        best = None
+        expansions = 0
+
+        while queue:
+            estimate, _, state = heapq.heappop(queue)
+
+            if state.found_solution():
+                return state
+
+            if best is not None and estimate >= best.cost:
+                self.stats['pruned'] += 1
+                continue
+
+            # a cheaper way to this state was found since it was queued
+            if self.table.get(state.fingerprint()) is not state:
+                continue
+
+            if expansions >= max_expansions:
+                self.logger.warn('giving up after expanding %d states' %
+                                 expansions)
+                return best
+
+            expansions += 1
+            state.solve_one(first_solution=False)
+            # yeild to gevent
+            _yield()
+
+            for child in state.children:
+                estimate = child.cost + child._estimate(cheapest)
+                if child.found_solution():
+                    if best is None or child.cost < best.cost:
+                        best = child
+                elif best is not None and estimate >= best.cost:
+                    self.stats['pruned'] += 1
+                    continue
+
+                heapq.heappush(queue, (estimate, next(order), child))
+
+        return None
+
+    def solve(self, search='breadth'):
+        """
+        Try to solve a set of constraints, searching for a plan
+        with one of the searches: 'breadth' returns the first plan
+        found, 'weighted' the one with the least primitive weight.
+
+        It returns (is_solvable, requires_input, plan), where
+        solvable is the ability to solve the plan without any
+        input, requires_input describes the ability to solve
+        the plan if given some additional input, and plan is
+        the considered solve plan
+        """
+
+        if search == 'weighted':
+            solution_node = self._search_weighted()
+        elif search == 'breadth':
+            solution_node = self._search_breadth()
+        else:
+            raise ValueError('unknown solver search "%s"' % search)
+
+        top_level = self
+
+        self.logger.info('generated %d states, expanded %d, pruned %d' %
+                         (self.stats['generated'], self.stats['expanded'],
+                          self.stats['pruned']))
+        for stat in ('generated', 'expanded', 'pruned'):
+            metrics.incr('solver_states_%s' % stat, self.stats[stat])
+
         if solution_node:
             self.logger.debug('BEFORE BACKPRUNING')
             top_level.print_tree()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+
+import flask
+
+from opencenter.db import exceptions
+from opencenter.db.api import api_from_models
+from opencenter.webapp import ast
+from opencenter.webapp import generic
+from opencenter.webapp import utility
+from opencenter.webapp.auth import requires_auth
+
+
+# Server-Sent Events change stream.  Rather than looping on
+# /<model>/updates/<session_key>/<txid>?poll, a client holds one
+# connection open and is pushed an event per change:
+#
+#   id: <session_key>:<txid>
+#   event: <model>
+#   data: {"model": ..., "ids": [...], "node_ids": [...], "txid": ...}
+#
+# On reconnect, the Last-Event-ID header resumes from the last event
+# seen.  If that transaction is no longer known (server restart,
+# expired txid) a 'reset' event is sent, and the client should refetch.
+object_type = 'stream'
+bp = flask.Blueprint(object_type, __name__)
+
+stream_models = ['nodes', 'facts', 'attrs', 'tasks']
+
+
+def _format_event(event_type, data, event_id=None, retry=None):
+    lines = []
+    if retry is not None:
+        lines.append('retry: %d' % retry)
+    if event_id is not None:
+        lines.append('id: %s' % event_id)
+    lines.append('event: %s' % event_type)
+    lines.append('data: %s' % json.dumps(data))
+    return '\n'.join(lines) + '\n\n'
+
+
+class StreamFilter(object):
+    """
+    Decides which change events a stream subscriber sees.
+
+    Events are matched on the nodes they touch: either nodes matching
+    a filter language expression, or nodes in the subtree rooted at a
+    given node.  Nodes that no longer exist always match, so that
+    deletes are not swallowed.
+    """
+
+    def __init__(self, api, expression=None, root_id=None):
+        self.api = api
+        self.root = None
+        self.root_id = root_id
+        self.subtree = None
+
+        if expression is not None:
+            self.root = ast.FilterBuilder(ast.FilterTokenizer(),
+                                          expression, api=api).build()
+
+    def _get_subtree(self):
+        if self.subtree is None:
+            self.subtree = set(utility.fully_expand_nodelist(
+                [self.root_id], self.api))
+        return self.subtree
+
+    def match_node(self, node_id):
+        try:
+            node = self.api._model_get_by_id('nodes', node_id)
+        except exceptions.IdNotFound:
+            return True
+
+        if self.root_id is not None and \
+                node['id'] not in self._get_subtree():
+            return False
+
+        if self.root is not None and not self.root.eval_node(node):
+            return False
+
+        return True
+
+    def apply(self, event):
+        """
+        Returns the event to send (possibly trimmed to the matching
+        node ids), or None if the subscriber should not see it.
+        """
+        if self.root is None and self.root_id is None:
+            return event
+
+        if event['model'] == 'nodes':
+            # reparenting changes which nodes are in the subtree
+            self.subtree = None
+            ids = [x for x in event['ids'] if self.match_node(x)]
+            if not ids:
+                return None
+            return dict(event, ids=ids, node_ids=ids)
+
+        if any(self.match_node(x) for x in event['node_ids']):
+            return event
+
+        return None
+
+
+def _node_ids(api, model, ids):
+    if model == 'nodes':
+        return list(ids)
+
+    node_ids = set()
+    for object_id in ids:
+        try:
+            obj = api._model_get_by_id(model, object_id)
+        except exceptions.IdNotFound:
+            continue
+        if obj.get('node_id') is not None:
+            node_ids.add(obj['node_id'])
+    return list(node_ids)
+
+
+def _backlog(api, transactions, models, txid):
+    """
+    Collect the changes after txid as a list of events, oldest
+    first.  Returns None if txid is expired or unknown.
+    """
+    changes = []
+    for model in models:
+        model_changes = transactions.changes_since(model, txid)
+        if model_changes is None:
+            return None
+        changes.extend((tx, model, ids) for tx, ids in model_changes)
+
+    changes.sort()
+    return [{'model': model,
+             'ids': list(ids),
+             'node_ids': _node_ids(api, model, ids),
+             'txid': str(tx)} for tx, model, ids in changes]
+
+
+def _emit(event, session_key):
+    return _format_event(event['model'],
+                         {'model': event['model'],
+                          'ids': event['ids'],
+                          'node_ids': event['node_ids'],
+                          'txid': event['txid'],
+                          'session_key': session_key},
+                         event_id='%s:%s' % (session_key, event['txid']))
+
+
+def _stream(subscription, session_key, preamble, backlog,
+            stream_filter, keepalive):
+    if preamble:
+        yield preamble
+
+    # the subscription is opened before the backlog is read, so a
+    # change landing in between shows up in both
+    sent_txid = None
+    for event in backlog:
+        sent_txid = int(event['txid'])
+        event = stream_filter.apply(event)
+        if event is not None:
+            yield _emit(event, session_key)
+
+    while True:
+        events = subscription.get_all(keepalive)
+
+        if not events:
+            # comment lines keep proxies from timing out the connection
+            yield ': keepalive\n\n'
+
+        for event in events:
+            if sent_txid is not None and int(event['txid']) <= sent_txid:
+                continue
+            event = stream_filter.apply(event)
+            if event is not None:
+                yield _emit(event, session_key)
+
+
+@bp.route('/', methods=['GET'])
+@requires_auth()
+def stream():
+    app = flask.current_app
+    api = api_from_models()
+    args = flask.request.args
+
+    models = stream_models
+    if 'models' in args:
+        models = [x.strip() for x in args['models'].split(',')]
+        for model in models:
+            if not model in app.transactions:
+                return generic.http_badrequest(
+                    msg='cannot stream changes for %s' % model)
+
+    root_id = None
+    if 'node' in args:
+        try:
+            root_id = int(args['node'])
+            api._model_get_by_id('nodes', root_id)
+        except ValueError:
+            return generic.http_badrequest(msg='node must be an id')
+        except exceptions.IdNotFound:
+            return generic.http_notfound(msg='node not found')
+
+    try:
+        stream_filter = StreamFilter(api, args.get('filter'), root_id)
+    except SyntaxError as e:
+        return generic.http_badrequest(msg='bad filter: %s' % e)
+
+    # get queued changes into the log, so they count as history,
+    # then subscribe before looking at the log, so nothing that
+    # lands in between is missed
+    app.notifier.flush()
+    subscription = utility.subscribe(*['%s-changes' % x for x in models])
+
+    session_key = app.transactions.session_key
+    current_txid = str(app.transactions.issue())
+    last_event_id = flask.request.headers.get('Last-Event-ID',
+                                              args.get('last_event_id'))
+
+    preamble_type = 'transaction'
+    backlog = []
+
+    if last_event_id:
+        backlog = None
+        last_session, _, last_txid = last_event_id.partition(':')
+        if last_session == session_key:
+            try:
+                backlog = _backlog(api, app.transactions, models,
+                                   int(last_txid))
+            except ValueError:
+                pass
+
+        if backlog is None:
+            # we can't tell what the client missed
+            preamble_type = 'reset'
+            backlog = []
+        else:
+            # resume from the last event the client saw
+            preamble_type = None
+
+    preamble = None
+    if preamble_type is not None:
+        preamble = _format_event(preamble_type,
+                                 {'session_key': session_key,
+                                  'txid': current_txid},
+                                 event_id='%s:%s' % (session_key,
+                                                     current_txid),
+                                 retry=int(app.config['stream_retry']))
+
+    response = flask.Response(
+        _stream(subscription, session_key, preamble, backlog, stream_filter,
+                float(app.config['stream_keepalive'])),
+        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.call_on_close(subscription.close)
+    return response
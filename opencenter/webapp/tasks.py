@@ -35,74 +35,125 @@ import netifaces
 from opencenter.db import exceptions
 from opencenter.db.api import api_from_models
 from opencenter.webapp import generic
-from opencenter.webapp import utility
 
 object_type = 'tasks'
 bp = flask.Blueprint(object_type, __name__)
 watched_tasks = {}
-task_last_run = 0
 
+LOG = logging.getLogger(__name__)
 
-def _clean_tasks():
-    """
-    clean up completed tasks over task_reaping_threshold seconds old.
-    This is set in the [main] section of the config.  The default is
-    300 seconds (5 min).
 
-    This will not run more often than once per minute.
+class TaskReaper(object):
+    """
+    move completed tasks over task_reaping_threshold seconds old
+    out of the tasks table and into the task archive, and delete
+    archived tasks over task_archive_retention seconds old.  These
+    are set in the [main] section of the config.  The defaults are
+    1800 seconds (30 min) and 604800 seconds (7 days).  A retention
+    of 0 keeps archived tasks forever.
+
+    Reaping runs in a background greenlet every task_reaping_interval
+    seconds, moving at most task_reaping_batch_size tasks per
+    statement so a large backlog never holds the db for long.
     """
 
-    current_time = time.time()
-    if current_time < task_last_run + 60:
-        return
-
-    api = api_from_models()
+    def __init__(self, threshold=1800, interval=60, batch_size=500,
+                 retention=604800):
+        self.threshold = int(threshold)
+        self.interval = int(interval)
+        self.batch_size = int(batch_size)
+        self.retention = int(retention)
+        self.greenlet = None
+        self.stats = {'runs': 0,
+                      'reaped': 0,
+                      'purged': 0,
+                      'last_run': 0,
+                      'last_reaped': 0,
+                      'last_purged': 0,
+                      'last_duration': 0.0}
+
+    def _batched(self, f, query):
+        total = 0
+        while True:
+            count = f(query)
+            total += count
+            if count < self.batch_size:
+                return total
+
+            # let waiting requests in between batches
+            gevent.sleep(0)
+
+    def reap(self, current_time=None):
+        """
+        archive expired tasks and purge expired archives in
+        batches, returning the number of tasks archived
+        """
+        api = api_from_models()
+        start_time = time.time()
+
+        if current_time is None:
+            current_time = start_time
+        current_time = int(current_time)
+
+        expiration_threshold = current_time - self.threshold
+        query = '(state = "done" or state = "cancelled" or ' \
+                'state = "timeout") and completed < %d' % \
+                expiration_threshold
+
+        reaped = self._batched(
+            lambda q: api._model_move_by_query(
+                object_type, 'archives', q, self.batch_size,
+                {'archived': current_time}), query)
+
+        purged = 0
+        if self.retention > 0:
+            query = 'archived < %d' % (current_time - self.retention)
+            purged = self._batched(
+                lambda q: api._model_delete_by_query(
+                    'archives', q, self.batch_size), query)
+
+        self.stats['runs'] += 1
+        self.stats['reaped'] += reaped
+        self.stats['purged'] += purged
+        self.stats['last_run'] = int(start_time)
+        self.stats['last_reaped'] = reaped
+        self.stats['last_purged'] = purged
+        self.stats['last_duration'] = time.time() - start_time
+
+        if reaped > 0 or purged > 0:
+            LOG.info('archived %d tasks, purged %d archived tasks in %.3fs' %
+                     (reaped, purged, self.stats['last_duration']))
+
+        return reaped
+
+    def _run(self):
+        while True:
+            try:
+                self.reap()
+            except Exception as e:
+                LOG.error('error reaping tasks: %s' % str(e))
 
-    reaping_threshold = flask.current_app.config['task_reaping_threshold']
-    expiration_threshold = current_time - int(reaping_threshold)
+            gevent.sleep(self.interval)
 
-    expired_tasks = api._model_query(
-        object_type,
-        '(state = "done" or state="cancelled") '
-        'and completed < %d' %
-        expiration_threshold)
+    def start(self):
+        if self.greenlet is None:
+            self.greenlet = gevent.spawn(self._run)
 
-    for task in expired_tasks:
-        api._model_delete_by_id(object_type, task['id'])
+    def stop(self):
+        if self.greenlet is not None:
+            self.greenlet.kill()
+            self.greenlet = None
 
 
 @bp.route('/', methods=['GET', 'POST'])
 def list():
-    _clean_tasks()
-
-    result = generic.list(object_type)
-
-    if flask.request.method == 'POST':
-        data = flask.request.json
-        if 'node_id' in data:
-            task_semaphore = 'task-for-%s' % data['node_id']
-            flask.current_app.logger.debug('notifying event %s' %
-                                           task_semaphore)
-            utility.notify(task_semaphore)
-
-    return result
+    # task-for-<node_id> waiters are woken by generic._notify
+    return generic.list(object_type)
 
 
 @bp.route('/<object_id>', methods=['GET', 'PUT', 'DELETE'])
 def task_by_id(object_id):
-    result = generic.object_by_id(object_type, object_id)
-
-    if flask.request.method == 'PUT':
-        api = api_from_models()
-        task = api.task_get_by_id(object_id)
-        if 'node_id' in task:
-            flask.current_app.logger.debug('Task: %s' % task)
-            task_semaphore = 'task-for-%s' % task['node_id']
-            flask.current_app.logger.debug('notifying event %s' %
-                                           task_semaphore)
-            utility.notify(task_semaphore)
-
-    return result
+    return generic.object_by_id(object_type, object_id)
 
 
 @bp.route('/<task_id>/logs', methods=['GET'])
@@ -190,10 +241,7 @@ def task_log(task_id):
     new_task = api._model_create('tasks', payload)
 
     # this should really be done by the data model.  <sigh>
-    task_semaphore = 'task-for-%s' % task['node_id']
-    flask.current_app.logger.debug('notifying event %s' %
-                                   task_semaphore)
-    utility.notify(task_semaphore)
+    generic._notify(new_task, 'tasks', new_task['id'])
 
     # # force the wake
     # utility.sleep(0.1)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import bisect
+import random
+import string
+import time
+
+from opencenter.db import journal
+from opencenter.webapp import utility
+
+
+class ModelLog(object):
+    """
+    Append-only log of the ids changed in a single model, ordered
+    by transaction sequence number.
+
+    Entries live in parallel lists starting at self.head.  Pruning
+    just advances head, and the dead prefix is sliced off once it
+    is at least half the list, so pruning is O(1) amortized.  Every
+    change after self.base is still in the log.
+    """
+
+    def __init__(self, base):
+        self.seqs = []
+        self.times = []
+        self.ids = []
+        self.head = 0
+        self.base = base
+
+    def __len__(self):
+        return len(self.seqs) - self.head
+
+    def append(self, seq, when, ids, merge=False):
+        if merge and len(self) > 0:
+            # no client holds a txid between the last entry and this
+            # one, so nobody can tell them apart.  Fold them together.
+            self.seqs[-1] = seq
+            self.times[-1] = when
+            self.ids[-1].update(ids)
+        else:
+            self.seqs.append(seq)
+            self.times.append(when)
+            self.ids.append(set(ids))
+
+    def prune(self, before):
+        head = self.head
+        while head < len(self.seqs) and self.times[head] < before:
+            self.base = self.seqs[head]
+            head += 1
+
+        if head > 16 and head * 2 >= len(self.seqs):
+            del self.seqs[:head]
+            del self.times[:head]
+            del self.ids[:head]
+            head = 0
+
+        self.head = head
+
+    def changes_since(self, seq):
+        """
+        Returns a list of (seq, ids) for the changes after seq,
+        or None if changes after seq may already have been pruned.
+        """
+        if seq < self.base:
+            return None
+
+        start = max(self.head, bisect.bisect_right(self.seqs, seq))
+        return [(self.seqs[x], self.ids[x])
+                for x in xrange(start, len(self.seqs))]
+
+
+class TransactionLog(object):
+    """
+    Ordered in-memory change history for the /<model>/updates
+    endpoints and the change stream.
+
+    Transaction ids are integers from a single sequence shared by
+    every model, so a txid from /updates is valid against any of
+    them.  Changes older than max_age seconds are pruned, after which
+    a txid from before them is expired.
+
+    The log remembers the newest txid handed to a client (issue()).
+    Changes recorded after that are merged into one entry until
+    another txid is issued, because no client could ask for the
+    interval between them.
+    """
+
+    def __init__(self, max_age=300, session_key=None):
+        if session_key is None:
+            session_key = ''.join([random.choice(string.hexdigits)
+                                   for n in xrange(30)])
+        self.session_key = session_key
+        self.max_age = max_age
+        self.seq = 1
+        self.issued = self.seq
+        self.logs = {}
+
+    def __contains__(self, model):
+        return model in self.logs
+
+    def __getitem__(self, model):
+        return self.logs[model]
+
+    def add_model(self, model):
+        if not model in self.logs:
+            self.logs[model] = ModelLog(self.seq)
+
+    def issue(self):
+        """
+        Returns the current txid, noting that a client may
+        refer back to it.
+        """
+        self.issued = self.seq
+        return self.seq
+
+    def record(self, model, ids, when=None):
+        """
+        Record a change to ids in model, returning its txid.
+        """
+        if when is None:
+            when = time.time()
+
+        log = self.logs[model]
+        merge = len(log) > 0 and log.seqs[-1] > self.issued
+
+        self.seq += 1
+        log.append(self.seq, when, ids, merge=merge)
+        log.prune(when - self.max_age)
+        return self.seq
+
+    def changes_since(self, model, txid):
+        """
+        Returns a list of (txid, ids) for changes to model after txid,
+        or None if txid is expired or unknown.
+        """
+        if txid > self.seq:
+            return None
+        return self.logs[model].changes_since(txid)
+
+    def ids_since(self, model, txid):
+        """
+        Returns the set of ids in model changed after txid,
+        or None if txid is expired or unknown.
+        """
+        return _union(self.changes_since(model, txid))
+
+
+class JournalLog(object):
+    """
+    Change history served from the durable change journal (the
+    changes table), with the same interface as TransactionLog.
+
+    Txids are journal sequence numbers, written in the same database
+    transaction as the change, so they survive a restart.  The
+    session key is derived from the database, not the process, so
+    clients resume from their last txid instead of resyncing.
+
+    Node changes are expanded the way the notifier does it: a node or
+    fact change covers the node's whole subtree, an attr change only
+    the node itself.  A txid more than max_changes behind is treated
+    as expired, so the client resyncs.
+    """
+
+    def __init__(self, session_key, retention=86400, prune_interval=60,
+                 batch_size=500, max_changes=10000):
+        self.session_key = session_key
+        self.max_changes = max_changes
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.batch_size = batch_size
+        self.last_prune = 0
+        self.models = set()
+
+    def __contains__(self, model):
+        return model in self.models
+
+    def add_model(self, model):
+        self.models.add(model)
+
+    def issue(self):
+        return journal.latest_seq()
+
+    def record(self, model, ids, when=None):
+        """
+        The change is already journaled by the time anyone is
+        notified, so this just returns the current txid, pruning
+        the journal every prune_interval seconds on the way.
+        """
+        if when is None:
+            when = time.time()
+
+        if self.retention > 0 and \
+                when - self.last_prune >= self.prune_interval:
+            self.last_prune = when
+            journal.prune(int(when - self.retention), self.batch_size)
+
+        return journal.latest_seq()
+
+    def changes_since(self, model, txid):
+        """
+        Returns a list of (txid, ids) for changes to model after txid,
+        or None if txid is expired or unknown.
+        """
+        latest = journal.latest_seq()
+        if txid > latest:
+            # from a different (or reset) database
+            return None
+        if txid == latest:
+            return []
+        if txid < journal.first_seq() - 1:
+            # changes after txid have been pruned
+            return None
+
+        models = [model]
+        if model == 'nodes':
+            models = ['nodes', 'facts', 'attrs']
+
+        # a client this far behind is cheaper to resync than to
+        # catch up, so treat it like an expired txid
+        rows = journal.changes_since(txid, models, self.max_changes + 1)
+        if len(rows) > self.max_changes:
+            return None
+
+        if model != 'nodes':
+            return [(row.id, set([row.object_id])) for row in rows]
+
+        index = None
+        changes = []
+
+        for row in rows:
+            if row.model == 'nodes':
+                node_id = row.object_id
+            else:
+                node_id = row.node_id
+
+            if node_id is None:
+                continue
+
+            if row.model == 'attrs':
+                changes.append((row.id, set([node_id])))
+                continue
+
+            if index is None:
+                index = utility.children_index()
+            changes.append((row.id, utility.expand_subtree(index,
+                                                           [node_id])))
+        return changes
+
+    def ids_since(self, model, txid):
+        return _union(self.changes_since(model, txid))
+
+
+def _union(changes):
+    if changes is None:
+        return None
+
+    result = set()
+    for _, ids in changes:
+        result.update(ids)
+    return result
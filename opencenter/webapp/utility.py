@@ -24,20 +24,24 @@
 ##############################################################################
 
 import copy
+import fnmatch
 import logging
 import time
 
-import gevent.event
+import gevent
 import gevent.coros
+import gevent.queue
 
+from opencenter.db import exceptions
 from opencenter.db.api import api_from_models
 from opencenter.webapp import solver
 
 
-util_conditions = {}
 util_locks = {}
 util_lock_lock = gevent.coros.Semaphore()
 
+unprovisioned_cache = {}
+
 LOG = logging.getLogger(__name__)
 
 
@@ -105,36 +109,161 @@ def lock_release(what):
     return lock.release()
 
 
-def _get_or_make_event(what):
-    util_lock_lock.acquire()
+class Subscription(object):
+    """
+    A single subscriber's view of the broker.  Every subscription owns
+    its own queue, so a publish is delivered exactly once to each
+    subscription with a matching topic, regardless of how many other
+    greenlets are waiting on the same topic.
+    """
 
-    if not what in util_conditions:
-        util_conditions[what] = gevent.event.Event()
+    def __init__(self, broker, topics):
+        self.broker = broker
+        self.topics = topics
+        self.queue = gevent.queue.Queue()
 
-    util_lock_lock.release()
+    def get(self, timeout=None):
+        """
+        Block for the next event delivered to this subscription.
 
-    return util_conditions[what]
+        Arguments:
+        timeout -- seconds to wait, or None to wait forever
 
+        Returns:
+        event dict, or None on timeout
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except gevent.queue.Empty:
+            return None
 
-def notify(what):
-    if what in util_conditions:
-        LOG.debug('notifying %s' % what)
-        util_conditions[what].set()
-    else:
-        LOG.debug('no waiters on %s... skipping' % what)
+    def get_all(self, timeout=None):
+        """
+        Block for the next event, then drain any others that are
+        already queued.
+
+        Returns:
+        list of event dicts (empty on timeout)
+        """
+        event = self.get(timeout)
+        if event is None:
+            return []
+
+        events = [event]
+        while not self.queue.empty():
+            events.append(self.queue.get_nowait())
+        return events
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Broker(object):
+    """
+    In-process publish/subscribe broker for long-poll wakeups.
+
+    Topics are plain strings ('nodes-changes', 'task-for-3').  A
+    subscription topic may contain shell-style wildcards ('nodes-id-*'),
+    in which case it matches every published topic fnmatch accepts.
+    Exact topics are dispatched with a dict lookup; only wildcard
+    subscriptions are matched by pattern.
+
+    Publishing never blocks: events are put on unbounded per-subscriber
+    queues, and since greenlets only switch on blocking calls no locking
+    is required around the subscription tables.
+    """
+
+    def __init__(self):
+        self.topics = {}
+        self.wildcards = {}
+
+    def _table(self, topic):
+        if any(c in topic for c in '*?['):
+            return self.wildcards
+        return self.topics
+
+    def subscribe(self, *topics):
+        subscription = Subscription(self, topics)
+        for topic in topics:
+            self._table(topic).setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for topic in subscription.topics:
+            table = self._table(topic)
+            subscribers = table.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del table[topic]
+
+    def subscribers(self, topic):
+        """
+        Return the set of subscriptions that should receive a
+        publish on topic.
+        """
+        result = set(self.topics.get(topic, ()))
+        for pattern, subscribers in self.wildcards.items():
+            if fnmatch.fnmatchcase(topic, pattern):
+                result.update(subscribers)
+        return result
+
+    def publish(self, topic, ids=None, **kwargs):
+        """
+        Publish an event on topic.
+
+        Arguments:
+        topic -- topic name
+        ids -- ids of the changed objects, carried in the event so
+               waiters need not re-query to find out what changed
+
+        Returns:
+        number of subscriptions the event was delivered to
+        """
+        subscribers = self.subscribers(topic)
+        if not subscribers:
+            LOG.debug('no waiters on %s... skipping' % topic)
+            return 0
+
+        event = {'topic': topic,
+                 'ids': [] if ids is None else list(ids)}
+        event.update(kwargs)
+
+        LOG.debug('notifying %s (%d waiters)' % (topic, len(subscribers)))
+        for subscription in subscribers:
+            subscription.queue.put(event)
+        return len(subscribers)
 
 
-def clear(what):
-    if what in util_conditions:
-        util_conditions[what].clear()
+broker = Broker()
+
+
+def subscribe(*topics):
+    return broker.subscribe(*topics)
+
+
+def notify(what, ids=None, **kwargs):
+    return broker.publish(what, ids, **kwargs)
 
 
 def wait(what, timeout=30):
-    event = _get_or_make_event(what)
+    """
+    Wait for a single event on topic what.  Note that an event
+    published before this is called is not seen: callers that check
+    state and then wait should subscribe() first instead.
+
+    Returns:
+    event dict, or None on timeout
+    """
     LOG.debug('waiting on %s' % what)
-    result = event.wait(timeout)
-    event.clear()
-    return result
+    with broker.subscribe(what) as subscription:
+        return subscription.get(timeout)
 
 
 def sleep(how_long):
@@ -222,6 +351,35 @@ def get_direct_children(node_id, api=None):
             if x['id'] != node_id]
 
 
+def children_index(api=None):
+    """
+    build a parent_id -> set of child node ids index from the
+    parent_id facts, with a single query
+    """
+    if api is None:
+        api = api_from_models()
+    index = {}
+    for fact in api._model_query('facts', 'key = "parent_id"'):
+        index.setdefault(fact['value'], set()).add(fact['node_id'])
+    return index
+
+
+def expand_subtree(index, node_ids):
+    """
+    given a children_index and a list of node ids, return the set
+    of those nodes and all of their descendants
+    """
+    seen = set()
+    to_visit = list(node_ids)
+    while to_visit:
+        node_id = to_visit.pop()
+        if node_id in seen:
+            continue
+        seen.add(node_id)
+        to_visit.extend(index.get(node_id, ()))
+    return seen
+
+
 def run_adventure(adventure_dsl=None, nodes=None):
     """
     run an arbitrary adventure on a set of nodes, either by ID or
@@ -276,18 +434,18 @@ def run_adventure(adventure_dsl=None, nodes=None):
 
         # FAIL: create a task update -- this should be done
         # via the model...
-        task_semaphore = 'task-for-%s' % adventure_node
-        notify(task_semaphore)
+        notify('task-for-%s' % adventure_node, ids=[task['id']])
     else:
         raise ValueError('no adventurator')
 
     return task
 
 
-def solve_for_node(node_id, constraints, api=None, plan=None):
+def solve_for_node(node_id, constraints, api=None, plan=None,
+                   search='breadth'):
     """
     given a node id and a list of constraints, run a solver
-    to try and find a solution path.
+    to try and find a solution path, with one of solver.searches.
 
     it returns (is_solvable, requires_input, solution_plan)
     """
@@ -295,20 +453,28 @@ def solve_for_node(node_id, constraints, api=None, plan=None):
         api = api_from_models()
 
     if plan is not None:
+        # a plan is laid out as given, there is nothing to search
         task_solver = solver.Solver.from_plan(api, node_id, [], plan)
+        search = 'breadth'
     else:
         task_solver = solver.Solver(api, node_id, constraints)
 
-    is_solvable, requires_input, solution_plan = task_solver.solve()
+    is_solvable, requires_input, solution_plan = task_solver.solve(search)
 
     return (is_solvable, requires_input, solution_plan)
 
 
-def solve_and_run(node_id, constraints, api=None, plan=None):
+def solve_and_run(node_id, constraints, api=None, plan=None,
+                  search='breadth', pool=None):
     if api is None:
         api = api_from_models()
-    is_solvable, requires_input, solution_plan = solve_for_node(
-        node_id, constraints, api=api, plan=plan)
+
+    if pool is not None:
+        is_solvable, requires_input, solution_plan = pool.solve(
+            node_id, constraints, api=api, plan=plan, search=search)
+    else:
+        is_solvable, requires_input, solution_plan = solve_for_node(
+            node_id, constraints, api=api, plan=plan, search=search)
 
     task = None
 
@@ -318,22 +484,40 @@ def solve_and_run(node_id, constraints, api=None, plan=None):
     return task, is_solvable, requires_input, solution_plan
 
 
+def _is_unprovisioned(node):
+    return node['name'] == 'unprovisioned' and \
+        'container' in node['facts'].get('backends', [])
+
+
 def unprovisioned_container():
+    """
+    The container new agents are parented to, created if need be.
+    Its id is remembered, since a rack of agents booting together
+    all ask for it.
+    """
     api = api_from_models()
-    unprovisioned = api._model_query(
-        'nodes',
-        'name = "unprovisioned" and "container" in facts.backends')
+
+    if 'id' in unprovisioned_cache:
+        try:
+            unprovisioned = api._model_get_by_id('nodes',
+                                                 unprovisioned_cache['id'])
+            if _is_unprovisioned(unprovisioned):
+                return unprovisioned
+        except exceptions.IdNotFound:
+            pass
+        del unprovisioned_cache['id']
+
+    unprovisioned = [x for x in api._model_query('nodes',
+                                                 'name = "unprovisioned"')
+                     if _is_unprovisioned(x)]
     if len(unprovisioned) == 0:
         #create unprovisioned node
-        unprovisioned = api._model_create(
+        unprovisioned = api._model_create_with_keys(
             'nodes',
-            {"name": "unprovisioned"})
-        api._model_create(
-            'facts',
-            {"node_id": unprovisioned['id'],
-             "key": "backends",
-             "value": ["node", "container"]})
-        return unprovisioned
+            {"name": "unprovisioned"},
+            {'facts': {"backends": ["node", "container"]}})
     else:
         unprovisioned = unprovisioned[0]
-        return unprovisioned
+
+    unprovisioned_cache['id'] = unprovisioned['id']
+    return unprovisioned
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import hashlib
+import random
+import string
+
+from opencenter.webapp import utility
+
+
+class VersionIndex(object):
+    """
+    In-memory versions for every object and collection, so GETs
+    can answer If-None-Match without touching the database.
+
+    Versions come from the change journal hook in models.py, which
+    sees every write (including those that never go through the
+    web api), and are numbered from a per-process epoch.  Anything
+    not written since startup is at version 0 of the epoch, so a
+    restart invalidates every ETag rather than risk a stale 304.
+
+    A node's representation includes its facts, attrs and inherited
+    facts, so fact and attr writes bump their node too, and a node's
+    version is the newest of it and its ancestors.
+    """
+
+    def __init__(self, models):
+        self.models = set(models)
+        self.epoch = ''.join([random.choice(string.hexdigits)
+                              for n in xrange(8)])
+        self.seq = 0
+        self.objects = {}
+        self.collections = {}
+        # node_id -> parent_id, loaded on demand and dropped
+        # whenever a fact changes
+        self.parents = None
+
+    # models journaled under another name.  Agent checkins are
+    # attrs writes kept out of the attrs change feed.
+    aliases = {'checkins': 'attrs'}
+
+    def bump(self, model, object_ids, node_ids=None, keys=None):
+        model = self.aliases.get(model, model)
+        if not model in self.models:
+            return
+
+        self.seq += 1
+        self.collections[model] = self.seq
+        for object_id in object_ids:
+            self.objects[(model, object_id)] = self.seq
+
+        if model in ('facts', 'attrs'):
+            self.collections['nodes'] = self.seq
+            for node_id in node_ids or []:
+                if node_id is not None:
+                    self.objects[('nodes', node_id)] = self.seq
+
+        if model in ('facts', 'nodes'):
+            self.parents = None
+
+    def _ancestors(self, node_id):
+        if self.parents is None:
+            index = utility.children_index()
+            self.parents = {}
+            for parent_id, children in index.items():
+                for child in children:
+                    self.parents[child] = parent_id
+
+        seen = set()
+        node_id = self.parents.get(node_id)
+        while node_id is not None and node_id not in seen:
+            seen.add(node_id)
+            yield node_id
+            node_id = self.parents.get(node_id)
+
+    def version(self, model, object_id=None):
+        if object_id is None:
+            return self.collections.get(model, 0)
+
+        version = self.objects.get((model, object_id), 0)
+        if model == 'nodes':
+            for ancestor in self._ancestors(object_id):
+                version = max(version, self.objects.get(('nodes', ancestor),
+                                                        0))
+        return version
+
+    def etag(self, model, object_id=None, variant=None):
+        """
+        Returns the current ETag for an object (or for the whole
+        collection, if object_id is None), or None if the model's
+        writes aren't tracked.  Different variants (fields, pages
+        and so on) of the same version get different ETags.
+        """
+        if not model in self.models:
+            return None
+
+        if object_id is not None:
+            try:
+                object_id = int(object_id)
+            except ValueError:
+                return None
+
+        etag = '%s-%d' % (self.epoch, self.version(model, object_id))
+        if variant:
+            etag += '-' + hashlib.sha1(variant).hexdigest()[:8]
+        return etag
@@ -0,0 +1,237 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+
+from opencenter.db import database
+from opencenter.db import models
+from opencenter.db.api import api_from_models
+from opencenter.webapp import ast
+from opencenter.webapp import availability
+
+from util import OpenCenterTestCase
+
+
+def _keys(criteria):
+    builder = ast.FilterBuilder(ast.FilterTokenizer(), criteria)
+    return availability.criteria_keys(builder.build())
+
+
+class CriteriaKeysTests(OpenCenterTestCase):
+    def test_identifiers(self):
+        self.assertEquals(
+            _keys('facts.backends = "x" and attrs.converged = true'),
+            set(['facts.backends', 'attrs.converged']))
+        self.assertEquals(_keys('name = "x"'), set(['name']))
+        self.assertEquals(_keys('"agent" in facts.backends'),
+                          set(['facts.backends']))
+
+    def test_volatile(self):
+        self.assertEquals(_keys('count(facts.backends) = 1'), None)
+        self.assertEquals(_keys('facts.{name} = 1'), None)
+
+
+class AvailabilityTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.api = api_from_models()
+        self.index = self.app.availability
+        self.index.clear()
+
+        self.container = self._model_create('nodes', name='container')
+        self.node = self._model_create('nodes', name='node')
+        self.api._model_create('facts', {'node_id': self.node['id'],
+                                         'key': 'parent_id',
+                                         'value': self.container['id']})
+        self.tagged = self._adventure('tagged', 'facts.tag = "yes"')
+        self.everything = self._adventure('everything', 'true')
+
+    def _adventure(self, name, criteria):
+        return self.api._model_create('adventures', {'name': name,
+                                                     'dsl': [],
+                                                     'criteria': criteria})
+
+    def _fact(self, node, key, value):
+        self.api._model_create('facts', {'node_id': node['id'],
+                                         'key': key,
+                                         'value': value})
+
+    def _available(self, node, expect_code=200):
+        resp = self.client.get('/nodes/%s/adventures' % node)
+        self.assertEquals(resp.status_code, expect_code)
+        if expect_code == 200:
+            return sorted(x['name'] for x in
+                          json.loads(resp.data)['adventures'])
+
+    def test_compiled_once(self):
+        compiles = self.index.stats['compiles']
+        self.assertEquals(self._available(self.node['id']), ['everything'])
+        self.assertEquals(self._available(self.container['id']),
+                          ['everything'])
+        self.assertEquals(self.index.stats['compiles'], compiles + 2)
+
+    def test_cached_until_a_read_key_changes(self):
+        self._available(self.node['id'])
+        evaluations = self.index.stats['evaluations']
+
+        self._fact(self.node, 'other', 'value')
+        self.assertEquals(self._available(self.node['id']), ['everything'])
+        self.assertEquals(self.index.stats['evaluations'], evaluations)
+
+        self._fact(self.node, 'tag', 'yes')
+        self.assertEquals(self._available(self.node['id']),
+                          ['everything', 'tagged'])
+        # only the criteria that reads the fact
+        self.assertEquals(self.index.stats['evaluations'], evaluations + 1)
+
+    def test_rolled_back_writes(self):
+        self._available(self.node['id'])
+        evaluations = self.index.stats['evaluations']
+
+        database.session.add(models.Facts(self.node['id'], 'tag', 'yes'))
+        database.session.flush()
+        database.session.rollback()
+
+        self.assertEquals(self._available(self.node['id']), ['everything'])
+        self.assertEquals(self.index.stats['evaluations'], evaluations)
+
+    def test_inherited_facts(self):
+        self._adventure('ratio', 'facts.ram_allocation_ratio = "2"')
+        self.assertEquals(self._available(self.node['id']), ['everything'])
+
+        self._fact(self.container, 'ram_allocation_ratio', '2')
+        self.assertEquals(self._available(self.node['id']),
+                          ['everything', 'ratio'])
+
+    def test_moved_while_nothing_cached(self):
+        self._adventure('ratio', 'facts.ram_allocation_ratio = "2"')
+        moved = self._model_create('nodes', name='moved')
+        self._available(self.node['id'])
+        # settling a fact change builds the children index
+        self._fact(self.node, 'other', 'value')
+        self._available(self.node['id'])
+        self.assertNotEquals(self.index.children, None)
+
+        # nothing cached, so the move below is not queued
+        self.index.results = {}
+        self._fact(moved, 'parent_id', self.node['id'])
+        self.assertEquals(self._available(moved['id']), ['everything'])
+
+        self._fact(self.container, 'ram_allocation_ratio', '2')
+        self.assertEquals(self._available(moved['id']),
+                          ['everything', 'ratio'])
+
+    def test_criteria_changes(self):
+        self.assertEquals(self._available(self.node['id']), ['everything'])
+
+        self.api._model_update_by_id('adventures', self.tagged['id'],
+                                     {'criteria': 'name = "node"'})
+        self.assertEquals(self._available(self.node['id']),
+                          ['everything', 'tagged'])
+
+        self.api._model_delete_by_id('adventures', self.everything['id'])
+        self.assertEquals(self._available(self.node['id']), ['tagged'])
+
+    def test_functions_are_always_evaluated(self):
+        self._adventure('counted', 'count(facts.backends) = 0')
+        self._available(self.node['id'])
+        evaluations = self.index.stats['evaluations']
+
+        self._available(self.node['id'])
+        self.assertEquals(self.index.stats['evaluations'], evaluations + 1)
+
+    def test_bad_criteria(self):
+        self._adventure('broken', 'facts.tag = = ')
+        self.assertEquals(self._available(self.node['id']), ['everything'])
+
+    def test_missing_node(self):
+        self._available(99999, expect_code=404)
+        self._available('bogus', expect_code=400)
+
+
+class BulkAvailabilityTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.api = api_from_models()
+        self.app.availability.clear()
+
+        self.container = self._model_create('nodes', name='container')
+        self.nodes = []
+        for name in ['one', 'two', 'three']:
+            node = self._model_create('nodes', name=name)
+            self.api._model_create('facts', {'node_id': node['id'],
+                                             'key': 'parent_id',
+                                             'value': self.container['id']})
+            self.nodes.append(node)
+        self.stray = self._model_create('nodes', name='stray')
+
+        self.one = self.api._model_create('adventures', {
+            'name': 'one', 'dsl': [], 'criteria': 'name = "one"'})
+        self.leaves = self.api._model_create('adventures', {
+            'name': 'leaves', 'dsl': [], 'criteria': 'name != "container"'})
+        self.api._model_create('adventures', {
+            'name': 'never', 'dsl': [], 'criteria': 'false'})
+
+    def _available(self, expect_code=200, **kwargs):
+        resp = self.client.post('/adventures/available',
+                                content_type='application/json',
+                                data=json.dumps(kwargs))
+        self.assertEquals(resp.status_code, expect_code)
+        return json.loads(resp.data)
+
+    def test_nodes(self):
+        one, two, _ = self.nodes
+        out = self._available(nodes=[one['id'], two['id'], 99999])
+
+        self.assertEquals(out['nodes'], {
+            str(one['id']): sorted([self.one['id'], self.leaves['id']]),
+            str(two['id']): [self.leaves['id']]})
+        self.assertEquals(out['missing'], [99999])
+        self.assertEquals(sorted(x['name'] for x in out['adventures']),
+                          ['leaves', 'one'])
+
+    def test_container(self):
+        out = self._available(container=self.container['id'])
+
+        expected = [self.container['id']] + [x['id'] for x in self.nodes]
+        self.assertEquals(sorted(out['nodes'].keys()),
+                          sorted(str(x) for x in expected))
+        self.assertEquals(out['nodes'][str(self.container['id'])], [])
+
+    def test_agrees_with_single_node(self):
+        out = self._available(container=self.container['id'])
+
+        for node in self.nodes:
+            resp = self.client.get('/nodes/%d/adventures' % node['id'])
+            single = json.loads(resp.data)['adventures']
+            self.assertEquals(sorted(x['id'] for x in single),
+                              out['nodes'][str(node['id'])])
+
+    def test_bad_requests(self):
+        self._available(expect_code=400)
+        self._available(expect_code=400, nodes=[1], container=1)
+        self._available(expect_code=400, nodes='1')
+        self._available(expect_code=400, nodes=['bogus'])
+        self._available(expect_code=404, container=99999)
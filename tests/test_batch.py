@@ -0,0 +1,177 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+
+from sqlalchemy import event
+
+from opencenter.db import database
+from opencenter.db.api import api_from_models
+
+from util import OpenCenterTestCase
+
+
+class MultiGetTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.nodes = [self._stub_node('node%d' % x) for x in range(4)]
+
+    def _get(self, url, expect_code=200):
+        resp = self.client.get(url)
+        self.assertEquals(resp.status_code, expect_code)
+        return json.loads(resp.data)
+
+    def test_ids(self):
+        wanted = [self.nodes[2]['id'], self.nodes[0]['id']]
+        out = self._get('/nodes/?ids=%d,%d' % tuple(wanted))
+        self.assertEquals([x['id'] for x in out['nodes']], wanted)
+        self.assertEquals(out['missing'], [])
+
+    def test_missing_ids(self):
+        out = self._get('/nodes/?ids=%d,999999' % self.nodes[1]['id'])
+        self.assertEquals([x['id'] for x in out['nodes']],
+                          [self.nodes[1]['id']])
+        self.assertEquals(out['missing'], [999999])
+
+    def test_ids_with_fields(self):
+        out = self._get('/nodes/?ids=%d,999999&fields=name' %
+                        self.nodes[1]['id'])
+        self.assertEquals(out['nodes'], [{'name': 'node1'}])
+        self.assertEquals(out['missing'], [999999])
+
+    def test_bad_ids(self):
+        self._get('/nodes/?ids=1,x', expect_code=400)
+        self._get('/nodes/?ids=1&limit=1', expect_code=400)
+
+    def test_single_query(self):
+        statements = []
+        counting = [True]
+
+        def count(conn, cursor, statement, *args):
+            if counting[0]:
+                statements.append(statement)
+
+        api_from_models().destroy_cache()
+        database.session.commit()
+        event.listen(database.session.get_bind(), 'before_cursor_execute',
+                     count)
+        try:
+            self._get('/nodes/?fields=id,name&ids=%s' %
+                      ','.join([str(x['id']) for x in self.nodes]))
+        finally:
+            counting[0] = False
+
+        self.assertEquals(len(statements), 1)
+
+
+class BatchTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.node = self._stub_node('node', attrs={'converged': False})
+
+    def _batch(self, requests, expect_code=200):
+        resp = self.client.post('/batch/',
+                                content_type='application/json',
+                                data=json.dumps({'requests': requests}))
+        self.assertEquals(resp.status_code, expect_code)
+        return json.loads(resp.data)
+
+    def test_batch(self):
+        attr = api_from_models().attr_get_first_by_query(
+            "node_id=%d and key='converged'" % self.node['id'])
+
+        out = self._batch([
+            {'method': 'GET', 'path': '/nodes/%d' % self.node['id']},
+            {'method': 'PUT', 'path': '/attrs/%d' % attr['id'],
+             'body': {'value': True}},
+            {'method': 'GET',
+             'path': '/nodes/?ids=%d&fields=attrs' % self.node['id']},
+            {'method': 'GET', 'path': '/nodes/999999'}])
+
+        statuses = [x['status'] for x in out['responses']]
+        self.assertEquals(statuses, [200, 200, 200, 404])
+
+        responses = [x['body'] for x in out['responses']]
+        self.assertEquals(responses[0]['node']['name'], 'node')
+        self.assertEquals(responses[1]['attr']['value'], True)
+        self.assertEquals(responses[2]['nodes'][0]['attrs']['converged'],
+                          True)
+
+    def test_post(self):
+        out = self._batch([{'method': 'POST', 'path': '/nodes/',
+                            'body': {'name': 'new'}}])
+        self.assertEquals(out['responses'][0]['status'], 201)
+        self.assertEquals(out['responses'][0]['body']['node']['name'],
+                          'new')
+
+    def test_repeated_gets_are_memoized(self):
+        url = '/nodes/%d' % self.node['id']
+        out = self._batch([{'path': url}, {'path': url}])
+        self.assertEquals(out['responses'][0], out['responses'][1])
+
+    def test_writes_drop_memo(self):
+        url = '/nodes/%d' % self.node['id']
+        attr = api_from_models().attr_get_first_by_query(
+            "node_id=%d and key='converged'" % self.node['id'])
+
+        out = self._batch([{'path': url},
+                           {'method': 'PUT', 'path': '/attrs/%d' % attr['id'],
+                            'body': {'value': True}},
+                           {'path': url}])
+        first, last = out['responses'][0], out['responses'][2]
+        self.assertFalse(first['body']['node']['attrs']['converged'])
+        self.assertTrue(last['body']['node']['attrs']['converged'])
+
+    def test_bad_items(self):
+        out = self._batch([{'method': 'DELETE', 'path': '/nodes/1'},
+                           {'path': '/batch/'},
+                           {'path': '/stream/'},
+                           {'method': 'GET'},
+                           'junk'])
+        self.assertEquals([x['status'] for x in out['responses']],
+                          [405, 400, 400, 400, 400])
+
+    def test_blocking_items(self):
+        node_id = self.node['id']
+        out = self._batch([{'path': '/nodes/%d/tasks_blocking' % node_id},
+                           {'path': '/admin/nodes/%d/tasks_blocking/' %
+                            node_id},
+                           {'path': '/nodes/%d?poll' % node_id},
+                           {'path': '/nodes/?poll=1&fields=id'},
+                           {'path': '/tasks/1/logs?watch'},
+                           {'path': '/nodes/%d?fields=id' % node_id}])
+        self.assertEquals([x['status'] for x in out['responses']],
+                          [400, 400, 400, 400, 400, 200])
+
+    def test_bad_batch(self):
+        self._batch(None, expect_code=400)
+
+        old = self.app.config['max_batch_size']
+        self.app.config['max_batch_size'] = 1
+        try:
+            self._batch([{'path': '/nodes/'}, {'path': '/nodes/'}],
+                        expect_code=400)
+        finally:
+            self.app.config['max_batch_size'] = old
@@ -0,0 +1,169 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+
+import gevent
+import unittest2
+
+from opencenter.webapp import utility
+
+from util import OpenCenterTestCase
+
+
+class BrokerTests(unittest2.TestCase):
+    def setUp(self):
+        self.broker = utility.Broker()
+
+    def test_publish_without_subscribers(self):
+        self.assertEqual(self.broker.publish('nodes-changes', [1]), 0)
+
+    def test_event_carries_ids(self):
+        with self.broker.subscribe('nodes-changes') as sub:
+            self.broker.publish('nodes-changes', [1, 2], txid='1.0')
+            event = sub.get(1)
+
+        self.assertEqual(event['topic'], 'nodes-changes')
+        self.assertEqual(event['ids'], [1, 2])
+        self.assertEqual(event['txid'], '1.0')
+
+    def test_events_queue_until_read(self):
+        with self.broker.subscribe('task-for-1') as sub:
+            self.broker.publish('task-for-1', [1])
+            self.broker.publish('task-for-1', [2])
+            events = sub.get_all(1)
+
+        self.assertEqual([e['ids'] for e in events], [[1], [2]])
+
+    def test_wildcard_subscription(self):
+        with self.broker.subscribe('nodes-id-*') as sub:
+            self.broker.publish('nodes-id-3', [3])
+            self.broker.publish('facts-id-3', [3])
+            self.broker.publish('nodes-id-4', [4])
+            events = sub.get_all(1)
+
+        self.assertEqual([e['topic'] for e in events],
+                         ['nodes-id-3', 'nodes-id-4'])
+
+    def test_overlapping_topics_deliver_once(self):
+        with self.broker.subscribe('nodes-id-*', 'nodes-id-3') as sub:
+            self.broker.publish('nodes-id-3', [3])
+            events = sub.get_all(1)
+
+        self.assertEqual(len(events), 1)
+
+    def test_timeout(self):
+        with self.broker.subscribe('nodes-changes') as sub:
+            self.assertIsNone(sub.get(0.01))
+            self.assertEqual(sub.get_all(0.01), [])
+
+    def test_unsubscribe_cleans_up(self):
+        sub = self.broker.subscribe('nodes-changes', 'nodes-id-*')
+        sub.close()
+        self.assertEqual(self.broker.topics, {})
+        self.assertEqual(self.broker.wildcards, {})
+        self.assertEqual(self.broker.publish('nodes-changes'), 0)
+
+    def test_many_concurrent_waiters(self):
+        # every waiter on a shared topic must see every event exactly
+        # once -- no waiter clearing a shared flag out from under another
+        waiters = 5000
+        publishes = 3
+        received = {}
+
+        def waiter(n, topic):
+            with self.broker.subscribe(topic) as sub:
+                received[n] = []
+                while len(received[n]) < publishes:
+                    event = sub.get(5)
+                    if event is None:
+                        break
+                    received[n].append(event['ids'][0])
+
+        greenlets = []
+        for n in range(waiters):
+            topic = 'nodes-changes' if n % 2 else 'nodes-id-*'
+            greenlets.append(gevent.spawn(waiter, n, topic))
+
+        # let everyone subscribe
+        gevent.sleep(0)
+
+        for x in range(publishes):
+            self.broker.publish('nodes-changes', [x])
+            self.broker.publish('nodes-id-%d' % x, [x])
+            # interleave with the waiters
+            gevent.sleep(0)
+
+        gevent.joinall(greenlets, timeout=30)
+
+        self.assertEqual(len(received), waiters)
+        for n in range(waiters):
+            self.assertEqual(received[n], range(publishes))
+
+        self.assertEqual(self.broker.topics, {})
+        self.assertEqual(self.broker.wildcards, {})
+
+    def test_many_topics(self):
+        # one waiter per topic, as with thousands of agents each
+        # long-polling their own task-for-<id>
+        waiters = 5000
+        received = {}
+
+        def waiter(n):
+            with self.broker.subscribe('task-for-%d' % n) as sub:
+                received[n] = sub.get_all(5)
+
+        greenlets = [gevent.spawn(waiter, n) for n in range(waiters)]
+        gevent.sleep(0)
+
+        for n in reversed(range(waiters)):
+            self.broker.publish('task-for-%d' % n, [n])
+
+        gevent.joinall(greenlets, timeout=30)
+
+        for n in range(waiters):
+            self.assertEqual([e['ids'] for e in received[n]], [[n]])
+
+
+class TasksBlockingTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.node = self._model_create('nodes', name='blocking_node')
+
+    def test_blocking_poll_wakes_on_new_task(self):
+        def poll():
+            return self.client.get(
+                '/nodes/%s/tasks_blocking' % self.node['id'])
+
+        poller = gevent.spawn(poll)
+        gevent.sleep(0)
+
+        task = self._model_create('tasks', node_id=self.node['id'],
+                                  action='run.adventure', payload={})
+
+        resp = poller.get(timeout=10)
+        self.assertEqual(resp.status_code, 200)
+        out = json.loads(resp.data)
+        self.assertEqual(out['task']['id'], task['id'])
@@ -0,0 +1,157 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+
+from opencenter.db.api import api_from_models
+
+from util import OpenCenterTestCase, QueryCounter, query_budget
+
+
+# Statement budgets for the endpoints agents and the dashboard hit
+# most.  Node representations still load facts and attrs one node at
+# a time (and facts once more per ancestor), so list endpoints are
+# budgeted per node until that is fixed.
+NODES = 20
+PER_NODE = 5
+
+
+class QueryBudgetTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.node = self._model_create('nodes', name='node')
+
+    def test_counts(self):
+        with QueryCounter() as counter:
+            self.client.get('/nodes/%d' % self.node['id'])
+
+        self.assertTrue(len(counter.statements) > 0)
+        self.assertTrue(('get', 'nodes') in counter.api_calls)
+
+    def test_over_budget_fails(self):
+        def spend():
+            with self.assertQueryBudget(statements=1):
+                for x in range(3):
+                    self.client.get('/nodes/%d' % self.node['id'])
+
+        self.assertRaises(self.failureException, spend)
+
+    def test_repeats(self):
+        with QueryCounter() as counter:
+            for x in range(3):
+                self.client.get('/nodes/%d' % self.node['id'])
+
+        count, statement = counter.repeated()[0]
+        self.assertTrue(count >= 3)
+        self.assertTrue('%dx SELECT' % count in counter.report())
+
+    @query_budget(statements=0, api_calls=0)
+    def test_decorator(self):
+        pass
+
+
+class EndpointBudgetTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        api = api_from_models()
+
+        self.container = self._model_create('nodes', name='container')
+        api._model_create('facts', {'node_id': self.container['id'],
+                                    'key': 'backends',
+                                    'value': ['node', 'container']})
+
+        self.nodes = []
+        for n in range(NODES):
+            node = api._model_create_with_keys(
+                'nodes', {'name': 'node-%d' % n},
+                {'facts': {'parent_id': self.container['id'],
+                           'backends': ['node', 'agent']},
+                 'attrs': {'converged': True}})
+            self.nodes.append(node)
+        self.node = self.nodes[0]
+
+        for n in range(5):
+            api._model_create('adventures',
+                              {'name': 'adventure-%d' % n,
+                               'dsl': [],
+                               'criteria': '"agent" in facts.backends'})
+
+        self.app.availability.clear()
+
+    def _get(self, url):
+        resp = self.client.get(url)
+        self.assertTrue(resp.status_code in (200, 404))
+        return resp
+
+    def _post(self, url, data):
+        resp = self.client.post(url, content_type='application/json',
+                                data=json.dumps(data))
+        self.assertEquals(resp.status_code, 200)
+        return resp
+
+    def test_node(self):
+        with self.assertQueryBudget(statements=8, repeats=2):
+            self._get('/nodes/%d' % self.node['id'])
+
+    def test_node_list(self):
+        with self.assertQueryBudget(statements=PER_NODE * (NODES + 2),
+                                    repeats=2 * (NODES + 2)):
+            self._get('/nodes/')
+
+    def test_node_page(self):
+        # a page of 5 reads 6 nodes, to know if there's another page
+        with self.assertQueryBudget(statements=PER_NODE * 6 + 2):
+            self._get('/nodes/?limit=5')
+
+    def test_node_adventures(self):
+        with self.assertQueryBudget(statements=8, repeats=2):
+            self._get('/nodes/%d/adventures' % self.node['id'])
+
+        # answered from the availability index
+        with self.assertQueryBudget(statements=1):
+            self._get('/nodes/%d/adventures' % self.node['id'])
+
+    def test_available_for_container(self):
+        with self.assertQueryBudget(statements=PER_NODE * (NODES + 2)):
+            self._post('/adventures/available',
+                       {'container': self.container['id']})
+
+    def test_whoami(self):
+        with self.assertQueryBudget(statements=15, repeats=3):
+            self._post('/nodes/whoami', {'hostname': 'new-agent'})
+
+    def test_tasks(self):
+        with self.assertQueryBudget(statements=2):
+            self._get('/nodes/%d/tasks' % self.node['id'])
+
+    def test_facts(self):
+        with self.assertQueryBudget(statements=2):
+            self._get('/facts/')
+
+    def test_updates(self):
+        # notifications still queued from setUp are written on /updates
+        self.app.notifier.flush()
+        with self.assertQueryBudget(statements=2):
+            self._get('/updates')
@@ -0,0 +1,226 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+
+from sqlalchemy import event
+
+from opencenter.db import database
+from opencenter.db import models
+from opencenter.db.api import api_from_models
+from opencenter.webapp import dispatcher
+
+from util import OpenCenterTestCase
+
+
+class DispatcherTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.api = api_from_models()
+        self.dispatcher = self.app.dispatcher
+        self.node = self._model_create('nodes', name='agent')
+        self.other = self._model_create('nodes', name='other')
+
+    def _task(self, node, action='run'):
+        return self._model_create('tasks', node_id=node['id'],
+                                  action=action, payload={})
+
+    def _next(self, node, expect_code=200):
+        resp = self.client.get('/nodes/%d/tasks' % node['id'])
+        self.assertEquals(resp.status_code, expect_code)
+        if expect_code == 200:
+            return json.loads(resp.data)['task']
+
+    def test_oldest_first(self):
+        first = self._task(self.node)
+        self._task(self.other)
+        second = self._task(self.node)
+
+        self.assertEquals(self._next(self.node)['id'], first['id'])
+        self.assertEquals(self.api._model_get_by_id(
+            'tasks', first['id'])['state'], 'delivered')
+        self.assertEquals(self._next(self.node)['id'], second['id'])
+        self._next(self.node, expect_code=404)
+
+    def test_writes_outside_the_api(self):
+        # the agent backend creates tasks with the db api, and
+        # never notifies
+        task = self.api._model_create('tasks', {'node_id': self.node['id'],
+                                                'action': 'run',
+                                                'payload': {}})
+        self.assertEquals(self.dispatcher.next_task(self.node['id'])['id'],
+                          task['id'])
+
+    def test_rolled_back_tasks_are_not_queued(self):
+        self.dispatcher.load()
+        database.session.add(models.Tasks(node_id=self.node['id'],
+                                          action='run', payload={}))
+        database.session.flush()
+        database.session.rollback()
+
+        self.assertEquals(self.dispatcher.queues.get(self.node['id']), None)
+
+    def test_stale_tasks_are_dropped(self):
+        done = self._task(self.node)
+        deleted = self._task(self.node)
+        moved = self._task(self.node)
+        pending = self._task(self.node)
+
+        self._model_update('tasks', done['id'], state='done')
+        self._model_delete('tasks', deleted['id'])
+        self._model_update('tasks', moved['id'], node_id=self.other['id'])
+
+        dropped = self.dispatcher.stats['dropped']
+        self.assertEquals(self.dispatcher.next_task(self.node['id'])['id'],
+                          pending['id'])
+        self.assertEquals(self.dispatcher.stats['dropped'] - dropped, 3)
+        self.assertEquals(self.dispatcher.next_task(self.other['id'])['id'],
+                          moved['id'])
+
+    def test_back_to_pending(self):
+        task = self._task(self.node)
+        self._next(self.node)
+        self._next(self.node, expect_code=404)
+
+        self._model_update('tasks', task['id'], state='pending')
+        self.assertEquals(self._next(self.node)['id'], task['id'])
+
+    def test_load(self):
+        tasks = [self._task(self.node) for x in range(3)]
+        self._model_update('tasks', tasks[1]['id'], state='done')
+
+        fresh = dispatcher.Dispatcher()
+        fresh.load()
+        self.assertEquals(fresh.queues[self.node['id']],
+                          [tasks[0]['id'], tasks[2]['id']])
+        self.assertEquals([x['id'] for x in
+                           fresh.pending(self.node['id'], limit=5)],
+                          [tasks[0]['id'], tasks[2]['id']])
+
+    def test_no_table_scan(self):
+        for x in range(10):
+            self._task(self.other)
+        self._task(self.node)
+        self.dispatcher.next_task(self.node['id'])
+
+        statements = []
+        counting = [True]
+
+        def count(conn, cursor, statement, *args):
+            if counting[0]:
+                statements.append(statement)
+
+        database.session.commit()
+        event.listen(database.session.get_bind(), 'before_cursor_execute',
+                     count)
+        try:
+            self.dispatcher.next_task(self.node['id'])
+        finally:
+            counting[0] = False
+
+        for statement in statements:
+            self.assertFalse('tasks.state =' in statement)
+
+    def test_blocking_gets_task(self):
+        task = self._task(self.node)
+        resp = self.client.get('/nodes/%d/tasks_blocking' % self.node['id'])
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals(json.loads(resp.data)['task']['id'], task['id'])
+
+
+class BatchDeliveryTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.api = api_from_models()
+        self.node = self._model_create('nodes', name='agent')
+        self.tasks = [self._model_create('tasks', node_id=self.node['id'],
+                                         action='run', payload={})
+                      for x in range(3)]
+
+    def _get(self, url, expect_code=200):
+        resp = self.client.get(url)
+        self.assertEquals(resp.status_code, expect_code)
+        return json.loads(resp.data)
+
+    def _states(self):
+        return [self.api._model_get_by_id('tasks', x['id'])['state']
+                for x in self.tasks]
+
+    def test_tasks_max(self):
+        out = self._get('/nodes/%d/tasks?max=2' % self.node['id'])
+        self.assertEquals([x['id'] for x in out['tasks']],
+                          [x['id'] for x in self.tasks[:2]])
+        self.assertEquals([x['state'] for x in out['tasks']],
+                          ['delivered', 'delivered'])
+        self.assertEquals(self._states(),
+                          ['delivered', 'delivered', 'pending'])
+
+        out = self._get('/nodes/%d/tasks?max=10' % self.node['id'])
+        self.assertEquals([x['id'] for x in out['tasks']],
+                          [self.tasks[2]['id']])
+        self._get('/nodes/%d/tasks?max=10' % self.node['id'],
+                  expect_code=404)
+
+    def test_blocking_max(self):
+        out = self._get('/nodes/%d/tasks_blocking?max=5' % self.node['id'])
+        self.assertEquals(len(out['tasks']), 3)
+        self.assertEquals(self._states(), ['delivered'] * 3)
+
+    def test_blocking_without_max(self):
+        out = self._get('/nodes/%d/tasks_blocking' % self.node['id'])
+        self.assertEquals(out['task']['id'], self.tasks[0]['id'])
+        self.assertEquals(self._states(), ['pending'] * 3)
+
+    def test_one_commit(self):
+        commits = []
+        counting = [True]
+
+        def count(conn):
+            if counting[0]:
+                commits.append(conn)
+
+        database.session.commit()
+        event.listen(database.session.get_bind(), 'commit', count)
+        try:
+            self._get('/nodes/%d/tasks?max=3' % self.node['id'])
+        finally:
+            counting[0] = False
+
+        self.assertEquals(len(commits), 1)
+
+    def test_max_capped(self):
+        old = self.app.config['max_task_delivery']
+        self.app.config['max_task_delivery'] = 1
+        try:
+            out = self._get('/nodes/%d/tasks?max=3' % self.node['id'])
+            self.assertEquals(len(out['tasks']), 1)
+        finally:
+            self.app.config['max_task_delivery'] = old
+
+    def test_bad_max(self):
+        self._get('/nodes/%d/tasks?max=x' % self.node['id'],
+                  expect_code=400)
+        self._get('/nodes/%d/tasks_blocking?max=0' % self.node['id'],
+                  expect_code=400)
@@ -0,0 +1,97 @@
+#
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+from util import OpenCenterTestCase
+
+import opencenter.db.api as db_api
+from opencenter.webapp import ast
+
+
+api = db_api.api_from_models()
+
+
+class LayeredEphemeralTestCase(OpenCenterTestCase):
+    def setUp(self):
+        self.node = self._model_create('nodes', name='node-1')
+        self.other = self._model_create('nodes', name='node-2')
+
+        self.bottom = db_api.ephemeral_api_from_api(api)
+        self._apply(self.bottom, 'facts.first := "a"')
+
+        self.top = db_api.layered_api_from_api(self.bottom)
+        self._apply(self.top, 'facts.second := "b"')
+
+    def tearDown(self):
+        self._clean_all()
+
+    def _apply(self, layer, expression):
+        node = layer._model_get_by_id('nodes', self.node['id'])
+        ast.apply_expression(node, expression, layer)
+
+    def _facts(self, layer):
+        return layer._model_get_by_id('nodes', self.node['id'])['facts']
+
+    def test_changes_show_through(self):
+        facts = self._facts(self.top)
+        self.assertEquals(facts['first'], 'a')
+        self.assertEquals(facts['second'], 'b')
+
+    def test_changes_stay_in_layer(self):
+        self.assertFalse('second' in self._facts(self.bottom))
+        self.assertFalse('first' in self._facts(api))
+
+        # only the new fact is held in the top layer
+        self.assertEquals(len(self.top.model_list['facts'].new_obj), 1)
+
+    def test_update_over_parent(self):
+        self._apply(self.top, 'facts.first := "c"')
+
+        self.assertEquals(self._facts(self.top)['first'], 'c')
+        self.assertEquals(self._facts(self.bottom)['first'], 'a')
+
+    def test_delete_over_parent(self):
+        self.top._model_delete_by_id('nodes', self.other['id'])
+
+        self.assertEquals(len(self.top._model_get_all('nodes')), 1)
+        self.assertEquals(len(self.bottom._model_get_all('nodes')), 2)
+
+    def test_transactions(self):
+        transactions = self.top.transactions()
+
+        self.assertEquals(sorted([x['key'] for x in
+                                  transactions['facts']['new'].values()]),
+                          ['first', 'second'])
+        self.assertEquals(len(self.bottom.transactions()['facts']['new']), 1)
+
+    def test_merged_view_is_kept(self):
+        layer = self.top.model_list['facts']
+        merged = layer._merge()
+        self._facts(self.top)
+        self.assertTrue(layer._merge() is merged)
+
+        # until the layer changes
+        self._apply(self.top, 'facts.third := "c"')
+        self.assertFalse(layer._merge() is merged)
+        self.assertEquals(self._facts(self.top)['third'], 'c')
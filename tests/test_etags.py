@@ -0,0 +1,158 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+from sqlalchemy import event
+
+from opencenter.db import database
+from opencenter.db.api import api_from_models
+
+from util import OpenCenterTestCase
+
+
+class ETagTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.container = self._stub_node(
+            'container', facts={'backends': ['container', 'node']})
+        self.node = self._stub_node(
+            'node', facts={'parent_id': self.container['id']})
+
+    def _get(self, url, etag=None, expect_code=200):
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        resp = self.client.get(url, headers=headers)
+        self.assertEquals(resp.status_code, expect_code)
+        return resp
+
+    def _statements(self, fn):
+        # sqlalchemy 0.7 can't remove engine listeners, so this
+        # one just stops counting.  Listeners only apply to new
+        # connections, so release the session's first.
+        statements = []
+        counting = [True]
+
+        def count(conn, cursor, statement, *args):
+            if counting[0]:
+                statements.append(statement)
+
+        database.session.commit()
+        event.listen(database.session.get_bind(), 'before_cursor_execute',
+                     count)
+        try:
+            fn()
+        finally:
+            counting[0] = False
+        return statements
+
+    def test_object_not_modified(self):
+        url = '/nodes/%s' % self.node['id']
+        etag = self._get(url).headers['ETag']
+        self.assertIsNotNone(etag)
+
+        resp = self._get(url, etag, expect_code=304)
+        self.assertEquals(resp.headers['ETag'], etag)
+        self.assertEquals(resp.data, '')
+
+    def test_not_modified_skips_database(self):
+        url = '/nodes/%s' % self.node['id']
+        etag = self._get(url).headers['ETag']
+
+        # with a cold cache, a full GET has to query
+        api_from_models().destroy_cache()
+        statements = self._statements(
+            lambda: self._get(url, etag, expect_code=304))
+        self.assertEquals(statements, [])
+
+        statements = self._statements(lambda: self._get(url))
+        self.assertNotEquals(statements, [])
+
+    def test_own_fact_changes_etag(self):
+        url = '/nodes/%s' % self.node['id']
+        etag = self._get(url).headers['ETag']
+
+        self._model_create('facts', node_id=self.node['id'],
+                           key='x', value=1)
+
+        resp = self._get(url, etag)
+        self.assertNotEquals(resp.headers['ETag'], etag)
+
+    def test_inherited_fact_changes_etag(self):
+        url = '/nodes/%s' % self.node['id']
+        etag = self._get(url).headers['ETag']
+
+        self._model_create('facts', node_id=self.container['id'],
+                           key='x', value=1)
+
+        self._get(url, etag)
+
+    def test_unrelated_change_keeps_etag(self):
+        other = self._stub_node('other')
+        url = '/nodes/%s' % self.node['id']
+        etag = self._get(url).headers['ETag']
+
+        self._model_create('attrs', node_id=other['id'], key='x', value=1)
+
+        self._get(url, etag, expect_code=304)
+
+    def test_collection_etag(self):
+        etag = self._get('/nodes/').headers['ETag']
+        self._get('/nodes/', etag, expect_code=304)
+
+        self._model_create('attrs', node_id=self.node['id'],
+                           key='x', value=1)
+        self._get('/nodes/', etag)
+
+    def test_query_changes_etag(self):
+        etag = self._get('/nodes/').headers['ETag']
+        etags = set([etag])
+        for query in ['fields=name', 'ids=%d' % self.node['id'],
+                      'limit=1', 'limit=1&sort=name']:
+            resp = self._get('/nodes/?' + query, etag)
+            etags.add(resp.headers['ETag'])
+        self.assertEquals(len(etags), 5)
+
+        # the order of the query doesn't matter
+        etag = self._get('/nodes/?limit=1&sort=name').headers['ETag']
+        self._get('/nodes/?sort=name&limit=1', etag, expect_code=304)
+
+        url = '/nodes/%s' % self.node['id']
+        etag = self._get(url).headers['ETag']
+        self._get(url + '?fields=name', etag)
+
+    def test_direct_api_writes_change_etag(self):
+        # writes that don't go through the web api still count
+        etag = self._get('/tasks/').headers['ETag']
+        api_from_models()._model_create('tasks',
+                                        {'node_id': self.node['id'],
+                                         'action': 'x',
+                                         'payload': {}})
+        self._get('/tasks/', etag)
+
+    def test_deleted_object(self):
+        url = '/nodes/%s' % self.node['id']
+        etag = self._get(url).headers['ETag']
+        self._model_delete('nodes', self.node['id'])
+        self._get(url, etag, expect_code=404)
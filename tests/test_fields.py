@@ -0,0 +1,113 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+
+from sqlalchemy import event
+
+from opencenter.db import database
+from opencenter.db.api import api_from_models
+
+from util import OpenCenterTestCase
+
+
+class FieldsTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.container = self._stub_node(
+            'container', facts={'backends': ['container', 'node']})
+        self.node = self._stub_node(
+            'node', facts={'parent_id': self.container['id']},
+            attrs={'converged': True})
+
+    def _get(self, url, expect_code=200):
+        resp = self.client.get(url)
+        self.assertEquals(resp.status_code, expect_code)
+        return json.loads(resp.data)
+
+    def test_list_fields(self):
+        out = self._get('/nodes/?fields=id,name')
+        self.assertEquals(len(out['nodes']), 2)
+        for node in out['nodes']:
+            self.assertEquals(sorted(node.keys()), ['id', 'name'])
+
+    def test_list_fact_keys(self):
+        out = self._get('/nodes/?fields=id,facts.parent_id')
+        nodes = dict([(x['id'], x) for x in out['nodes']])
+        self.assertEquals(nodes[self.node['id']]['facts'],
+                          {'parent_id': self.container['id']})
+        self.assertFalse('attrs' in nodes[self.node['id']])
+        self.assertFalse('backends' in nodes[self.node['id']]['facts'])
+
+    def test_whole_field_wins(self):
+        out = self._get('/nodes/%s?fields=facts.parent_id,facts' %
+                        self.container['id'])
+        self.assertEquals(out['node']['facts']['backends'],
+                          ['container', 'node'])
+
+    def test_object_fields(self):
+        out = self._get('/nodes/%s?fields=name,attrs.converged' %
+                        self.node['id'])
+        self.assertEquals(out['node'], {'name': 'node',
+                                        'attrs': {'converged': True}})
+
+    def test_unknown_field(self):
+        self._get('/nodes/?fields=id,bogus', expect_code=400)
+        self._get('/nodes/%s?fields=bogus.key' % self.node['id'],
+                  expect_code=400)
+
+    def test_no_fields(self):
+        out = self._get('/nodes/%s' % self.node['id'])
+        self.assertTrue('facts' in out['node'])
+        self.assertTrue('attrs' in out['node'])
+
+    def test_filter_fields(self):
+        resp = self.client.post('/nodes/filter?fields=id',
+                                content_type='application/json',
+                                data=json.dumps({'filter': 'name="node"'}))
+        self.assertEquals(resp.status_code, 200)
+        out = json.loads(resp.data)
+        self.assertEquals(out['nodes'], [{'id': self.node['id']}])
+
+    def test_skips_synthesized_fields(self):
+        statements = []
+        counting = [True]
+
+        def count(conn, cursor, statement, *args):
+            if counting[0]:
+                statements.append(statement)
+
+        api_from_models().destroy_cache()
+        database.session.commit()
+        event.listen(database.session.get_bind(), 'before_cursor_execute',
+                     count)
+        try:
+            self._get('/nodes/?fields=id,name')
+        finally:
+            counting[0] = False
+
+        # one select of the nodes table, and nothing from facts
+        # or attrs
+        self.assertEquals(len(statements), 1)
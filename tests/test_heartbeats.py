@@ -0,0 +1,190 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+
+from sqlalchemy import event
+
+from opencenter.db import database
+from opencenter.db.api import api_from_models
+from opencenter.webapp import heartbeats as heartbeats_module
+
+from util import OpenCenterTestCase
+
+
+class HeartbeatTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.api = api_from_models()
+        self.heartbeats = self.app.heartbeats
+        self.heartbeats.flush()
+        self.nodes = [self._stub_node('agent%d' % x) for x in range(3)]
+
+    def _checkin(self, node_id):
+        attr = self.api.attr_get_first_by_query(
+            "node_id=%d and key='last_checkin'" % node_id)
+        if attr is None:
+            return None
+        return attr['value']
+
+    def test_checkins_are_batched(self):
+        node_id = self.nodes[0]['id']
+        self._model_create('tasks', node_id=node_id, action='run',
+                           payload={})
+
+        resp = self.client.get('/nodes/%d/tasks_blocking' % node_id)
+        self.assertEquals(resp.status_code, 200)
+        self.assertIsNone(self._checkin(node_id))
+        self.assertTrue(node_id in self.heartbeats.pending)
+
+        self.assertEquals(self.heartbeats.flush(), 1)
+        self.assertIsNotNone(self._checkin(node_id))
+        self.assertEquals(self.heartbeats.pending, {})
+
+    def test_flush_updates_and_inserts(self):
+        self.heartbeats.beat(self.nodes[0]['id'], when=100)
+        self.heartbeats.flush()
+
+        for node in self.nodes:
+            self.heartbeats.beat(node['id'], when=200)
+        self.assertEquals(self.heartbeats.flush(), 3)
+
+        for node in self.nodes:
+            self.assertEquals(self._checkin(node['id']), 200)
+
+        out = json.loads(self.client.get(
+            '/nodes/%d' % self.nodes[0]['id']).data)
+        self.assertEquals(out['node']['attrs']['last_checkin'], 200)
+
+    def test_one_statement_per_kind(self):
+        def statements(nodes):
+            seen = []
+            counting = [True]
+
+            def count(conn, cursor, statement, *args):
+                if counting[0]:
+                    seen.append(statement)
+
+            for node in nodes:
+                self.heartbeats.beat(node['id'])
+
+            database.session.commit()
+            event.listen(database.session.get_bind(),
+                         'before_cursor_execute', count)
+            try:
+                self.heartbeats.flush()
+            finally:
+                counting[0] = False
+            return len(seen)
+
+        # inserts first, then updates, for one node and for three
+        self.assertEquals(statements(self.nodes[:1]),
+                          statements(self.nodes[1:]))
+        self.assertEquals(statements(self.nodes[:1]),
+                          statements(self.nodes))
+
+    def test_unknown_node(self):
+        resp = self.client.get('/nodes/999999/tasks_blocking')
+        self.assertEquals(resp.status_code, 404)
+        resp = self.client.get('/nodes/bogus/tasks_blocking')
+        self.assertEquals(resp.status_code, 400)
+
+    def test_deleted_node_is_skipped(self):
+        doomed = self._model_create('nodes', name='doomed')
+        self.heartbeats.beat(doomed['id'])
+        self.heartbeats.beat(self.nodes[0]['id'])
+        self._model_delete('nodes', doomed['id'])
+
+        self.assertEquals(self.heartbeats.flush(), 1)
+        self.assertIsNone(self._checkin(doomed['id']))
+
+    def test_not_in_attrs_feed(self):
+        transactions = self.app.transactions
+        self.app.notifier.flush()
+        txid = transactions.issue()
+
+        self.heartbeats.beat(self.nodes[0]['id'])
+        self.heartbeats.flush()
+
+        self.assertEquals(transactions.ids_since('attrs', txid), set())
+        self.assertEquals(transactions.ids_since('nodes', txid), set())
+        self.assertEquals(len(transactions.ids_since('checkins', txid)), 1)
+
+    def test_bumps_node_etag(self):
+        url = '/nodes/%d' % self.nodes[0]['id']
+        etag = self.client.get(url).headers['ETag']
+
+        self.heartbeats.beat(self.nodes[0]['id'])
+        self.heartbeats.flush()
+
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEquals(resp.status_code, 200)
+
+    def test_failed_write_is_kept(self):
+        heartbeats = heartbeats_module.Heartbeats(self.app.notifier,
+                                                  batch_size=2)
+        for node in self.nodes:
+            heartbeats.beat(node['id'], when=100)
+
+        api = api_from_models()
+        real = api._model_set_key_values
+        calls = []
+
+        def failing(*args, **kwargs):
+            calls.append(True)
+            if len(calls) > 1:
+                # a newer checkin arrives as the second batch fails
+                heartbeats.beat(self.nodes[2]['id'], when=200)
+                raise RuntimeError('database is locked')
+            return real(*args, **kwargs)
+
+        api._model_set_key_values = failing
+        try:
+            self.assertRaises(RuntimeError, heartbeats.flush, api)
+        finally:
+            del api._model_set_key_values
+
+        self.assertEquals(heartbeats.pending, {self.nodes[2]['id']: 200})
+        self.assertEquals(heartbeats.flush(), 1)
+        self.assertEquals(self._checkin(self.nodes[2]['id']), 200)
+
+    def test_stop_flushes(self):
+        heartbeats = heartbeats_module.Heartbeats(self.app.notifier)
+        heartbeats.start()
+        heartbeats.beat(self.nodes[0]['id'], when=400)
+        heartbeats.stop()
+
+        self.assertEquals(heartbeats.pending, {})
+        self.assertEquals(self._checkin(self.nodes[0]['id']), 400)
+
+    def test_write_through(self):
+        old = self.heartbeats.interval
+        self.heartbeats.interval = 0
+        try:
+            self.heartbeats.beat(self.nodes[1]['id'], when=300)
+        finally:
+            self.heartbeats.interval = old
+
+        self.assertEquals(self._checkin(self.nodes[1]['id']), 300)
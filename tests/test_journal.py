@@ -0,0 +1,191 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+import time
+
+from opencenter import webapp
+from opencenter.db import journal
+from opencenter.db import models
+from opencenter.db.api import api_from_models
+from opencenter.db.database import session
+from opencenter.db.models import Nodes
+from opencenter.webapp import transactions
+
+from util import OpenCenterTestCase
+
+
+class JournalTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.api = api_from_models()
+        self.node = self._model_create('nodes', name='journaled')
+
+    def _changes(self, since, model):
+        return [(x.object_id, x.node_id)
+                for x in journal.changes_since(since, [model])]
+
+    def test_writes_are_journaled(self):
+        start = journal.latest_seq()
+
+        fact = self._model_create('facts', node_id=self.node['id'],
+                                  key='x', value=1)
+        self._model_update('facts', fact['id'], value=2)
+        self._model_delete('facts', fact['id'])
+
+        self.assertEquals(self._changes(start, 'facts'),
+                          [(fact['id'], self.node['id'])] * 3)
+
+    def test_rollback_is_not_journaled(self):
+        start = journal.latest_seq()
+
+        session.add(Nodes('rolled back'))
+        session.flush()
+        session.rollback()
+
+        self.assertEquals(journal.latest_seq(), start)
+
+    def test_disabled_journal_writes_nothing(self):
+        start = journal.latest_seq()
+        heard = []
+
+        def listener(model, ids, node_ids, keys):
+            heard.append(model)
+
+        models.add_change_listener(listener)
+        models.journal_enabled = False
+        try:
+            self._model_create('facts', node_id=self.node['id'],
+                               key='x', value=1)
+        finally:
+            models.journal_enabled = True
+            models.remove_change_listener(listener)
+
+        self.assertEquals(journal.latest_seq(), start)
+        self.assertTrue('facts' in heard)
+
+    def test_listeners_hear_commits_only(self):
+        heard = []
+
+        def listener(model, ids, node_ids, keys):
+            heard.append((model, ids))
+
+        models.add_change_listener(listener)
+        try:
+            session.add(Nodes('rolled back'))
+            session.flush()
+            session.rollback()
+            self.assertEquals(heard, [])
+
+            node = Nodes('committed')
+            session.add(node)
+            session.flush()
+            self.assertEquals(heard, [])
+            session.commit()
+            self.assertEquals(heard, [('nodes', [node.id])])
+        finally:
+            models.remove_change_listener(listener)
+
+    def test_close_removes_listeners(self):
+        app = webapp.WebServer('opencenter',
+                               configfile='tests/test.conf',
+                               debug=True)
+        self.assertTrue(app.versions.bump in models.change_listeners)
+        app.close()
+        self.assertFalse(app.versions.bump in models.change_listeners)
+
+    def test_bulk_deletes_are_journaled(self):
+        task = self.api._model_create('tasks', {'node_id': self.node['id'],
+                                                'action': 'x',
+                                                'payload': {}})
+        start = journal.latest_seq()
+
+        self.api._model_delete_by_query('tasks', 'id = %d' % task['id'])
+
+        self.assertEquals(self._changes(start, 'tasks'), [(task['id'], None)])
+
+    def test_resume_after_restart(self):
+        trans = self._get_txid()
+        self._model_create('attrs', node_id=self.node['id'],
+                           key='x', value=1)
+
+        # a new server on the same database
+        app = webapp.WebServer('opencenter',
+                               configfile='tests/test.conf',
+                               debug=True)
+        client = app.test_client()
+
+        resp = client.get('/nodes/updates/%s/%s' % (trans['session_key'],
+                                                    trans['txid']))
+        app.close()
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals(json.loads(resp.data)['nodes'], [self.node['id']])
+
+    def test_future_txid_is_invalid(self):
+        trans = self._get_txid()
+        self._model_get_updates('nodes', trans['session_key'],
+                                int(trans['txid']) + 1,
+                                expect_code=410, raw=True)
+
+    def test_prune_keeps_latest(self):
+        start = journal.latest_seq()
+        self._model_create('facts', node_id=self.node['id'],
+                           key='x', value=1)
+        self._model_create('facts', node_id=self.node['id'],
+                           key='y', value=1)
+        latest = journal.latest_seq()
+
+        journal.prune(int(time.time()) + 10)
+
+        self.assertEquals(journal.latest_seq(), latest)
+        self.assertEquals(journal.first_seq(), latest)
+
+        trans = self._get_txid()
+        self._model_get_updates('nodes', trans['session_key'], start,
+                                expect_code=410, raw=True)
+
+    def test_txid_before_oldest_change(self):
+        self._model_create('facts', node_id=self.node['id'],
+                           key='x', value=1)
+        journal.prune(int(time.time()) + 10)
+        first = journal.first_seq()
+
+        log = transactions.JournalLog('x')
+        self.assertEquals(log.ids_since('facts', first - 1),
+                          set([journal.changes_since(first - 1,
+                                                     ['facts'])[0][2]]))
+        self.assertEquals(log.changes_since('facts', first - 2), None)
+
+    def test_far_behind_txid_resyncs(self):
+        start = journal.latest_seq()
+        for x in range(3):
+            self._model_create('attrs', node_id=self.node['id'],
+                               key='x%d' % x, value=x)
+
+        log = transactions.JournalLog('x', max_changes=3)
+        self.assertEquals(len(log.changes_since('attrs', start)), 3)
+
+        log.max_changes = 2
+        self.assertEquals(log.changes_since('attrs', start), None)
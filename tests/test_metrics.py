@@ -0,0 +1,103 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+
+from opencenter.webapp import metrics
+
+from util import OpenCenterTestCase
+
+
+class MetricsTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.node = self._model_create('nodes', name='node')
+
+    def _metrics(self):
+        resp = self.client.get('/admin/metrics/')
+        self.assertEquals(resp.status_code, 200)
+        return json.loads(resp.data)['metrics']
+
+    def _route(self, snapshot, route, method='GET'):
+        for x in snapshot['routes']:
+            if x['route'] == route and x['method'] == method:
+                return x
+
+    def test_requests_are_counted(self):
+        before = self._route(self._metrics(), '/nodes/<object_id>')
+        before = before['count'] if before else 0
+
+        for x in range(3):
+            self.client.get('/nodes/%d' % self.node['id'])
+
+        route = self._route(self._metrics(), '/nodes/<object_id>')
+        self.assertEquals(route['count'], before + 3)
+        self.assertEquals(route['blueprint'], 'nodes')
+        self.assertTrue(route['latency_sum'] > 0)
+        self.assertTrue(route['db_statements'] > 0)
+        self.assertEquals(route['latency_buckets']['60.0'], route['count'])
+
+    def test_counters(self):
+        self.client.post('/nodes/filter', content_type='application/json',
+                         data=json.dumps({'filter': 'name = "node"'}))
+        snapshot = self._metrics()
+
+        self.assertTrue(snapshot['counters']['filter_parses'] > 0)
+        self.assertTrue(snapshot['counters']['filter_evaluations'] > 0)
+        self.assertTrue('nodes' in snapshot['counters']['cache_misses'])
+        self.assertTrue('reaped' in snapshot['components']['task_reaper'])
+        self.assertTrue('dispatched' in snapshot['components']['dispatcher'])
+
+    def test_in_flight(self):
+        # this request is in flight while it is being answered
+        snapshot = self._metrics()
+        self.assertEquals(snapshot['in_flight']['/admin/metrics/'], 1)
+
+    def test_prometheus(self):
+        self.client.get('/nodes/%d' % self.node['id'])
+        resp = self.client.get('/admin/metrics/',
+                               headers={'Accept': 'text/plain'})
+        self.assertEquals(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+
+        self.assertTrue('# TYPE opencenter_http_request_duration_seconds '
+                        'histogram' in resp.data)
+        self.assertTrue('opencenter_http_request_duration_seconds_bucket{'
+                        'blueprint="nodes",le="+Inf",method="GET",'
+                        'route="/nodes/<object_id>"}' in resp.data)
+        self.assertTrue('opencenter_dispatcher_dispatched ' in resp.data)
+
+        resp = self.client.get('/admin/metrics/?format=prometheus')
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+
+    def test_bad_format(self):
+        resp = self.client.get('/admin/metrics/?format=xml')
+        self.assertEquals(resp.status_code, 400)
+
+    def test_incr(self):
+        before = metrics.counters.get(('widgets', 'nodes'), 0)
+        metrics.incr('widgets', 2, label='nodes')
+        self.assertEquals(metrics.counters[('widgets', 'nodes')], before + 2)
+        del metrics.counters[('widgets', 'nodes')]
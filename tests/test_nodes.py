@@ -27,6 +27,10 @@ import random
 import string
 import unittest2
 
+from sqlalchemy import event
+
+import opencenter.webapp.utility
+from opencenter.db import database
 from opencenter.db.database import init_db
 from opencenter import webapp
 
@@ -74,6 +78,62 @@ class NodeRegister(OpenCenterTestCase):
                           "Node ID or hostname required.")
         self.assertEquals(out['status'], 400)
 
+    def _whoami(self, **data):
+        resp = self.client.post('/nodes/whoami',
+                                content_type=self.content_type,
+                                data=json.dumps(data))
+        self.assertEquals(resp.status_code, 200)
+        return json.loads(resp.data)
+
+    def test_registration(self):
+        self.app.config['hostidfile'] = '/nonexistent/hostid'
+        node_id = self._whoami(hostname=self.name)['node_id']
+
+        node = self._whoami(node_id=node_id)['node']
+        unprovisioned = opencenter.webapp.utility.unprovisioned_container()
+        self.assertEquals(node['facts']['parent_id'], unprovisioned['id'])
+        self.assertEquals(node['facts']['backends'], ['node', 'agent'])
+        self.assertTrue(node['attrs']['registered'])
+        self.assertTrue(node['attrs']['converged'])
+
+    def test_existing_node_registration(self):
+        existing = self._model_create('nodes', name=self.name)
+        self.assertEquals(self._whoami(hostname=self.name)['node_id'],
+                          existing['id'])
+
+        # now registered, so the next one is new
+        self.assertNotEquals(self._whoami(hostname=self.name)['node_id'],
+                             existing['id'])
+
+    def test_registration_commits_once(self):
+        for x in range(20):
+            self._model_create('nodes', name=_randomStr(10))
+
+        commits = []
+        statements = []
+        counting = [True]
+
+        def count_commit(conn):
+            if counting[0]:
+                commits.append(conn)
+
+        def count_statement(conn, cursor, statement, *args):
+            if counting[0]:
+                statements.append(statement)
+
+        database.session.commit()
+        event.listen(database.session.get_bind(), 'commit', count_commit)
+        event.listen(database.session.get_bind(), 'before_cursor_execute',
+                     count_statement)
+        try:
+            self._whoami(hostname=self.name)
+        finally:
+            counting[0] = False
+
+        self.assertEquals(len(commits), 1)
+        # an indexed lookup, not a scan over every node
+        self.assertTrue(len(statements) < 20)
+
 # shep, i broke this.  sorry.  but I'm testing more than this in
 # happypathtests, so we can argue over it tomorrow?  :)
 
@@ -360,6 +420,121 @@ class NodeTransactionTests(OpenCenterTestCase):
         self.assertEquals(trans['session_key'], session_key)
         self.assertEquals(set(changed_nodes), set([my_node['id']]))
 
+    def _get_delta(self, trans, query):
+        resp = self.client.get('/nodes/updates/%s/%s?%s' %
+                               (trans['session_key'], trans['txid'], query))
+        self.assertEquals(resp.status_code, 200)
+        return json.loads(resp.data)
+
+    def test_updates_without_delta(self):
+        trans = self._get_txid()
+        self._model_create('attrs', node_id=self.node['id'],
+                           key='x', value=1)
+
+        out = self._get_delta(trans, '')
+        self.assertFalse('delta' in out)
+
+    def test_delta_objects(self):
+        trans = self._get_txid()
+        self._model_create('attrs', node_id=self.node['id'],
+                           key='x', value=1)
+
+        delta = self._get_delta(trans, 'delta=objects')['delta']
+        self.assertTrue(delta['complete'])
+        self.assertEquals(len(delta['objects']), 1)
+        self.assertEquals(delta['objects'][0]['id'], self.node['id'])
+        self.assertEquals(delta['objects'][0]['attrs']['x'], 1)
+
+    def test_delta_diff(self):
+        self._model_create('facts', node_id=self.node['id'],
+                           key='untouched', value=1)
+        trans = self._get_txid()
+        self._model_create('facts', node_id=self.node['id'],
+                           key='touched', value=2)
+
+        delta = self._get_delta(trans, 'delta=diff')['delta']
+        self.assertEquals(delta['objects'][0]['facts'], {'touched': 2})
+        self.assertEquals(delta['objects'][0]['attrs'], {})
+        self.assertEquals(delta['objects'][0]['name'], self.node['name'])
+
+    def test_delta_diff_inherited(self):
+        # children of a changed container get their whole object,
+        # since their inherited facts changed
+        self._reparent_nodes([self.node_a], self.container['id'])
+        trans = self._get_txid()
+        self._model_create('facts', node_id=self.container['id'],
+                           key='x', value=1)
+
+        delta = self._get_delta(trans, 'delta=diff')['delta']
+        objects = dict([(x['id'], x) for x in delta['objects']])
+        self.assertEquals(objects[self.container['id']]['facts'], {'x': 1})
+        self.assertEquals(objects[self.node_a['id']]['facts']['parent_id'],
+                          self.container['id'])
+
+    def test_delta_diff_reparented(self):
+        # a reparented node inherits from its new parent, so it is
+        # sent whole rather than just its parent_id
+        first = self._model_create('nodes', name='first')
+        second = self._model_create('nodes', name='second')
+        self._model_create('facts', node_id=first['id'],
+                           key='ram_allocation_ratio', value=1)
+        self._model_create('facts', node_id=second['id'],
+                           key='ram_allocation_ratio', value=2)
+        self._reparent_nodes([self.node_a], first['id'])
+
+        trans = self._get_txid()
+        self._reparent_nodes([self.node_a], second['id'])
+
+        delta = self._get_delta(trans, 'delta=diff')['delta']
+        objects = dict([(x['id'], x) for x in delta['objects']])
+        facts = objects[self.node_a['id']]['facts']
+        self.assertEquals(facts['ram_allocation_ratio'], 2)
+        self.assertEquals(
+            facts, self._model_get_by_id('nodes', self.node_a['id'])['facts'])
+
+    def test_delta_diff_inherited_and_own(self):
+        # a node whose own attr changed along with a fact it
+        # inherits is sent whole
+        self._reparent_nodes([self.node_a], self.container['id'])
+        trans = self._get_txid()
+        self._model_create('facts', node_id=self.container['id'],
+                           key='ram_allocation_ratio', value=1)
+        self._model_create('attrs', node_id=self.node_a['id'],
+                           key='y', value=2)
+
+        delta = self._get_delta(trans, 'delta=diff')['delta']
+        objects = dict([(x['id'], x) for x in delta['objects']])
+        node = objects[self.node_a['id']]
+        self.assertEquals(node['facts']['ram_allocation_ratio'], 1)
+        self.assertEquals(node['facts']['parent_id'], self.container['id'])
+        self.assertEquals(node['attrs']['y'], 2)
+
+    def test_delta_deleted(self):
+        my_node = self._model_create('nodes', name='delete_me')
+        trans = self._get_txid()
+        self._model_delete('nodes', my_node['id'])
+
+        delta = self._get_delta(trans, 'delta=diff')['delta']
+        self.assertEquals(delta['objects'], [])
+        self.assertEquals(delta['deleted'], [my_node['id']])
+
+    def test_delta_budget(self):
+        trans = self._get_txid()
+        for node in (self.node_a, self.node_b, self.node_c):
+            self._model_create('attrs', node_id=node['id'],
+                               key='x', value=1)
+
+        out = self._get_delta(trans, 'delta=objects&budget=10')
+        self.assertFalse(out['delta']['complete'])
+        self.assertEquals(out['delta']['objects'], [])
+        self.assertEquals(len(out['nodes']), 3)
+
+    def test_delta_bad_mode(self):
+        trans = self._get_txid()
+        resp = self.client.get('/nodes/updates/%s/%s?delta=bogus' %
+                               (trans['session_key'], trans['txid']))
+        self.assertEquals(resp.status_code, 400)
+
 
 class NodeMiscTests(OpenCenterTestCase):
     def test_cascading_deletes(self):
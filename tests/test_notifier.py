@@ -0,0 +1,123 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import gevent
+
+from opencenter.webapp import utility
+
+from util import OpenCenterTestCase
+
+
+class NotifierTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+
+        self.notifier = self.app.notifier
+        self.notifier.flush()
+        self.old_window = self.notifier.window
+
+        self.container = self._stub_node(
+            'container', facts={'backends': ['container', 'node']})
+        self.children = [
+            self._stub_node('child%d' % x,
+                            facts={'parent_id': self.container['id']})
+            for x in range(3)]
+        self.other = self._stub_node('other')
+        self.notifier.flush()
+
+    def tearDown(self):
+        self.notifier.window = self.old_window
+
+    def test_burst_is_coalesced(self):
+        self.notifier.window = 60
+        trans = self._get_txid()
+        flushes = self.notifier.stats['flushes']
+
+        for x in range(20):
+            self._model_create('facts', node_id=self.container['id'],
+                               key='fact%d' % x, value=x)
+
+        # nothing has gone out yet
+        self.assertEquals(self.notifier.stats['flushes'], flushes)
+
+        with utility.subscribe('nodes-id-*') as sub:
+            _, changed = self._model_get_updates(
+                'nodes', trans['session_key'], trans['txid'])
+            events = sub.get_all(0)
+
+        self.assertEquals(self.notifier.stats['flushes'], flushes + 1)
+        self.assertEquals(set(changed),
+                          set([self.container['id']] +
+                              [x['id'] for x in self.children]))
+
+        # each child is woken once for the whole burst
+        woken = sorted(e['ids'][0] for e in events)
+        self.assertEquals(woken, sorted(x['id'] for x in self.children))
+
+    def test_window_expires(self):
+        self.notifier.window = 0.01
+        flushes = self.notifier.stats['flushes']
+
+        with utility.subscribe('nodes-changes') as sub:
+            self._model_create('attrs', node_id=self.other['id'],
+                               key='x', value=1)
+            # the broker is shared with other test apps, so skip
+            # anything that isn't ours
+            event = sub.get(5)
+            while event is not None and \
+                    event['ids'] != [self.other['id']]:
+                event = sub.get(5)
+
+        self.assertEquals(self.notifier.stats['flushes'], flushes + 1)
+        self.assertIsNotNone(event)
+
+    def test_no_window(self):
+        self.notifier.window = 0
+        flushes = self.notifier.stats['flushes']
+
+        self._model_create('facts', node_id=self.other['id'],
+                           key='x', value=1)
+        self._model_create('facts', node_id=self.other['id'],
+                           key='y', value=1)
+
+        self.assertEquals(self.notifier.stats['flushes'], flushes + 2)
+        self.assertIsNone(self.notifier.greenlet)
+
+    def test_subtree_of_nested_containers(self):
+        self.notifier.window = 60
+        inner = self._stub_node(
+            'inner', facts={'backends': ['container', 'node'],
+                            'parent_id': self.container['id']})
+        leaf = self._stub_node('leaf', facts={'parent_id': inner['id']})
+        trans = self._get_txid()
+
+        self._model_create('facts', node_id=self.container['id'],
+                           key='x', value=1)
+        _, changed = self._model_get_updates(
+            'nodes', trans['session_key'], trans['txid'])
+
+        self.assertTrue(inner['id'] in changed)
+        self.assertTrue(leaf['id'] in changed)
+        self.assertFalse(self.other['id'] in changed)
@@ -0,0 +1,153 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+import urlparse
+
+from opencenter.db.api import api_from_models
+
+from util import OpenCenterTestCase
+
+
+class PagingTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.nodes = [self._stub_node(name) for name in
+                      ['delta', 'alpha', 'echo', 'charlie', 'bravo']]
+        self.tasks = []
+        for node in self.nodes:
+            task = self._model_create('tasks', node_id=node['id'],
+                                      action='run', payload={})
+            self.tasks.append(task)
+
+        # a few tasks with parents, so sorting sees both nulls and
+        # values
+        for task in self.tasks[:2]:
+            self._model_update('tasks', task['id'],
+                               parent_id=self.tasks[-1]['id'])
+
+    def _get(self, url, expect_code=200):
+        resp = self.client.get(url)
+        self.assertEquals(resp.status_code, expect_code)
+        return resp, json.loads(resp.data)
+
+    def _walk(self, what, url, warm=False):
+        results = []
+        pages = 0
+        while url is not None:
+            if warm:
+                api_from_models()._model_get_all(what)
+            else:
+                api_from_models().destroy_cache()
+
+            resp, out = self._get(url)
+            results += out[what]
+            pages += 1
+
+            url = out.get('next')
+            if url is not None:
+                self.assertEquals(resp.headers['Link'],
+                                  '<%s>; rel="next"' % url)
+                parsed = urlparse.urlparse(url)
+                url = '%s?%s' % (parsed.path, parsed.query)
+        return results, pages
+
+    def test_unpaged(self):
+        _, out = self._get('/nodes/')
+        self.assertEquals(len(out['nodes']), 5)
+        self.assertFalse('next' in out)
+
+    def test_limit(self):
+        resp, out = self._get('/nodes/?limit=2')
+        self.assertEquals([x['id'] for x in out['nodes']],
+                          sorted([x['id'] for x in self.nodes])[:2])
+        self.assertTrue('cursor=' in out['next'])
+
+    def test_walk_pages(self):
+        for warm in (False, True):
+            results, pages = self._walk('nodes', '/nodes/?limit=2', warm)
+            self.assertEquals(pages, 3)
+            self.assertEquals([x['id'] for x in results],
+                              sorted([x['id'] for x in self.nodes]))
+
+    def test_sort(self):
+        for warm in (False, True):
+            results, _ = self._walk('nodes', '/nodes/?sort=name&limit=2',
+                                    warm)
+            self.assertEquals([x['name'] for x in results],
+                              ['alpha', 'bravo', 'charlie', 'delta', 'echo'])
+
+            results, _ = self._walk('nodes', '/nodes/?sort=-name&limit=3',
+                                    warm)
+            self.assertEquals([x['name'] for x in results],
+                              ['echo', 'delta', 'charlie', 'bravo', 'alpha'])
+
+    def test_sort_without_limit(self):
+        _, out = self._get('/nodes/?sort=-name')
+        self.assertEquals(out['nodes'][0]['name'], 'echo')
+        self.assertFalse('next' in out)
+
+    def test_sort_with_nulls(self):
+        # sql and in-memory paging must agree, nulls and ties included
+        for sort in ('parent_id', '-parent_id'):
+            url = '/tasks/?sort=%s&limit=2' % sort
+            cold, _ = self._walk('tasks', url)
+            warm, _ = self._walk('tasks', url, warm=True)
+            self.assertEquals(len(cold), 5)
+            self.assertEquals([x['id'] for x in cold],
+                              [x['id'] for x in warm])
+
+        ids = [x['id'] for x in self._walk('tasks', url)[0]]
+        with_parent = sorted([x['id'] for x in self.tasks[:2]],
+                             reverse=True)
+        self.assertEquals(ids[-2:], with_parent)
+
+    def test_fields_and_paging(self):
+        results, _ = self._walk('nodes', '/nodes/?sort=name&limit=2&'
+                                'fields=name')
+        self.assertEquals(results[0], {'name': 'alpha'})
+        self.assertEquals(len(results), 5)
+
+    def test_bad_arguments(self):
+        self._get('/nodes/?limit=none', expect_code=400)
+        self._get('/nodes/?limit=0', expect_code=400)
+        self._get('/nodes/?sort=facts', expect_code=400)
+        self._get('/nodes/?sort=bogus', expect_code=400)
+        self._get('/nodes/?cursor=bogus', expect_code=400)
+
+        _, out = self._get('/nodes/?sort=name&limit=1')
+        cursor = urlparse.parse_qs(
+            urlparse.urlparse(out['next']).query)['cursor'][0]
+        self._get('/nodes/?sort=-name&cursor=%s' % cursor, expect_code=400)
+
+    def test_max_page_size(self):
+        old = self.app.config['max_page_size']
+        self.app.config['max_page_size'] = 2
+        try:
+            _, out = self._get('/nodes/?limit=100')
+            self.assertEquals(len(out['nodes']), 2)
+            self.assertTrue('next' in out)
+        finally:
+            self.app.config['max_page_size'] = old
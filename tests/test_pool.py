@@ -0,0 +1,251 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+from util import OpenCenterTestCase
+
+import gevent
+
+import opencenter.backends
+from opencenter.db import api as db_api
+from opencenter.db import database
+from opencenter.db import models
+from opencenter.db import exceptions
+from opencenter.webapp import metrics
+from opencenter.webapp import pool
+from opencenter.webapp import utility
+
+api = db_api.api_from_models()
+
+
+class PoolTestCase(OpenCenterTestCase):
+    def setUp(self):
+        if opencenter.backends.primitive_by_name('test.set_test_fact') is None:
+            opencenter.backends.load_specific_backend('tests.test',
+                                                      'TestBackend')
+
+        self._clean_all()
+
+        self.adv = self._stub_node(
+            'adventurator',
+            facts={'backends': ['node', 'agent']},
+            attrs={'opencenter_agent_output_modules': ['adventurator']})
+        self.container = self._stub_node(
+            'container',
+            facts={'backends': ['node', 'container']})
+        self.node = self._stub_node('node-1', facts={'solved_fact': 'z'})
+
+        self.api = api
+        self.constraints = ['facts.solved_fact = "a"',
+                            'facts.test_fact = "b"']
+
+    def tearDown(self):
+        self._clean_all()
+
+    def test_snapshot(self):
+        snapshot = db_api.snapshot_from_api(self.api)
+        snapshot_api = db_api.api_from_snapshot(snapshot)
+
+        node = snapshot_api._model_get_by_id('nodes', self.node['id'])
+        self.assertEquals(node['facts']['solved_fact'], 'z')
+
+        self.assertRaises(exceptions.IdNotFound,
+                          snapshot_api._model_get_by_id, 'nodes', 999999)
+
+        # the snapshot is a copy, later changes don't reach it
+        self._model_create('facts', node_id=self.node['id'],
+                           key='test_fact', value='b')
+        node = snapshot_api._model_get_by_id('nodes', self.node['id'])
+        self.assertFalse('test_fact' in node['facts'])
+
+    def test_solve_nodes(self):
+        self._model_create('facts', node_id=self.node['id'],
+                           key='parent_id', value=self.container['id'])
+
+        # the node and its container, not the unrelated adventurator
+        self.assertEquals(pool.solve_nodes(self.api, self.node['id'],
+                                           self.constraints),
+                          set([self.node['id'], self.container['id']]))
+        self.assertEquals(pool.solve_nodes(self.api, self.node['id'],
+                                           ['count(filter("nodes", '
+                                            '"true")) > 0']),
+                          None)
+
+        snapshot = db_api.snapshot_from_api(
+            self.api, node_ids=[self.node['id']])
+        self.assertEquals([x['id'] for x in snapshot['nodes']['rows']],
+                          [self.node['id']])
+        self.assertEquals(set([x['node_id'] for x in
+                               snapshot['facts']['rows']]),
+                          set([self.node['id']]))
+
+    def test_snapshot_many_nodes(self):
+        nodes = [models.Nodes('many-%d' % x) for x in range(1100)]
+        database.session.add_all(nodes)
+        database.session.flush()
+        database.session.add_all([models.Facts(x.id, 'many', 1)
+                                  for x in nodes])
+        database.session.commit()
+        self.api.destroy_cache()
+
+        node_ids = [x.id for x in nodes]
+        try:
+            snapshot = db_api.snapshot_from_api(self.api, node_ids=node_ids)
+        finally:
+            # far quicker than deleting them one by one through the api
+            database.session.execute(models.Facts.__table__.delete().where(
+                models.Facts.key == 'many'))
+            database.session.execute(models.Nodes.__table__.delete().where(
+                models.Nodes.name.like('many-%')))
+            database.session.commit()
+            self.api.destroy_cache()
+
+        self.assertEquals(len(snapshot['nodes']['rows']), 1100)
+        self.assertEquals(set([x['node_id'] for x in
+                               snapshot['facts']['rows']]),
+                          set(node_ids))
+
+    def test_solve_from_snapshot(self):
+        snapshot_api = db_api.api_from_snapshot(
+            db_api.snapshot_from_api(self.api))
+
+        self.assertEquals(
+            utility.solve_for_node(self.node['id'], self.constraints,
+                                   api=snapshot_api),
+            utility.solve_for_node(self.node['id'], self.constraints,
+                                   api=self.api))
+
+    def test_in_process(self):
+        solver_pool = pool.SolverPool(size=0)
+        solver_pool.start()
+
+        result = solver_pool.solve(self.node['id'], self.constraints,
+                                   api=self.api)
+
+        self.assertTrue(result[0])
+        self.assertEquals(solver_pool.stats['in_process'], 1)
+        self.assertEquals(solver_pool.stats['solves'], 0)
+
+    def test_workers(self):
+        solver_pool = pool.SolverPool(size=1)
+        solver_pool.start()
+        try:
+            key = ('solver_states_expanded', None)
+            before = metrics.counters.get(key, 0)
+
+            result = solver_pool.solve(self.node['id'], self.constraints,
+                                       api=self.api)
+            self.assertEquals(solver_pool.stats['solves'], 1)
+
+            # what the worker counted is added to the server's counters
+            self.assertTrue(metrics.counters.get(key, 0) > before)
+
+            self.assertEquals(result,
+                              utility.solve_for_node(self.node['id'],
+                                                     self.constraints,
+                                                     api=self.api))
+
+            # and errors make it back
+            self.assertRaises(exceptions.IdNotFound, solver_pool.solve,
+                              999999, self.constraints, api=self.api)
+        finally:
+            solver_pool.stop()
+
+        self.assertEquals(solver_pool.stats['workers'], 0)
+
+    def test_ifcount_nodes(self):
+        # an interface no primitive takes as an argument
+        self._model_create('filters', name='counted',
+                           filter_type='interface',
+                           expr='name = "container"')
+        constraints = ['facts.solved_fact = "a"', "ifcount('counted') > 0"]
+
+        self.assertTrue(self.container['id'] in
+                        pool.solve_nodes(self.api, self.node['id'],
+                                         constraints))
+        self.assertEquals(pool.solve_nodes(self.api, self.node['id'],
+                                           ['ifcount(facts.x) > 0']),
+                          None)
+
+        solver_pool = pool.SolverPool(size=1)
+        solver_pool.start()
+        try:
+            self.assertEquals(solver_pool.solve(self.node['id'], constraints,
+                                                api=self.api),
+                              utility.solve_for_node(self.node['id'],
+                                                     constraints,
+                                                     api=self.api))
+        finally:
+            solver_pool.stop()
+
+    def test_timeout(self):
+        solver_pool = pool.SolverPool(size=1, timeout=0)
+        solver_pool.start()
+        try:
+            self.assertRaises(ValueError, solver_pool.solve,
+                              self.node['id'], self.constraints,
+                              api=self.api)
+        finally:
+            solver_pool.stop()
+
+        self.assertEquals(solver_pool.stats['timeouts'], 1)
+
+    def test_hub_runs_during_solve(self):
+        solver_pool = pool.SolverPool(size=1)
+        solver_pool.start()
+
+        ticks = []
+
+        def tick():
+            while True:
+                gevent.sleep(0.01)
+                ticks.append(True)
+
+        ticker = gevent.spawn(tick)
+        try:
+            solver_pool.solve(self.node['id'], self.constraints,
+                              api=self.api)
+        finally:
+            ticker.kill()
+            solver_pool.stop()
+
+        self.assertTrue(len(ticks) > 0)
+
+    def test_request_in_worker(self):
+        solver_pool = pool.SolverPool(size=1)
+        solver_pool.start()
+        in_process = self.app.solver_pool
+        self.app.solver_pool = solver_pool
+        try:
+            resp = self._model_create('facts', node_id=self.node['id'],
+                                      key='solved_fact', value='a',
+                                      please=True, raw=True,
+                                      expect_code=202)
+        finally:
+            self.app.solver_pool = in_process
+            solver_pool.stop()
+
+        self.assertEquals(solver_pool.stats['solves'], 1)
+        self.assertTrue('node.set_fact' in
+                        [x['primitive'] for x in resp['plan']])
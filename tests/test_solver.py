@@ -304,6 +304,103 @@ class SolverTestCase(OpenCenterTestCase):
         self.assertEquals(int(node['facts']['test2_fact']),
                           int(newcontainer['id']))
 
+    def test_transpositions_pruned(self):
+        # setting two facts in either order ends up in the same
+        # state, which should only be searched once
+        self._make_adventurator()
+
+        top = solver.Solver(self.api, self.node['id'],
+                            ['facts.solved_fact = "a"',
+                             'facts.test_fact = "b"'])
+        solvable, choosable, plan = top.solve()
+
+        self.assertTrue(solvable)
+        self.assertEquals(len([x for x in plan
+                               if x['primitive'] == 'node.set_fact']), 2)
+        self.assertTrue(top.stats['pruned'] > 0)
+
+        seen = []
+        states = [top]
+        while states:
+            state = states.pop()
+            self.assertFalse(state.fingerprint() in seen)
+            seen.append(state.fingerprint())
+            states += state.children
+
+    def test_children_layered(self):
+        # each state holds only its own consequences, on top of
+        # its parent's
+        self._make_adventurator()
+
+        top = solver.Solver(self.api, self.node['id'],
+                            ['facts.solved_fact = "a"',
+                             'facts.test_fact = "b"'])
+        top.solve()
+
+        states = list(top.children)
+        while states:
+            state = states.pop()
+            layer = state.api.model_list['facts']
+            self.assertTrue(layer.parent is
+                            state.parent.api.model_list['facts'])
+            self.assertEquals(state.applied_consequences[
+                :len(state.parent.applied_consequences)],
+                state.parent.applied_consequences)
+            states += state.children
+
+    def _solution_cost(self, top):
+        # the solved tree is pruned down to the plan
+        while top.children:
+            top = top.children[0]
+        return top.cost
+
+    def test_weighted_search(self):
+        self._make_adventurator()
+        constraints = ['facts.solved_fact = "a"', 'facts.test_fact = "b"']
+
+        breadth = solver.Solver(self.api, self.node['id'], constraints)
+        weighted = solver.Solver(self.api, self.node['id'], constraints)
+
+        breadth_result = breadth.solve('breadth')
+        solvable, choosable, plan = weighted.solve('weighted')
+
+        self.assertTrue(solvable)
+        self.assertEquals(sorted([x['primitive'] for x in plan]),
+                          sorted([x['primitive'] for x in breadth_result[2]]))
+        self.assertTrue(self._solution_cost(weighted) <=
+                        self._solution_cost(breadth))
+
+        self._run_plan_safe(plan, self.node['id'])
+        node = self._model_get_by_id('nodes', self.node['id'])
+        self.assertEquals(node['facts']['solved_fact'], 'a')
+        self.assertEquals(node['facts']['test_fact'], 'b')
+
+    def test_weighted_search_unsolvable(self):
+        self._make_adventurator()
+
+        top = solver.Solver(self.api, self.node['id'],
+                            ['facts.bogus_value = "a"'])
+        self.assertEquals(top.solve('weighted'), (False, False, []))
+
+    def test_weighted_search_gives_up(self):
+        self._make_adventurator()
+        constraints = ['facts.solved_fact = "a"', 'facts.test_fact = "b"']
+
+        old = solver.max_expansions
+        solver.max_expansions = 1
+        try:
+            top = solver.Solver(self.api, self.node['id'], constraints)
+            self.assertEquals(top.solve('weighted'), (False, False, []))
+        finally:
+            solver.max_expansions = old
+
+        self.assertEquals(top.stats['expanded'], 1)
+
+    def test_unknown_search(self):
+        top = solver.Solver(self.api, self.node['id'],
+                            ['facts.solved_fact = "a"'])
+        self.assertRaises(ValueError, top.solve, 'sideways')
+
 
     # def test_nova_backend(self):
     #     # make sure adding a nova backend pulls in chef-client
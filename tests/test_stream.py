@@ -0,0 +1,197 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import json
+
+from opencenter.db.api import api_from_models
+from opencenter.webapp import stream as stream_module
+from opencenter.webapp import utility
+
+from util import OpenCenterTestCase
+
+
+class StreamTests(OpenCenterTestCase):
+    def setUp(self):
+        self._clean_all()
+        self.app.config['stream_keepalive'] = 0.1
+        # one event per write
+        self.app.notifier.window = 0
+
+        self.container = self._model_create('nodes', name='container')
+        self._model_create('facts', node_id=self.container['id'],
+                           key='backends', value=['container', 'node'])
+        self.child = self._model_create('nodes', name='child')
+        self._model_create('facts', node_id=self.child['id'],
+                           key='parent_id', value=self.container['id'])
+        self.other = self._model_create('nodes', name='other')
+
+        self.streams = []
+
+    def tearDown(self):
+        for resp in self.streams:
+            resp.close()
+
+        # closing the response drops the subscription
+        self.assertFalse(utility.broker.subscribers('nodes-changes'))
+
+    def _open(self, url='/stream/', **kwargs):
+        resp = self.client.get(url, **kwargs)
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals(resp.mimetype, 'text/event-stream')
+        self.streams.append(resp)
+        return iter(resp.response)
+
+    def _touch(self, node):
+        # attrs don't inherit, so this changes just the one node
+        self._model_create('attrs', node_id=node['id'], key='touched',
+                           value=True)
+
+    def _next_event(self, stream, tries=5):
+        # skip keepalives; give up after a few so a broken stream
+        # fails rather than hangs
+        for x in range(tries):
+            chunk = stream.next()
+            if chunk.startswith(':'):
+                continue
+
+            event = {}
+            for line in chunk.strip().split('\n'):
+                field, _, value = line.partition(': ')
+                event[field] = value
+            event['data'] = json.loads(event['data'])
+            return event
+        return None
+
+    def test_initial_transaction_event(self):
+        stream = self._open()
+        event = self._next_event(stream)
+
+        self.assertEquals(event['event'], 'transaction')
+        session_key, txid = event['id'].split(':')
+        self.assertEquals(event['data']['session_key'], session_key)
+        self.assertEquals(event['data']['txid'], txid)
+        self.assertTrue('retry' in event)
+
+    def test_node_update_pushed(self):
+        stream = self._open(url='/stream/?models=nodes')
+        self._next_event(stream)
+
+        self._touch(self.other)
+        event = self._next_event(stream)
+
+        self.assertEquals(event['event'], 'nodes')
+        self.assertEquals(event['data']['ids'], [self.other['id']])
+
+    def test_fact_and_task_changes_pushed(self):
+        stream = self._open(url='/stream/?models=facts,tasks')
+        self._next_event(stream)
+
+        fact = self._model_create('facts', node_id=self.other['id'],
+                                  key='x', value=1)
+        event = self._next_event(stream)
+        self.assertEquals(event['event'], 'facts')
+        self.assertEquals(event['data']['ids'], [fact['id']])
+        self.assertEquals(event['data']['node_ids'], [self.other['id']])
+
+        task = self._model_create('tasks', node_id=self.other['id'],
+                                  action='run', payload={})
+        event = self._next_event(stream)
+        self.assertEquals(event['event'], 'tasks')
+        self.assertEquals(event['data']['ids'], [task['id']])
+
+    def test_resume_with_last_event_id(self):
+        stream = self._open()
+        last_id = self._next_event(stream)['id']
+
+        self._touch(self.other)
+        self._touch(self.child)
+
+        stream = self._open(url='/stream/?models=nodes',
+                            headers={'Last-Event-ID': last_id})
+        first = self._next_event(stream)
+        second = self._next_event(stream)
+
+        self.assertEquals(first['event'], 'nodes')
+        self.assertEquals(first['data']['ids'], [self.other['id']])
+        self.assertEquals(second['data']['ids'], [self.child['id']])
+        self.assertTrue(int(first['data']['txid']) <
+                        int(second['data']['txid']))
+
+    def test_backlog_not_repeated_live(self):
+        subscription = utility.subscribe('nodes-changes')
+        # a change that lands after subscribing but before the
+        # backlog is read is seen by both
+        for txid in ['8', '9']:
+            utility.notify('nodes-changes', ids=[self.other['id']],
+                           txid=txid, model='nodes',
+                           node_ids=[self.other['id']])
+        backlog = [{'model': 'nodes', 'ids': [self.other['id']],
+                    'node_ids': [self.other['id']], 'txid': '8'}]
+
+        stream_filter = stream_module.StreamFilter(api_from_models())
+        events = stream_module._stream(subscription, 'key', None, backlog,
+                                       stream_filter, 0.1)
+        try:
+            self.assertTrue('id: key:8\n' in events.next())
+            self.assertTrue('id: key:9\n' in events.next())
+        finally:
+            subscription.close()
+
+    def test_resume_unknown_session_resets(self):
+        stream = self._open(headers={'Last-Event-ID': 'bogus:1.0'})
+        event = self._next_event(stream)
+        self.assertEquals(event['event'], 'reset')
+
+    def test_subtree_filter(self):
+        stream = self._open(url='/stream/?models=nodes&node=%s' %
+                            self.container['id'])
+        self._next_event(stream)
+
+        self._touch(self.other)
+        self._touch(self.child)
+
+        event = self._next_event(stream)
+        self.assertEquals(event['data']['ids'], [self.child['id']])
+
+    def test_expression_filter(self):
+        stream = self._open(url='/stream/?filter=name="other"')
+        self._next_event(stream)
+
+        self._model_create('facts', node_id=self.child['id'],
+                           key='x', value=1)
+        self._model_create('facts', node_id=self.other['id'],
+                           key='x', value=1)
+
+        event = self._next_event(stream)
+        self.assertEquals(event['event'], 'facts')
+        self.assertEquals(event['data']['node_ids'], [self.other['id']])
+
+    def test_bad_requests(self):
+        resp = self.client.get('/stream/?models=bogus')
+        self.assertEquals(resp.status_code, 400)
+        resp = self.client.get('/stream/?node=99999')
+        self.assertEquals(resp.status_code, 404)
+        resp = self.client.get('/stream/?filter=name=')
+        self.assertEquals(resp.status_code, 400)
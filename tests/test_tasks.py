@@ -30,6 +30,9 @@ import time
 import unittest2
 
 from opencenter import webapp
+from opencenter.db.abstraction import SqlAlchemyAbstraction
+from opencenter.db.api import api_from_models
+from opencenter.webapp.ast import FilterBuilder, FilterTokenizer
 
 from util import OpenCenterTestCase
 from util import inject
@@ -69,6 +72,7 @@ class TestTaskPruning(OpenCenterTestCase):
                            payload={},
                            completed=too_short_to_prune)
 
+        self.app.task_reaper.reap()
         all_tasks = self._model_get_all('tasks')
         self.assertTrue(len(all_tasks) == 1)
 
@@ -78,15 +82,97 @@ class TestTaskPruning(OpenCenterTestCase):
         all_tasks = self._model_get_all('tasks')
         self.assertTrue(len(all_tasks) == 0)
 
+        task = self._model_create('tasks', state='done',
+                                  node_id=self.node['id'],
+                                  action='something',
+                                  payload={},
+                                  completed=prunable_time)
+
+        self.app.task_reaper.reap()
+        all_tasks = self._model_get_all('tasks')
+        self.assertTrue(len(all_tasks) == 0)
+
+        # ... but it still lives on in the archive
+        archived = self._model_get_by_id('archives', task['id'])
+        self.assertEquals(archived['state'], 'done')
+        self.assertEquals(archived['node_id'], self.node['id'])
+        self.assertIsNotNone(archived['archived'])
+
+    def test_purge_old_archived_tasks(self):
+        prunable_time = int(time.time()) - 1801
+
+        task = self._model_create('tasks', state='timeout',
+                                  node_id=self.node['id'],
+                                  action='something',
+                                  payload={},
+                                  completed=prunable_time)
+
+        self.app.task_reaper.reap()
+        self._model_get_by_id('archives', task['id'])
+
+        retention = self.app.task_reaper.retention
+        self.app.task_reaper.reap(time.time() + retention + 1)
+        self._model_get_by_id('archives', task['id'], expect_code=404,
+                              raw=True)
+
+    def test_listing_does_not_prune(self):
+        prunable_time = int(time.time()) - 1801
+
         self._model_create('tasks', state='done',
                            node_id=self.node['id'],
                            action='something',
                            payload={},
                            completed=prunable_time)
 
+        all_tasks = self._model_get_all('tasks')
+        self.assertTrue(len(all_tasks) == 1)
+
+    def test_prune_in_batches(self):
+        prunable_time = int(time.time()) - 1801
+
+        for x in range(5):
+            self._model_create('tasks', state='cancelled',
+                               node_id=self.node['id'],
+                               action='something',
+                               payload={},
+                               completed=prunable_time)
+
+        reaper = webapp.tasks.TaskReaper(threshold=1800, batch_size=2)
+        self.assertEquals(reaper.reap(), 5)
+        self.assertEquals(reaper.stats['runs'], 1)
+        self.assertEquals(reaper.stats['last_reaped'], 5)
+
         all_tasks = self._model_get_all('tasks')
         self.assertTrue(len(all_tasks) == 0)
 
+    def test_sql_comparisons_match_filter(self):
+        now = int(time.time())
+        for completed in [None, now - 10, now + 10]:
+            self._model_create('tasks', state='done',
+                               node_id=self.node['id'],
+                               action='something',
+                               payload={},
+                               completed=completed)
+
+        api = api_from_models()
+        tasks = api.model_list['tasks']
+        while not isinstance(tasks, SqlAlchemyAbstraction):
+            tasks = tasks.base
+
+        for query in ['completed < %d' % now, 'completed <= %d' % now,
+                      'completed > %d' % now, 'completed >= %d' % now,
+                      'completed < "%d"' % now, 'action < 5',
+                      'action >= "s"']:
+            builder = FilterBuilder(FilterTokenizer(), 'tasks: %s' % query,
+                                    api=api)
+            self.assertEquals(sorted([x['id'] for x in tasks.query(query)]),
+                              sorted([x['id'] for x in builder.filter()]))
+
+        # a task with no completion time is never old enough
+        self.app.task_reaper.reap(now + 3600)
+        self.assertEquals([x['completed'] for x in
+                           self._model_get_all('tasks')], [None])
+
     def test_do_not_prune_running_tasks(self):
         prunable_time = int(time.time()) - 1801
 
@@ -99,6 +185,7 @@ class TestTaskPruning(OpenCenterTestCase):
                            payload={},
                            completed=prunable_time)
 
+        self.app.task_reaper.reap()
         all_tasks = self._model_get_all('tasks')
         self.assertTrue(len(all_tasks) == 1)
 
@@ -121,7 +208,7 @@ class TaskCreateTests(unittest2.TestCase):
 
     @classmethod
     def tearDownClass(self):
-        pass
+        self.foo.close()
 
     def setUp(self):
         self.node_id = 99
@@ -181,7 +268,7 @@ class TaskUpdateTests(unittest2.TestCase):
 
     @classmethod
     def tearDownClass(self):
-        pass
+        self.foo.close()
 
     def setUp(self):
         # required fields: node_id, action, payload, state
@@ -370,7 +457,7 @@ class TaskInvalidHTTPMethodTests(unittest2.TestCase):
 
     @classmethod
     def tearDownClass(self):
-        pass
+        self.foo.close()
 
     def _execute_method(self, method_name, path, http_code):
         """Helper function that will execute a method, against a path and
@@ -0,0 +1,95 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+import unittest2
+
+from opencenter.webapp.transactions import TransactionLog
+
+
+class TransactionLogTests(unittest2.TestCase):
+    def setUp(self):
+        self.log = TransactionLog(max_age=300)
+        self.log.add_model('nodes')
+        self.log.add_model('facts')
+
+    def test_txids_increase_across_models(self):
+        start = self.log.issue()
+        a = self.log.record('nodes', [1])
+        b = self.log.record('facts', [2])
+        self.assertTrue(start < a < b)
+
+    def test_ids_since(self):
+        self.log.record('nodes', [1])
+        txid = self.log.issue()
+        self.log.record('nodes', [2, 3])
+        self.log.record('facts', [4])
+
+        self.assertEquals(self.log.ids_since('nodes', txid), set([2, 3]))
+        self.assertEquals(self.log.ids_since('facts', txid), set([4]))
+        self.assertEquals(self.log.ids_since('nodes', self.log.issue()),
+                          set())
+
+    def test_unissued_changes_are_merged(self):
+        txid = self.log.issue()
+        for x in range(100):
+            self.log.record('nodes', [x])
+
+        self.assertEquals(len(self.log['nodes']), 1)
+        self.assertEquals(self.log.ids_since('nodes', txid), set(range(100)))
+
+    def test_issued_changes_are_not_merged(self):
+        self.log.record('nodes', [1])
+        txid = self.log.issue()
+        self.log.record('nodes', [2])
+
+        self.assertEquals(len(self.log['nodes']), 2)
+        self.assertEquals(self.log.ids_since('nodes', txid), set([2]))
+
+    def test_old_changes_are_pruned(self):
+        self.log.record('nodes', [1], when=1000)
+        old_txid = self.log.issue()
+        self.log.record('nodes', [2], when=1100)
+        txid = self.log.issue()
+        self.log.record('nodes', [3], when=1401)
+
+        # [1] and [2] have aged out
+        self.assertEquals(len(self.log['nodes']), 1)
+        self.assertIsNone(self.log.ids_since('nodes', old_txid))
+        self.assertEquals(self.log.ids_since('nodes', txid), set([3]))
+
+    def test_pruned_entries_are_released(self):
+        for x in range(1000):
+            self.log.record('nodes', [x], when=x)
+            self.log.issue()
+
+        # only the last max_age seconds are left, and the dead
+        # prefix of the lists has been compacted away
+        self.assertEquals(len(self.log['nodes']), 301)
+        self.assertTrue(len(self.log['nodes'].seqs) < 1000)
+
+    def test_unknown_txids(self):
+        self.assertIsNone(self.log.ids_since('nodes', 0))
+        self.assertIsNone(self.log.ids_since('nodes',
+                                             self.log.issue() + 1))
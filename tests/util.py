@@ -22,16 +22,138 @@
 # under the License.
 #
 ##############################################################################
+import functools
 import json
 import random
 import string
 import unittest2
 import logging
 
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
 from opencenter import webapp
+from opencenter.db import api as db_api
+from opencenter.db import database
+from opencenter.db.api import api_from_models
 from opencenter.db.database import init_db, _memorydb_migrate_db
 
 
+# QueryCounters counting right now, innermost last
+_counting = []
+
+
+def _count_statement(conn, cursor, statement, parameters, *args):
+    for counter in _counting:
+        counter.statements.append((statement, parameters))
+
+
+event.listen(Engine, 'before_cursor_execute', _count_statement)
+
+
+class QueryCounter(object):
+    """
+    Count the sql statements and db api calls made inside a with
+    block.  The api cache is dropped on the way in, so counts don't
+    depend on what ran before.
+
+        with QueryCounter() as counter:
+            self.client.get('/nodes/1')
+        print len(counter.statements), len(counter.api_calls)
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.api_calls = []
+        self._call_model = None
+
+    def __enter__(self):
+        api_from_models().destroy_cache()
+        database.session.commit()
+
+        self._call_model = db_api.OpenCenterApi._call_model
+        call_model = self._call_model
+        counter = self
+
+        def counted(api, function, model, *args, **kwargs):
+            counter.api_calls.append((function, model))
+            return call_model(api, function, model, *args, **kwargs)
+
+        db_api.OpenCenterApi._call_model = counted
+        _counting.append(self)
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, exc_tb=None):
+        _counting.remove(self)
+        db_api.OpenCenterApi._call_model = self._call_model
+
+    def repeated(self, threshold=2):
+        """
+        Statements run at least threshold times, with their counts,
+        most repeated first.  The same query over and over, with only
+        its parameters changing, is usually an N+1.
+        """
+        counts = {}
+        for statement, parameters in self.statements:
+            counts[statement] = counts.get(statement, 0) + 1
+
+        return sorted([(count, statement) for statement, count
+                       in counts.items() if count >= threshold],
+                      reverse=True)
+
+    def report(self):
+        lines = ['%d statements, %d api calls' % (len(self.statements),
+                                                  len(self.api_calls))]
+        for count, statement in self.repeated():
+            lines.append('  %dx %s' % (count, ' '.join(statement.split())))
+        return '\n'.join(lines)
+
+
+class QueryBudget(QueryCounter):
+    """
+    A QueryCounter that fails the test if the block runs more than
+    statements sql statements, makes more than api_calls db api
+    calls, or runs any one statement more than repeats times.  None
+    means no limit.  The failure shows the repeated statements.
+    """
+
+    def __init__(self, test, statements=None, api_calls=None, repeats=None):
+        super(QueryBudget, self).__init__()
+        self.test = test
+        self.budget = {'statements': statements,
+                       'api_calls': api_calls,
+                       'repeats': repeats}
+
+    def __exit__(self, exc_type=None, exc_value=None, exc_tb=None):
+        super(QueryBudget, self).__exit__(exc_type, exc_value, exc_tb)
+        if exc_type is not None:
+            return
+
+        used = {'statements': len(self.statements),
+                'api_calls': len(self.api_calls),
+                'repeats': max([0] + [x[0] for x in self.repeated(1)])}
+
+        over = ['%s: %d, budget %d' % (k, used[k], v)
+                for k, v in sorted(self.budget.items())
+                if v is not None and used[k] > v]
+        if over:
+            self.test.fail('over query budget (%s)\n%s' % (
+                '; '.join(over), self.report()))
+
+
+def query_budget(statements=None, api_calls=None, repeats=None):
+    """
+    Decorate a test method to run it under a QueryBudget.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(self, *args, **kwargs):
+            with QueryBudget(self, statements, api_calls, repeats):
+                return f(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 class OpenCenterTestCase(unittest2.TestCase):
     @classmethod
     def setUpClass(cls, *args, **kwargs):
@@ -47,16 +169,26 @@ class OpenCenterTestCase(unittest2.TestCase):
 
     @classmethod
     def tearDownClass(cls):
-        pass
+        cls.app.close()
 
     def __init__(self, *args, **kwargs):
         super(OpenCenterTestCase, self).__init__(*args, **kwargs)
 
+    def assertQueryBudget(self, statements=None, api_calls=None,
+                          repeats=None):
+        """
+        with self.assertQueryBudget(statements=10):
+            ...
+        """
+        return QueryBudget(self, statements, api_calls, repeats)
+
     def _clean_all(self):
         for what in ['tasks', 'nodes', 'facts', 'filters',
                      'attrs', 'adventures']:
             self._clean_table(what)
 
+        api_from_models()._model_delete_by_query('archives', 'id > 0')
+
     def _clean_table(self, what):
         all_results = self._model_get_all(what)
         for what_id in [x['id'] for x in all_results]:
@@ -312,7 +444,7 @@ class ScaffoldedTestCase(OpenCenterTestCase):
 
     @classmethod
     def tearDownClass(cls):
-        pass
+        cls.app.close()
 
     def __init__(self, *args, **kwargs):
         super(ScaffoldedTestCase, self).__init__(*args, **kwargs)
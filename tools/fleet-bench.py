@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+#               OpenCenter(TM) is Copyright 2013 by Rackspace US, Inc.
+##############################################################################
+#
+# OpenCenter is licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.  This
+# version of OpenCenter includes Rackspace trademarks and logos, and in
+# accordance with Section 6 of the License, the provision of commercial
+# support services in conjunction with a version of OpenCenter which includes
+# Rackspace trademarks and logos is prohibited.  OpenCenter source code and
+# details are available at: # https://github.com/rcbops/opencenter or upon
+# written request.
+#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0 and a copy, including this
+# notice, is available in the LICENSE file accompanying this software.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the # specific language governing permissions and limitations
+# under the License.
+#
+##############################################################################
+
+"""
+Simulate a fleet of agents against an opencenter server.
+
+Each simulated agent is a greenlet that registers with whoami,
+uploads a few facts, then long-polls tasks_blocking and reports a
+result for every task it is handed.  A driver greenlet queues tasks
+for random agents at a fixed rate.
+
+The server runs in this process, either called directly through the
+WSGI test client (the default) or served over a local socket.  At the
+end, a JSON report gives throughput, per-endpoint latency
+percentiles, database statement counts and memory use.  Pass an
+earlier report with --compare to see what changed.
+
+With --boot-storm, every agent registers at the same moment and then
+stops, as when a rack of hosts powers on together.  The run ends when
+the last one is registered.
+
+    tools/fleet-bench.py --agents 1000 --duration 60 --output run.json
+    tools/fleet-bench.py --agents 1000 --socket --compare run.json
+    tools/fleet-bench.py --agents 500 --boot-storm
+"""
+
+import functools
+import json
+import optparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import gevent
+import gevent.event
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# imports from the tree, not an installed copy
+from sqlalchemy import event  # noqa
+
+from opencenter import webapp  # noqa
+from opencenter.db import database  # noqa
+from opencenter.db.database import init_db  # noqa
+
+
+class Stats(object):
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.statements = 0
+        self.tasks_created = 0
+        self.tasks_completed = 0
+        self.registered = 0
+
+    def record(self, endpoint, elapsed, status):
+        self.latencies.setdefault(endpoint, []).append(elapsed)
+        if status >= 500 or status in (400, 401, 405):
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def count_statement(self, *args):
+        self.statements += 1
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+class InProcessClient(object):
+    """calls the app through the WSGI test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        kwargs = {}
+        if body is not None:
+            kwargs = {'content_type': 'application/json',
+                      'data': json.dumps(body)}
+        resp = self.client.open(path, method=method, **kwargs)
+        return resp.status_code, resp.data
+
+
+class SocketClient(object):
+    """one keep-alive http connection per agent"""
+
+    def __init__(self, port):
+        import httplib
+        self.connection = httplib.HTTPConnection('127.0.0.1', port,
+                                                 timeout=60)
+
+    def request(self, method, path, body=None):
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.connection.request(method, path, body, headers)
+        resp = self.connection.getresponse()
+        return resp.status, resp.read()
+
+
+def timed(stats, endpoint, client, method, path, body=None):
+    start = time.time()
+    status, data = client.request(method, path, body)
+    stats.record(endpoint, time.time() - start, status)
+
+    try:
+        return status, json.loads(data)
+    except ValueError:
+        return status, None
+
+
+def agent(number, make_client, stats, nodes, stop, register_only=False):
+    client = make_client()
+    hostname = 'bench-agent-%d' % number
+
+    status, out = timed(stats, 'whoami', client, 'POST', '/nodes/whoami',
+                        {'hostname': hostname})
+    if status != 200:
+        return
+    node_id = out['node_id']
+    status, _ = timed(stats, 'whoami', client, 'POST', '/nodes/whoami',
+                      {'node_id': node_id})
+    if register_only:
+        if status == 200:
+            nodes.append(node_id)
+        return
+
+    facts = {'hostname': hostname,
+             'ipaddress': '10.%d.%d.%d' % (number >> 16 & 255,
+                                           number >> 8 & 255, number & 255),
+             'memory': random.choice([4096, 8192, 16384]),
+             'opencenter_agent_actions': ['install_chef', 'run_chef']}
+    # /admin/facts stores facts as given; /facts runs the solver
+    for key, value in facts.items():
+        timed(stats, 'facts', client, 'POST', '/admin/facts/',
+              {'node_id': node_id, 'key': key, 'value': value})
+
+    nodes.append(node_id)
+
+    while not stop.is_set():
+        status, out = timed(stats, 'tasks_blocking', client, 'GET',
+                            '/nodes/%d/tasks_blocking' % node_id)
+        if status != 200 or stop.is_set():
+            continue
+
+        task = out['task']
+        status, _ = timed(stats, 'task_result', client, 'PUT',
+                          '/tasks/%d' % task['id'],
+                          {'state': 'done',
+                           'result': {'result_code': 0,
+                                      'result_str': 'ok',
+                                      'result_data': {}}})
+        if status == 200:
+            stats.tasks_completed += 1
+
+
+def driver(make_client, stats, nodes, rate, stop):
+    client = make_client()
+    while not stop.is_set():
+        gevent.sleep(1.0 / rate)
+        if not nodes:
+            continue
+
+        status, _ = timed(stats, 'task_create', client, 'POST', '/tasks/',
+                          {'node_id': random.choice(nodes),
+                           'action': 'bench',
+                           'payload': {}})
+        if status == 201:
+            stats.tasks_created += 1
+
+
+def make_app(database_uri):
+    # there's no server agent, so whoami can't find a server id
+    # and complains about it for every registration
+    config = tempfile.NamedTemporaryFile(suffix='.conf')
+    config.write('[main]\ndatabase_uri = %s\nloglevel = ERROR\n'
+                 '[logging]\nopencenter.webapp.nodes.whoami = CRITICAL\n' %
+                 database_uri)
+    config.flush()
+
+    app = webapp.WebServer('opencenter', configfile=config.name)
+    init_db(app.config['database_uri'], migrate=False)
+    config.close()
+    return app
+
+
+def report(options, stats, elapsed, rss_start):
+    endpoints = {}
+    total = 0
+    for endpoint, values in sorted(stats.latencies.items()):
+        total += len(values)
+        endpoints[endpoint] = {
+            'count': len(values),
+            'errors': stats.errors.get(endpoint, 0),
+            'mean': sum(values) / len(values),
+            'p50': percentile(values, 0.5),
+            'p99': percentile(values, 0.99),
+            'max': max(values)}
+
+    return {'config': {'agents': options.agents,
+                       'boot_storm': options.boot_storm,
+                       'duration': options.duration,
+                       'task_rate': options.task_rate,
+                       'socket': options.socket,
+                       'database_uri': options.database_uri},
+            'elapsed': elapsed,
+            'requests': total,
+            'throughput': total / elapsed,
+            'endpoints': endpoints,
+            'db_statements': stats.statements,
+            'db_statements_per_request': stats.statements / float(
+                max(total, 1)),
+            'registered': stats.registered,
+            'tasks': {'created': stats.tasks_created,
+                      'completed': stats.tasks_completed},
+            'memory': {'maxrss_kb_start': rss_start,
+                       'maxrss_kb_end': resource.getrusage(
+                           resource.RUSAGE_SELF).ru_maxrss}}
+
+
+def compare(old, new):
+    def line(name, before, after):
+        if before is None or after is None:
+            return
+        change = ''
+        if before:
+            change = ' (%+.1f%%)' % ((after - before) * 100.0 / before)
+        print '%-40s %12.4f %12.4f%s' % (name, before, after, change)
+
+    print '%-40s %12s %12s' % ('', 'before', 'after')
+    line('throughput', old['throughput'], new['throughput'])
+    line('db_statements_per_request', old['db_statements_per_request'],
+         new['db_statements_per_request'])
+    line('maxrss_kb_end', old['memory']['maxrss_kb_end'],
+         new['memory']['maxrss_kb_end'])
+    for endpoint in sorted(new['endpoints']):
+        if not endpoint in old['endpoints']:
+            continue
+        for stat in ('p50', 'p99'):
+            line('%s %s' % (endpoint, stat),
+                 old['endpoints'][endpoint][stat],
+                 new['endpoints'][endpoint][stat])
+
+
+def finish(options, result):
+    output = json.dumps(result, indent=4, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+    if options.compare:
+        with open(options.compare) as f:
+            compare(json.load(f), result)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--agents', type='int', default=1000,
+                      help='number of simulated agents')
+    parser.add_option('-t', '--duration', type='float', default=30,
+                      help='seconds to run after the agents start')
+    parser.add_option('-r', '--task-rate', type='float', default=50,
+                      help='tasks queued per second')
+    parser.add_option('--ramp', type='float', default=5,
+                      help='seconds over which the agents start')
+    parser.add_option('--boot-storm', action='store_true', default=False,
+                      help='register every agent at once, then stop')
+    parser.add_option('--socket', action='store_true', default=False,
+                      help='serve over a local socket, not in-process')
+    parser.add_option('--database-uri', default='sqlite:///',
+                      help='database to run against')
+    parser.add_option('-o', '--output', help='write the report here')
+    parser.add_option('--compare', help='an earlier report to compare to')
+    options, args = parser.parse_args()
+
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    app = make_app(options.database_uri)
+    stats = Stats()
+    event.listen(database.engine, 'before_cursor_execute',
+                 stats.count_statement)
+    app.start_workers()
+
+    if options.socket:
+        from gevent import monkey
+        from gevent.pywsgi import WSGIServer
+        monkey.patch_socket()
+
+        server = WSGIServer(('127.0.0.1', 0), app, log=None)
+        server.start()
+        port = server.server_port
+        make_client = functools.partial(SocketClient, port)
+    else:
+        make_client = functools.partial(InProcessClient, app)
+
+    nodes = []
+    stop = gevent.event.Event()
+    greenlets = []
+
+    start = time.time()
+    if options.boot_storm:
+        gevent.joinall([gevent.spawn(agent, number, make_client, stats,
+                                     nodes, stop, True)
+                        for number in range(options.agents)])
+        elapsed = time.time() - start
+        stats.registered = len(nodes)
+        finish(options, report(options, stats, elapsed, rss_start))
+        return
+
+    for number in range(options.agents):
+        greenlets.append(gevent.spawn_later(
+            options.ramp * number / options.agents,
+            agent, number, make_client, stats, nodes, stop))
+    greenlets.append(gevent.spawn(driver, make_client, stats, nodes,
+                                  options.task_rate, stop))
+
+    gevent.sleep(options.ramp + options.duration)
+    stop.set()
+    elapsed = time.time() - start
+
+    # agents parked in a long poll won't notice the stop for up to
+    # 30 seconds
+    gevent.killall(greenlets, timeout=5)
+
+    stats.registered = len(nodes)
+    finish(options, report(options, stats, elapsed, rss_start))
+
+
+if __name__ == '__main__':
+    main()